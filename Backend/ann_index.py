@@ -0,0 +1,172 @@
+"""
+Approximate nearest-neighbour index (IVF-flat) for institution-wide attendance.
+
+When an attendance video comes without a classId every probe face is compared with every
+registered reference embedding. IVFFlatIndex clusters the L2-normalized references with spherical
+k-means into ~4*sqrt(N) inverted lists; a probe is only compared with the members of the
+ANN_NPROBE lists whose centroids are closest to it. The nearest reference row (and so the nearest
+student) is returned with its cosine distance, exactly like Gallery.match when the true neighbour
+is inside the probed lists.
+
+The index is persisted next to the data files (data/ann_index.npz) together with the student id
+of every row. When students are appended the saved index is reused and only the new rows are
+assigned to their nearest list; it is retrained once it has grown ANN_RETRAIN_GROWTH times past
+the size it was trained on. If faiss is installed, searches run through faiss.IndexIVFFlat built
+on the same centroids (same results, faster scans); the NumPy search is the fallback.
+"""
+import os
+
+import numpy as np
+
+try:
+    import faiss # optional accelerator
+except ImportError:
+    faiss = None
+
+ANN_MIN_REFS = int(os.environ.get("ANN_MIN_REFS", 2000)) # Smaller galleries use exact search
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", 8)) # Lists scanned per probe
+ANN_RETRAIN_GROWTH = 2.0
+KMEANS_ITERS = 10
+_FORMAT_VERSION = 1
+
+
+def _normalize(m):
+    m = np.asarray(m, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    return np.divide(m, norms, out=np.zeros_like(m), where=norms >= 1e-10)
+
+
+def default_nlist(n):
+    return max(1, min(n, int(4 * np.sqrt(n))))
+
+
+def spherical_kmeans(x, nlist, iters=KMEANS_ITERS, seed=0):
+    """Centroids (nlist, d) of unit vectors x, by cosine similarity."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = (x @ centroids.T).argmax(axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any(): # re-seed empty lists with random points
+            sums[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFFlatIndex:
+    def __init__(self, centroids, vectors, assign, nprobe=ANN_NPROBE, trained_size=None):
+        self.centroids = centroids
+        self.vectors = vectors # (N, d) float32, unit rows
+        self.assign = assign # list id per row
+        self.nprobe = nprobe
+        self.trained_size = trained_size or len(vectors)
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+        self._members = [order[bounds[l]:bounds[l + 1]] for l in range(len(centroids))]
+        self._faiss = None
+
+    @classmethod
+    def train(cls, vectors, nlist=None, nprobe=ANN_NPROBE):
+        x = _normalize(vectors)
+        centroids = spherical_kmeans(x, nlist or default_nlist(len(x)))
+        return cls(centroids, x, (x @ centroids.T).argmax(axis=1), nprobe)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def extended(self, vectors):
+        """New index with rows appended to their nearest existing list (no retraining)."""
+        x = _normalize(vectors)
+        return IVFFlatIndex(self.centroids, np.vstack([self.vectors, x]),
+                            np.concatenate([self.assign, (x @ self.centroids.T).argmax(axis=1)]),
+                            self.nprobe, self.trained_size)
+
+    def needs_retrain(self):
+        return len(self) > ANN_RETRAIN_GROWTH * self.trained_size
+
+    def search(self, probes, nprobe=None):
+        """Nearest row per probe: (rows (P,), cosine distances (P,)); row -1 if nothing scanned."""
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        p = _normalize(probes)
+        if faiss is not None:
+            return self._faiss_search(p, nprobe)
+        n = len(p)
+        best_sim = np.full(n, -np.inf, dtype=np.float32)
+        best_row = np.full(n, -1, dtype=np.int64)
+        top = np.argpartition(-(p @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        # (probe, list) pairs grouped by list: one small matmul per visited list
+        pairs_probe = np.repeat(np.arange(n), nprobe)
+        pairs_list = top.ravel()
+        order = np.argsort(pairs_list, kind="stable")
+        pairs_probe, pairs_list = pairs_probe[order], pairs_list[order]
+        starts = np.flatnonzero(np.r_[True, pairs_list[1:] != pairs_list[:-1]])
+        for s, e in zip(starts, np.r_[starts[1:], len(pairs_list)]):
+            members = self._members[pairs_list[s]]
+            if not len(members):
+                continue
+            q = pairs_probe[s:e]
+            sims = p[q] @ self.vectors[members].T
+            j = sims.argmax(axis=1)
+            sim = sims[np.arange(len(q)), j]
+            better = sim > best_sim[q]
+            best_sim[q[better]] = sim[better]
+            best_row[q[better]] = members[j[better]]
+        return best_row, np.where(best_row >= 0, 1.0 - best_sim, np.inf).astype(np.float64)
+
+    def _faiss_search(self, p, nprobe):
+        if self._faiss is None:
+            d = self.vectors.shape[1]
+            quantizer = faiss.IndexFlatIP(d)
+            quantizer.add(self.centroids)
+            index = faiss.IndexIVFFlat(quantizer, d, len(self.centroids), faiss.METRIC_INNER_PRODUCT)
+            index.is_trained = True # our centroids, so faiss assigns rows exactly like assign
+            index.add(self.vectors)
+            self._faiss = (index, quantizer)
+        index = self._faiss[0]
+        index.nprobe = nprobe
+        sims, rows = index.search(np.ascontiguousarray(p), 1)
+        rows = rows[:, 0].astype(np.int64)
+        return rows, np.where(rows >= 0, 1.0 - sims[:, 0], np.inf).astype(np.float64)
+
+    def save(self, path, keys):
+        tmp = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(tmp, version=_FORMAT_VERSION, centroids=self.centroids, vectors=self.vectors,
+                 assign=self.assign, keys=np.asarray(keys, dtype=str), trained_size=self.trained_size)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """(index, row keys) or (None, None) if missing / unreadable."""
+        try:
+            with np.load(path) as f:
+                if int(f["version"]) != _FORMAT_VERSION:
+                    return None, None
+                index = cls(f["centroids"], f["vectors"], f["assign"], trained_size=int(f["trained_size"]))
+                return index, f["keys"].tolist()
+        except (OSError, KeyError, ValueError):
+            return None, None
+
+
+def load_or_build(vectors, keys, path=None):
+    """
+    Index over vectors (row keys = owning student ids). Reuses the saved index when its rows (keys
+    and vectors) are a prefix of the current ones (students were only appended) and adds the rest;
+    otherwise trains.
+    """
+    keys = list(keys)
+    index, saved_keys = IVFFlatIndex.load(path) if path and os.path.exists(path) else (None, None)
+    if index is not None and (saved_keys != keys[:len(saved_keys)] or index.vectors.shape[1] != vectors.shape[1]
+                              or not np.allclose(index.vectors, _normalize(vectors[:len(saved_keys)]), atol=1e-6)):
+        index = None # rows were removed, reordered or rewritten (e.g. refreshed embeddings)
+    if index is not None and len(saved_keys) < len(keys):
+        index = index.extended(vectors[len(saved_keys):])
+    if index is None or index.needs_retrain():
+        index = IVFFlatIndex.train(vectors)
+    elif len(saved_keys) == len(keys):
+        return index # unchanged on disk
+    if path:
+        index.save(path, keys)
+    return index
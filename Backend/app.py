@@ -4,21 +4,23 @@ Teacher then submits name & roll no per cluster -> save registration.
 """
 import os
 import uuid
-import json
 import re
 from pathlib import Path
 from flask import Flask, request, jsonify, send_file
 from flask_cors import CORS
 
+from attendance_records import compact_session, hydrate_sessions, public_student
+from curation import curate_references
+from embedding_store import pack_student, student_vectors
+from gallery import GalleryCache
+from repository import Repository
+from storage import get_store
+
 app = Flask(__name__)
 CORS(app) # Allow all origins for deployment simplicity
 
 MEDIA_FOLDER = Path(__file__).parent / "uploads"
 DATA_FOLDER = Path(__file__).parent / "data"
-REGISTRATIONS_FILE = DATA_FOLDER / "registrations.json"
-CLASSES_FILE = DATA_FOLDER / "classes.json"
-STUDENTS_FILE = DATA_FOLDER / "students.json"
-ATTENDANCE_FILE = DATA_FOLDER / "attendance.json"
 
 MEDIA_FOLDER.mkdir(exist_ok=True)
 DATA_FOLDER.mkdir(exist_ok=True)
@@ -33,64 +35,47 @@ def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+# Storage backend (storage.py): SQLite WAL by default, STORAGE_BACKEND=json for the plain files
+STORE = get_store()
+# Parsed students / classes / attendance with secondary indexes, reloaded when the store's version changes
+REPO = Repository(STORE)
+
+
 def load_registrations():
-    if not REGISTRATIONS_FILE.exists():
-        return {}
-    try:
-        with open(REGISTRATIONS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return {}
+    return STORE.load_registrations()
 
 
 def save_registrations(data):
-    with open(REGISTRATIONS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    STORE.save_registrations(data)
 
 
-def load_classes():
-    if not CLASSES_FILE.exists():
-        return []
-    try:
-        with open(CLASSES_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+def load_classes(teacher_id=None):
+    return REPO.classes(teacher_id)
 
 
 def save_classes(data):
-    with open(CLASSES_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    STORE.save_classes(data)
 
 
-def load_students():
-    if not STUDENTS_FILE.exists():
-        return []
-    try:
-        with open(STUDENTS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+def load_students(class_id=None):
+    return REPO.students(class_id)
 
 
 def save_students(data):
-    with open(STUDENTS_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    STORE.save_students(data)
 
 
-def load_attendance():
-    if not ATTENDANCE_FILE.exists():
-        return []
-    try:
-        with open(ATTENDANCE_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except Exception:
-        return []
+# Prepared per-class embedding galleries for attendance (rebuilt when students / classes change)
+GALLERY_CACHE = GalleryCache(load_students, lambda: STORE.version("students", "classes"),
+                             ann_index_path=DATA_FOLDER / "ann_index.npz")
+
+
+def load_attendance(class_id=None):
+    return REPO.attendance(class_id)
 
 
 def save_attendance(data):
-    with open(ATTENDANCE_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2)
+    STORE.save_attendance(data)
 
 
 @app.route("/health", methods=["GET"])
@@ -149,8 +134,7 @@ def register_students():
         return jsonify({"error": "classId, video_id, and students (array) required"}), 400
 
     key = f"{class_id}_{video_id}"
-    reg = load_registrations()
-    reg[key] = {
+    STORE.put_registration(key, {
         "classId": class_id,
         "video_id": video_id,
         "students": [
@@ -161,19 +145,17 @@ def register_students():
             }
             for s in students
         ],
-    }
-    save_registrations(reg)
+    })
     return jsonify({"success": True, "message": "Registration saved"})
 
 
 @app.route("/api/registrations/<class_id>/<video_id>", methods=["GET"])
 def get_registrations(class_id, video_id):
     """Get saved name/roll_no for a video."""
-    key = f"{class_id}_{video_id}"
-    reg = load_registrations()
-    if key not in reg:
+    registration = STORE.get_registration(f"{class_id}_{video_id}")
+    if registration is None:
         return jsonify({"students": []})
-    return jsonify({"students": reg[key]["students"]})
+    return jsonify({"students": registration["students"]})
 
 
 @app.route("/api/video/<video_id>", methods=["GET"])
@@ -193,21 +175,13 @@ def get_classes():
     
     print(f"DEBUG: get_classes called with teacherId={teacher_id}, studentId={student_id}")
 
-    all_classes = load_classes()
-    
     if teacher_id:
-        # Filter classes for this teacher
-        user_classes = [c for c in all_classes if c.get("teacherId") == teacher_id]
-        return jsonify(user_classes)
+        # Filter classes for this teacher (indexed on teacherId)
+        return jsonify(load_classes(teacher_id))
         
     if student_id:
-        # Filter classes where student is enrolled
-        all_students = load_students()
-        # Find all classIds for this student roll_no
-        enrolled_class_ids = {s.get("classId") for s in all_students if s.get("roll_no") == student_id}
-        
-        student_classes = [c for c in all_classes if c.get("id") in enrolled_class_ids]
-        return jsonify(student_classes)
+        # roll_no -> classIds -> classes, both from the repository's indexes
+        return jsonify(REPO.classes_for_roll_no(student_id))
 
     # STRICT ISOLATION: If no ID provided, return nothing.
     # This prevents users from seeing all data if they bypass the frontend filters.
@@ -229,41 +203,51 @@ def add_class():
     if not name or not code or not time_schedule or not teacher_id:
         return jsonify({"error": "name, code, time, and teacherId are required"}), 400
 
-    classes = load_classes()
-    new_id = f"C{len(classes) + 201}" # Start from 201 to avoid conflict with mock data C101-C103
-    
-    # Check if ID exists (edge case with deletions, but simple for now)
-    while any(c["id"] == new_id for c in classes):
-         new_id = f"C{int(new_id[1:]) + 1}"
-
+    # The store assigns the id (C201, C202, ... - mock data uses C101-C103) in the same transaction
     new_class = {
-        "id": new_id,
         "name": f"{code}: {name}", # Format to match mock data expectation
         "time": time_schedule,
         "teacherId": teacher_id,
         "students": 0, # Default
         "image": image
     }
-    
-    classes.append(new_class)
-    save_classes(classes)
+    new_class = STORE.insert_class(new_class)
     
     return jsonify(new_class), 201
 
 
 @app.route("/api/classes/<class_id>", methods=["DELETE"])
 def delete_class(class_id):
-    classes = load_classes()
-    # Filter out the class
-    new_classes = [c for c in classes if c.get("id") != class_id]
-    
-    if len(new_classes) == len(classes):
+    stamp_before = GALLERY_CACHE.stamp()
+    if not STORE.delete_class(class_id):
         return jsonify({"error": "Class not found"}), 404
         
-    save_classes(new_classes)
+    GALLERY_CACHE.class_removed(class_id, stamp_before)
     return jsonify({"success": True, "message": "Class deleted"})
 
 
+def refresh_student_embeddings(known_students):
+    """
+    Fold the embeddings of re-recorded students (pipeline known_students entries) into their stored
+    references. The entries' embeddings are consumed, so they are not sent back to the client.
+    """
+    updated = {}
+    for entry in known_students:
+        new = entry.pop("embeddings_list", None)
+        student = REPO.student(entry["student_id"])
+        if not new or student is None:
+            continue
+        old = student_vectors(student)[1].tolist()
+        pool = [e for e in old if len(e) == len(new[0])] + new # references from an older model are replaced
+        centroid, refs = curate_references(pool)
+        student = pack_student({**student, "embedding": centroid, "embeddings_list": refs})
+        updated[student["id"]] = student
+        entry["embeddings_refreshed"] = True
+    if updated:
+        STORE.update_students(list(updated.values())) # only the changed rows
+        GALLERY_CACHE.students_updated()
+
+
 @app.route("/api/process-register-video", methods=["POST"])
 def process_register_video():
     """Upload video -> Extract Faces -> Return Clusters for user to label."""
@@ -282,13 +266,20 @@ def process_register_video():
     save_path = os.path.join(app.config["UPLOAD_FOLDER"], unique_name)
     file.save(save_path)
 
+    # With a classId, faces of students already registered in the class are recognised and
+    # only new clusters come back for labeling
+    class_id = request.form.get("classId")
+
     try:
         from pipeline import run_pipeline
         # Output to temp dir
         output_base = Path(app.config["UPLOAD_FOLDER"]).parent / "temp"
         output_base.mkdir(exist_ok=True)
         
-        result = run_pipeline(save_path, str(output_base), use_deepface=True)
+        gallery = GALLERY_CACHE.get(class_id) if class_id else None
+        result = run_pipeline(save_path, str(output_base), use_deepface=True, gallery=gallery)
+        if result.get("known_students"):
+            refresh_student_embeddings(result["known_students"])
         result["video_id"] = unique_name
          # Clean up video? Keep for now?
         return jsonify(result)
@@ -312,14 +303,8 @@ def add_student():
     if not data.get("name") or not data.get("roll_no"):
         return jsonify({"error": "Name and Roll No required"}), 400
 
-    students = load_students()
-    
-    # Check duplicate roll no IN THE SAME CLASS
-    target_class = data.get("classId")
-    if any(s["roll_no"] == data["roll_no"] and s.get("classId") == target_class for s in students):
-        return jsonify({"error": "Student with this Roll No already exists in this class"}), 409
-
-    new_student = {
+    stamp_before = GALLERY_CACHE.stamp()
+    new_student = pack_student({
         "id": str(uuid.uuid4()),
         "name": data["name"],
         "roll_no": data["roll_no"],
@@ -328,10 +313,12 @@ def add_student():
         "embeddings_list": data.get("embeddings_list", []), # Multiple reference embeddings for better matching
         "face_base64": data.get("face_base64"), # Thumbnail
         "registered_at": "2023-10-27" # Mock date or current
-    }
+    }) # Embeddings go to the binary embedding store; the record keeps a reference
     
-    students.append(new_student)
-    save_students(students)
+    # Duplicate roll no IN THE SAME CLASS is checked atomically with the insert
+    if not STORE.insert_student(new_student):
+        return jsonify({"error": "Student with this Roll No already exists in this class"}), 409
+    GALLERY_CACHE.student_added(new_student, stamp_before)
     
     return jsonify(new_student), 201
 
@@ -348,28 +335,26 @@ def process_attendance_video():
     file.save(save_path)
 
     try:
-        from pipeline import recognize_faces_in_video
+        from pipeline import ATTENDANCE_EARLY_EXIT, recognize_faces_in_video
         output_base = Path(app.config["UPLOAD_FOLDER"]).parent / "temp"
         
-        # Load all students (or filter by classId if passed in form data)
-        students = load_students()
-        
-        # FILTER BY CLASS ID
+        # Prepared gallery of the class (or ALL students if no classId), cached across requests
         class_id = request.form.get("classId")
         if class_id:
             print(f"DEBUG: Filtering attendance for class {class_id}")
-            students = [s for s in students if s.get("classId") == class_id]
         else:
             print("WARNING: No classId provided for attendance. Using ALL students.")
+        gallery = GALLERY_CACHE.get(class_id)
 
-        result = recognize_faces_in_video(save_path, students, str(output_base))
+        # Stop once the class is fully resolved / no new faces appear (form earlyExit=0|1 overrides the default)
+        early_exit = request.form.get("earlyExit", "1" if ATTENDANCE_EARLY_EXIT else "0") != "0"
+        result = recognize_faces_in_video(save_path, gallery, str(output_base), early_exit=early_exit)
         
-        # Hydrate student details
-        present_details = []
-        for sid in result["present_student_ids"]:
-            stu = next((s for s in students if s["id"] == sid), None)
-            if stu:
-                present_details.append(stu)
+        # Hydrate student details (without embeddings) plus their match scores
+        by_id = {s["id"]: s for s in gallery.students}
+        present_details = [{**public_student(by_id[sid]), "votes": result["vote_counts"][sid],
+                            "distance": result["avg_distances"][sid]}
+                           for sid in result["present_student_ids"] if sid in by_id]
         
         result["present_students"] = present_details
         return jsonify(result)
@@ -381,50 +366,35 @@ def process_attendance_video():
 def save_attendance_record():
     """Save the final attendance list."""
     data = request.get_json()
-    records = load_attendance()
     
-    # Ensure ID
-    if "id" not in data:
-        data["id"] = str(uuid.uuid4())
-        
-    records.append(data)
-    save_attendance(records)
-    return jsonify({"success": True, "record": data}), 201
+    # Server-side id, like students: a client-sent id could collide with a stored session
+    data["id"] = str(uuid.uuid4())
+
+    # Stored by reference: student ids + scores, thumbnails in the blob store. Bare ids must be
+    # students enrolled in the session's class.
+    bare_ids = [e for e in data.get("present_students") or [] if isinstance(e, str)]
+    enrolled = {}
+    if bare_ids:
+        class_id = data.get("classId")
+        enrolled = {s["id"]: s for s in load_students(class_id)} if class_id else {}
+        unknown = [sid for sid in bare_ids if sid not in enrolled]
+        if unknown:
+            return jsonify({"error": f"Students not enrolled in this class: {', '.join(unknown)}"}), 400
+    record = compact_session(data, students_by_id=enrolled)
+    STORE.insert_attendance(record) # one row, independent of how much history there is
+    return jsonify({"success": True, "record": record}), 201
 
 
 @app.route("/api/attendance/<class_id>", methods=["GET"])
 def get_class_attendance(class_id):
     student_id = request.args.get("studentId")
-    all_records = load_attendance()
-    
-    # Filter by class
-    class_records = [r for r in all_records if r.get("classId") == class_id]
-    
-    if student_id:
-        # For a student, we want to see sessions where they were present OR absent?
-        # Typically students want to see their attendance log.
-        # The records structure is a list of sessions, each having "present_students".
-        # We should probably return the sessions, but maybe mark if they were present?
-        # Or just return sessions where they were present?
-        # User said "show their validation report for each day".
-        # Let's return all sessions for the class, but the frontend will check if they are in 'present_students'.
-        # Actually, simpler: return all class records. The frontend can check if the student is in the list.
-        # BUT for privacy, maybe we shouldn't send the full list of other students?
-        # Let's filter the "present_students" list in each record to only include THIS student if present.
-        
-        filtered_records = []
-        for record in class_records:
-            # Create a copy to not mutate original
-            new_record = record.copy()
-            # Filter present_students to just this student
-            new_record["present_students"] = [
-                s for s in record.get("present_students", []) 
-                if s.get("roll_no") == student_id
-            ]
-            filtered_records.append(new_record)
-        return jsonify(filtered_records)
+    # Filter by class (indexed)
+    class_records = load_attendance(class_id)
 
-    return jsonify(class_records)
+    # Sessions hold student references; present_students is rebuilt with thumbnails from the blob
+    # store. For a student (studentId = roll no) every class session is returned, but for privacy
+    # present_students only keeps THIS student's entry - empty means absent.
+    return jsonify(hydrate_sessions(class_records, roll_no=student_id or None))
 
 
 @app.route("/api/attendance/export/<class_id>", methods=["GET"])
@@ -437,8 +407,7 @@ def export_attendance(class_id):
         from openpyxl.drawing.image import Image as ExcelImage
         from openpyxl.utils import get_column_letter
 
-        all_records = load_attendance()
-        class_sessions = [r for r in all_records if r.get("classId") == class_id]
+        class_sessions = hydrate_sessions(load_attendance(class_id)) # thumbnails from the blob store
         
         if not class_sessions:
             return jsonify({"error": "No attendance data found for this class"}), 404
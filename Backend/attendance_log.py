@@ -0,0 +1,282 @@
+"""
+Append-only, segmented log of attendance sessions with a per-class offset index.
+
+Attendance history only grows and is read one class at a time, so sessions are appended to JSONL
+segments and every class gets its own index file of fixed-size entries pointing into them:
+
+    data/attendance_log/            (ATTENDANCE_LOG_DIR)
+        CURRENT                     name of the live generation directory
+        lock                        flock'ed by writers (appends, compaction)
+        publish.lock                held by an append from its state write to its index write
+        gen-000001/
+            state                   next sequence number, active segment, segments at creation
+            seg-000001.jsonl        one session per line; a new segment starts past ATTENDANCE_SEGMENT_BYTES
+            index/c-<class>.idx     per session of the class: seq, segment, offset, length (24 bytes)
+
+An append writes one line and one index entry (O(1), whatever the history size). A class query
+reads its index file and seeks to its own records (O(sessions in the class), however many
+classes there are); a full listing merges all index files by sequence number. An append writes
+the record, then the state (taking its sequence number), then the index entry: readers never see
+a partial session, a crash never leaves an entry whose sequence number is handed out again, and
+a torn line or entry is skipped by the next append. version() waits for an append's state and
+index writes, so a cache never pairs the new version with the old index.
+
+Compaction rewrites the log into a new generation with each class's sessions stored contiguously
+(same sequence numbers, so listing order is unchanged) and without bytes no index points at. It
+runs in a background thread once ATTENDANCE_COMPACT_SEGMENTS segments were appended since the
+last one, or by hand:
+
+    python attendance_log.py compact
+
+The previous generation is kept until the next compaction, so in-flight readers can finish.
+"""
+import json
+import os
+import shutil
+import struct
+import sys
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from urllib.parse import quote
+
+try:
+    import fcntl
+except ImportError: # Windows: writers are only serialized within this process
+    fcntl = None
+
+DATA_FOLDER = Path(__file__).parent / "data"
+ATTENDANCE_LOG_DIR = Path(os.environ.get("ATTENDANCE_LOG_DIR", DATA_FOLDER / "attendance_log"))
+ATTENDANCE_SEGMENT_BYTES = int(os.environ.get("ATTENDANCE_SEGMENT_BYTES", 8 * 1024 * 1024)) # Segment size before rolling over
+ATTENDANCE_COMPACT_SEGMENTS = int(os.environ.get("ATTENDANCE_COMPACT_SEGMENTS", 8)) # New segments that trigger a background compaction
+
+ENTRY = struct.Struct("<QIQI") # seq, segment, offset, length
+STATE = struct.Struct("<QII") # next seq, active segment, segments written by the last compaction
+
+
+def _index_name(class_id):
+    return "none.idx" if class_id is None else f"c-{quote(str(class_id), safe='')}.idx"
+
+
+class AttendanceLog:
+    def __init__(self, folder=ATTENDANCE_LOG_DIR, compact_segments=ATTENDANCE_COMPACT_SEGMENTS):
+        self.folder = Path(folder)
+        self.compact_segments = compact_segments
+        self._thread_lock = threading.Lock()
+        self._compacting = None
+        self.folder.mkdir(parents=True, exist_ok=True)
+
+    def exists(self):
+        return (self.folder / "CURRENT").exists()
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock, open(self.folder / "lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    @contextmanager
+    def _publishing(self, exclusive):
+        with open(self.folder / "publish.lock", "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def _generation(self):
+        with open(self.folder / "CURRENT", "r", encoding="ascii") as f:
+            return self.folder / f.read().strip()
+
+    @staticmethod
+    def _read_state(gen):
+        with open(gen / "state", "rb") as f:
+            return STATE.unpack(f.read(STATE.size))
+
+    @staticmethod
+    def _write_state(gen, *state):
+        with open(gen / "state", "r+b" if (gen / "state").exists() else "wb") as f:
+            f.write(STATE.pack(*state))
+
+    # Writing
+
+    def append(self, record):
+        """Append one session; returns its sequence number."""
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        with self._locked():
+            gen = self._generation()
+            next_seq, segment, base = self._read_state(gen)
+            seg_path = gen / f"seg-{segment:06d}.jsonl"
+            size = seg_path.stat().st_size if seg_path.exists() else 0
+            if size and size + len(line) > ATTENDANCE_SEGMENT_BYTES:
+                segment, size = segment + 1, 0
+                seg_path = gen / f"seg-{segment:06d}.jsonl"
+            with open(seg_path, "a+b") as f:
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b"\n": # torn line from a crash: start on a fresh line
+                        f.write(b"\n")
+                        size += 1
+                f.write(line)
+            with self._publishing(exclusive=True):
+                self._write_state(gen, next_seq + 1, segment, base)
+                with open(gen / "index" / _index_name(record.get("classId")), "a+b") as f:
+                    idx_size = f.seek(0, os.SEEK_END)
+                    if idx_size % ENTRY.size: # torn entry from a crash
+                        f.truncate(idx_size - idx_size % ENTRY.size)
+                    f.write(ENTRY.pack(next_seq, segment, size, len(line) - 1))
+        if segment - base >= self.compact_segments:
+            self.compact_in_background()
+        return next_seq
+
+    def _write_generation(self, items):
+        """New generation from (seq, record) pairs (written in the given order); returns its name."""
+        existing = [int(p.name[4:]) for p in self.folder.glob("gen-*") if p.name[4:].isdigit()]
+        name = f"gen-{max(existing, default=0) + 1:06d}"
+        gen = self.folder / name
+        (gen / "index").mkdir(parents=True)
+        indexes = {}
+        segment, seg_file, size, next_seq = 1, None, 0, 0
+        try:
+            for seq, record in items:
+                line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+                if seg_file is None or (size and size + len(line) > ATTENDANCE_SEGMENT_BYTES):
+                    if seg_file is not None:
+                        seg_file.close()
+                        segment += 1
+                    seg_file, size = open(gen / f"seg-{segment:06d}.jsonl", "wb"), 0
+                seg_file.write(line)
+                indexes.setdefault(_index_name(record.get("classId")), []).append(
+                    ENTRY.pack(seq, segment, size, len(line) - 1))
+                size += len(line)
+                next_seq = max(next_seq, seq + 1)
+        finally:
+            if seg_file is not None:
+                seg_file.close()
+        for index_name, entries in indexes.items():
+            with open(gen / "index" / index_name, "wb") as f:
+                f.write(b"".join(entries))
+        self._write_state(gen, next_seq, segment, segment)
+        return name
+
+    def _switch(self, name):
+        """Point CURRENT at a generation; generations older than the previous one are removed."""
+        previous = self._generation().name if self.exists() else None
+        tmp = self.folder / f"CURRENT.{os.getpid()}.tmp"
+        tmp.write_text(name, encoding="ascii")
+        os.replace(tmp, self.folder / "CURRENT")
+        for gen in self.folder.glob("gen-*"):
+            if gen.name not in (name, previous):
+                shutil.rmtree(gen, ignore_errors=True)
+
+    def replace_all(self, records):
+        """Replace the whole history (imports, migrations) with records in this order."""
+        with self._locked():
+            self._switch(self._write_generation(enumerate(records)))
+
+    def create(self, records):
+        """Initialize an empty log with records, unless another process already did."""
+        with self._locked():
+            if not self.exists():
+                self._switch(self._write_generation(enumerate(records)))
+                return True
+        return False
+
+    def compact(self):
+        """Rewrite the live generation with each class's sessions contiguous; returns (before, after) bytes."""
+        with self._locked():
+            gen = self._generation()
+            before = sum(p.stat().st_size for p in gen.glob("seg-*.jsonl"))
+            by_class = {}
+            for index_path in sorted((gen / "index").glob("*.idx")):
+                by_class[index_path.name] = list(zip(*self._read_index(index_path)))
+            items = [item for entries in by_class.values() for item in self._read_entries(gen, entries, with_seq=True)]
+            name = self._write_generation(items)
+            self._switch(name)
+            after = sum(p.stat().st_size for p in (self.folder / name).glob("seg-*.jsonl"))
+        print(f"DEBUG: attendance log compacted into {name}: {before} -> {after} bytes")
+        return before, after
+
+    def compact_in_background(self):
+        with self._thread_lock:
+            if self._compacting is not None and self._compacting.is_alive():
+                return
+            self._compacting = threading.Thread(target=self._compact_if_due, daemon=True)
+            self._compacting.start()
+
+    def _compact_if_due(self):
+        try:
+            _, segment, base = self._read_state(self._generation())
+            if segment - base >= self.compact_segments: # another worker may have compacted meanwhile
+                self.compact()
+        except Exception as e:
+            print(f"DEBUG: attendance log compaction failed: {e}")
+
+    # Reading
+
+    @staticmethod
+    def _read_index(path):
+        """Parallel lists (seqs, (segment, offset, length)) of an index file."""
+        try:
+            with open(path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return [], []
+        raw = raw[:len(raw) - len(raw) % ENTRY.size]
+        entries = list(ENTRY.iter_unpack(raw))
+        return [e[0] for e in entries], [e[1:] for e in entries]
+
+    @staticmethod
+    def _read_entries(gen, entries, with_seq=False):
+        """Records for (seq, (segment, offset, length)) pairs, in the given order."""
+        out, files = [], {}
+        try:
+            for seq, (segment, offset, length) in entries:
+                f = files.get(segment)
+                if f is None:
+                    f = files[segment] = open(gen / f"seg-{segment:06d}.jsonl", "rb")
+                f.seek(offset)
+                record = json.loads(f.read(length))
+                out.append((seq, record) if with_seq else record)
+        finally:
+            for f in files.values():
+                f.close()
+        return out
+
+    def read(self, class_id=None):
+        """Sessions of a class (all sessions when class_id is None), in append order."""
+        if not self.exists():
+            return []
+        for attempt in range(2):
+            gen = self._generation()
+            try:
+                if class_id is not None:
+                    seqs, pos = self._read_index(gen / "index" / _index_name(class_id))
+                    entries = list(zip(seqs, pos))
+                else:
+                    entries = []
+                    for index_path in (gen / "index").glob("*.idx"):
+                        entries.extend(zip(*self._read_index(index_path)))
+                    entries.sort()
+                return self._read_entries(gen, entries)
+            except FileNotFoundError:
+                if attempt: # generation removed under us twice: give up
+                    raise
+        return []
+
+    def version(self):
+        """(generation, next seq): changes with every append and compaction."""
+        if not self.exists():
+            return None
+        with self._publishing(exclusive=False):
+            gen = self._generation()
+            return gen.name, self._read_state(gen)[0]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "compact":
+        sys.exit("Usage: python attendance_log.py compact")
+    log = AttendanceLog(ATTENDANCE_LOG_DIR)
+    if not log.exists():
+        sys.exit(f"{ATTENDANCE_LOG_DIR} has no attendance log yet")
+    before, after = log.compact()
+    print(f"{ATTENDANCE_LOG_DIR}: {before} -> {after} bytes")
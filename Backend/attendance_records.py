@@ -0,0 +1,128 @@
+"""
+Attendance sessions stored by reference.
+
+The frontend saves a session with present_students = the full student objects it was shown, so
+every session used to copy each present student's embeddings and base64 thumbnail and
+attendance history grew by a gallery per class meeting. compact_session() keeps, per present
+student, only
+
+    {"id", "name", "roll_no", "votes", "distance", "face_ref"}
+
+(name / roll_no as a snapshot of who was marked present, votes / distance the match scores of
+recognize_faces_in_video) under "present", and moves the thumbnail into the content-addressed
+blob store (blob_store.py), where a student's thumbnail is stored once however many sessions
+reference it. hydrate_sessions() turns stored sessions back into the present_students shape the
+API has always returned. Existing sessions are compacted in place with
+
+    python attendance_records.py migrate
+"""
+import base64
+import binascii
+import json
+import sys
+
+from blob_store import get_thumbnail_store
+
+EMBEDDING_FIELDS = ("embedding", "embeddings_list", "embedding_ref")
+ENTRY_FIELDS = ("id", "name", "roll_no", "votes", "distance") # kept per present student
+
+
+def public_student(student):
+    """Copy of a student record without its embeddings (what API responses carry)."""
+    return {k: v for k, v in student.items() if k not in EMBEDDING_FIELDS}
+
+
+def _thumbnail_key(face_base64, blobs):
+    try:
+        data = base64.b64decode(face_base64, validate=True)
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if base64.b64encode(data).decode("ascii") != face_base64:
+        return None # not canonical base64: would not hydrate to the same string, keep it inline
+    return blobs.put(data)
+
+
+def compact_entry(entry, blobs, students_by_id=None):
+    """
+    One present student (full object or bare id) -> compact entry. face_ref is only ever made here
+    from face_base64; a face_ref sent by the client is ignored.
+    """
+    if isinstance(entry, str): # bare student id
+        entry = (students_by_id or {}).get(entry) or {"id": entry}
+    out = {k: entry[k] for k in ENTRY_FIELDS if entry.get(k) is not None}
+    if entry.get("face_base64"):
+        key = _thumbnail_key(entry["face_base64"], blobs)
+        if key:
+            out["face_ref"] = key
+        else:
+            out["face_base64"] = entry["face_base64"]
+    return out
+
+
+def compact_session(session, blobs=None, students_by_id=None):
+    """Copy of a session with present_students replaced by compact "present" entries."""
+    blobs = blobs or get_thumbnail_store()
+    out = {k: v for k, v in session.items() if k not in ("present_students", "present")}
+    out["present"] = [compact_entry(e, blobs, students_by_id) for e in session.get("present_students") or []]
+    return out
+
+
+def hydrate_entries(entries, blobs=None, thumbnails=None):
+    """Compact entries -> student dicts with face_base64 (thumbnails: key -> base64, shared cache)."""
+    blobs = blobs or get_thumbnail_store()
+    thumbnails = {} if thumbnails is None else thumbnails
+    out = []
+    for entry in entries:
+        student = {k: v for k, v in entry.items() if k != "face_ref"}
+        key = entry.get("face_ref")
+        if key:
+            if key not in thumbnails:
+                data = blobs.get(key)
+                thumbnails[key] = base64.b64encode(data).decode("ascii") if data is not None else None
+            student["face_base64"] = thumbnails[key]
+        out.append(student)
+    return out
+
+
+def hydrate_sessions(sessions, roll_no=None, blobs=None):
+    """
+    Stored sessions -> API shape (present_students = student dicts with thumbnails). With roll_no,
+    present_students only keeps that student. Sessions not yet compacted pass through unchanged.
+    """
+    thumbnails = {}
+    out = []
+    for session in sessions:
+        if "present" not in session:
+            hydrated = dict(session)
+            entries = [public_student(e) if isinstance(e, dict) else e for e in session.get("present_students") or []]
+            if roll_no is not None:
+                entries = [e for e in entries if isinstance(e, dict) and e.get("roll_no") == roll_no]
+            hydrated["present_students"] = entries
+            out.append(hydrated)
+            continue
+        entries = session["present"]
+        if roll_no is not None:
+            entries = [e for e in entries if e.get("roll_no") == roll_no]
+        hydrated = {k: v for k, v in session.items() if k != "present"}
+        hydrated["present_students"] = hydrate_entries(entries, blobs, thumbnails)
+        out.append(hydrated)
+    return out
+
+
+def migrate(store, blobs=None):
+    """Compact every stored session (already compact ones are left as they are)."""
+    sessions = store.load_attendance()
+    students_by_id = {s["id"]: s for s in store.load_students()}
+    before = len(json.dumps(sessions))
+    sessions = [s if "present" in s else compact_session(s, blobs, students_by_id) for s in sessions]
+    store.save_attendance(sessions)
+    return len(sessions), before, len(json.dumps(sessions))
+
+
+if __name__ == "__main__":
+    from storage import get_store
+
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("Usage: python attendance_records.py migrate")
+    count, before, after = migrate(get_store())
+    print(f"{count} attendance sessions: {before} -> {after} bytes of records")
@@ -0,0 +1,66 @@
+"""
+Recall vs latency of the IVF-flat ANN index (ann_index.py) against exact search (gallery.Gallery)
+on a synthetic institution: S students x 5 references (128-d) and P probe faces near random
+students (every 5th probe is an unknown face). Recall = share of probes with an exact match under
+the attendance threshold whose ANN nearest student is the same; decisions = share of all probes
+with the same outcome (same student accepted, or rejected by both).
+
+Usage: python bench_ann.py [students] [probes]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import ann_index
+from bench_matcher import synthetic_class
+from gallery import AnnGallery, Gallery
+
+THRESHOLD = 0.40 # pipeline.ATTENDANCE_COSINE_THRESHOLD
+NPROBES = [1, 2, 4, 8, 16, 32]
+
+
+def timed(fn, repeats=3):
+    best, out = float("inf"), None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, out
+
+
+if __name__ == "__main__":
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_probes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    students, probes = synthetic_class(n_students, n_probes, 128)
+    exact = Gallery(students)
+    t_exact, (e_best, e_dist) = timed(lambda: exact.match(probes))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "ann_index.npz")
+        start = time.perf_counter()
+        ann = AnnGallery.from_gallery(exact, path)
+        t_build = time.perf_counter() - start
+        start = time.perf_counter()
+        AnnGallery.from_gallery(exact, path)
+        t_load = time.perf_counter() - start
+
+    index = ann.index
+    print(f"{n_students} students, {exact.n_refs} references, {n_probes} probes; "
+          f"{len(index.centroids)} lists; faiss={'yes' if ann_index.faiss else 'no'}")
+    print(f"index build {t_build * 1000:.0f} ms, reload from disk {t_load * 1000:.0f} ms")
+    e_acc = e_dist < THRESHOLD
+    print(f"{int(e_acc.sum())} probes have an exact match under {THRESHOLD}")
+    print(f"{'search':>10s} {'ms':>8s} {'recall':>7s} {'decisions':>10s}")
+    print(f"{'exact':>10s} {t_exact * 1000:8.1f} {1:7.2%} {1:10.2%}")
+    for nprobe in NPROBES:
+        index.nprobe = nprobe
+        t, (best, dist) = timed(lambda: ann.match(probes))
+        acc = dist < THRESHOLD
+        recall = float((best == e_best)[e_acc].mean())
+        same = float(np.where(e_acc, acc & (best == e_best), ~acc).mean())
+        print(f"{'nprobe ' + str(nprobe):>10s} {t * 1000:8.1f} {recall:7.2%} {same:10.2%}")
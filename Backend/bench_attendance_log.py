@@ -0,0 +1,61 @@
+"""
+Attendance storage benchmark: append latency and one-class query latency as history grows, for the
+append-only attendance log (attendance_log.py), SQLite (SqliteStore) and the JSON file (JsonStore).
+Sessions are the compact by-reference form (attendance_records.py), spread over many classes.
+
+Usage: python bench_attendance_log.py [classes] [students_per_session]
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from attendance_log import AttendanceLog
+from storage import JsonStore, SqliteStore
+
+CHECKPOINTS = (1000, 5000, 20000)
+
+
+def session(class_id, students):
+    return {"id": str(uuid.uuid4()), "classId": class_id, "date": "2026-10-17T10:00:00.000Z", "video_processed": True,
+            "present": [{"id": str(uuid.uuid4()), "name": "Student", "roll_no": f"23XX{i:04d}", "votes": 3,
+                         "distance": 0.21, "face_ref": "0" * 64} for i in range(students)]}
+
+
+class LogBackend:
+    def __init__(self, folder):
+        self.log = AttendanceLog(os.path.join(folder, "log"), compact_segments=10 ** 9)
+        self.log.create([])
+        self.insert_attendance, self.load_attendance = self.log.append, self.log.read
+
+
+def timed(fn, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+if __name__ == "__main__":
+    n_classes = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    students = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    print(f"{n_classes} classes, {students} students per session")
+    print(f"{'backend':>8} {'history':>8} {'append ms':>10} {'class query ms':>15}")
+    for name, make in (("log", LogBackend), ("sqlite", lambda d: SqliteStore(os.path.join(d, "a.db"))),
+                       ("json", JsonStore)):
+        with tempfile.TemporaryDirectory() as folder:
+            store = make(folder)
+            n = 0
+            for target in CHECKPOINTS:
+                if name == "json" and target > CHECKPOINTS[0]:
+                    break # whole-file rewrites: the larger histories take minutes
+                while n < target:
+                    store.insert_attendance(session(f"C{n % n_classes}", students))
+                    n += 1
+                t_append = timed(lambda: store.insert_attendance(session("C0", students)))
+                n += 5
+                t_query = timed(lambda: store.load_attendance("C1"))
+                print(f"{name:>8} {n:>8} {t_append:10.2f} {t_query:15.2f}")
@@ -0,0 +1,72 @@
+"""
+Registration clustering benchmark: sklearn DBSCAN(eps=0.25, min_samples=1, metric="cosine") on all
+embeddings at once vs clustering.OnlineClusterer fed in batches as tracks close. Checks that
+both give identical labels, and reports time and peak memory (tracemalloc) of each.
+
+Usage: python bench_clustering.py [faces] [people] [dim] [batch]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.cluster import DBSCAN
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from clustering import OnlineClusterer
+
+EPS = 0.25 # pipeline.REGISTRATION_CLUSTER_EPS
+
+
+def synthetic_tracks(n_faces, n_people, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_people, dim))
+    owners = rng.integers(0, n_people, n_faces)
+    # Noise tuned so some tracks of one person chain together and some stay apart
+    embs = centers[owners] + rng.normal(0, 0.6, (n_faces, dim))
+    names = [f"track{i}_best.jpg" for i in range(n_faces)] # closing order
+    return names, embs
+
+
+def measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    out = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return out, elapsed, peak
+
+
+def run_dbscan(names, embs):
+    order = sorted(range(len(names)), key=lambda i: names[i]) # run_pipeline sorted file names
+    labels = DBSCAN(eps=EPS, min_samples=1, metric="cosine").fit(embs[order]).labels_.tolist()
+    return [names[i] for i in order], labels
+
+
+def run_online(names, embs, batch):
+    clusterer = OnlineClusterer(EPS)
+    for s in range(0, len(names), batch):
+        clusterer.add(names[s:s + batch], embs[s:s + batch])
+    return clusterer.labels(order=sorted(names))
+
+
+if __name__ == "__main__":
+    n_faces = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    n_people = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    dim = int(sys.argv[3]) if len(sys.argv) > 3 else 128
+    batch = int(sys.argv[4]) if len(sys.argv) > 4 else 32
+    names, embs = synthetic_tracks(n_faces, n_people, dim)
+
+    (_, online_labels), t_online, m_online = measure(lambda: run_online(names, embs, batch))
+    print(f"{n_faces} faces, {n_people} people, {dim}-d, batches of {batch}: {len(set(online_labels))} clusters")
+    print(f"OnlineClusterer {t_online * 1000:9.1f} ms  peak {m_online / 1e6:8.1f} MB")
+    try:
+        (_, db_labels), t_db, m_db = measure(lambda: run_dbscan(names, embs))
+    except MemoryError:
+        print("DBSCAN          out of memory")
+    else:
+        print(f"DBSCAN          {t_db * 1000:9.1f} ms  peak {m_db / 1e6:8.1f} MB")
+        print(f"identical labels: {db_labels == online_labels}")
@@ -0,0 +1,73 @@
+"""
+Reference curation benchmark: recall of attendance matching with the references chosen by each
+curation method (centroid = old behaviour, kmedoids, fps) at a few budgets.
+
+Synthetic students: each has a few "poses" (offsets from the identity), seen unequally often at
+registration (mostly frontal) plus some outlier crops; attendance probes come from all poses
+equally. Recall = share of probes matched to the right student under the attendance threshold.
+
+Usage: python bench_curation.py [students] [dim]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from curation import curate_references
+from gallery import Gallery
+
+THRESHOLD = 0.40 # pipeline.ATTENDANCE_COSINE_THRESHOLD
+POSE_WEIGHTS = [0.7, 0.2, 0.1] # share of registration faces per pose
+REGISTRATION_FACES = 40
+OUTLIER_RATE = 0.05
+
+
+def synthetic_students(n_students, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    students = []
+    for _ in range(n_students):
+        identity = rng.normal(size=dim)
+        poses = [identity] + [identity + rng.normal(0, 0.9, dim) for _ in POSE_WEIGHTS[1:]]
+        counts = rng.multinomial(REGISTRATION_FACES, POSE_WEIGHTS)
+        faces = [poses[p] + rng.normal(0, 0.45, dim) for p, c in enumerate(counts) for _ in range(c)]
+        faces += [rng.normal(size=dim) for _ in range(rng.binomial(REGISTRATION_FACES, OUTLIER_RATE))]
+        students.append((poses, faces))
+    return students, rng
+
+
+def probes_for(students, per_pose, rng):
+    probes, owners = [], []
+    for s, (poses, _) in enumerate(students):
+        for pose in poses:
+            for _ in range(per_pose):
+                probes.append(pose + rng.normal(0, 0.45, len(pose)))
+                owners.append(s)
+    return probes, np.array(owners)
+
+
+if __name__ == "__main__":
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    students, rng = synthetic_students(n_students, dim)
+    probes, owners = probes_for(students, 5, rng)
+    print(f"{n_students} students x {REGISTRATION_FACES} registration faces, {len(probes)} probes, {dim}-d")
+    print(f"{'method':>9} {'budget':>6} {'recall':>7} {'side pose':>9} {'curate ms':>9} {'match ms':>8}")
+    side = np.tile(np.repeat([False, True, True], 5), n_students) # probes from non-frontal poses
+    for budget in (3, 5, 8):
+        for method in ("centroid", "kmedoids", "fps"):
+            start = time.perf_counter()
+            records = []
+            for i, (_, faces) in enumerate(students):
+                centroid, refs = curate_references(faces, budget, method)
+                records.append({"id": str(i), "embedding": centroid, "embeddings_list": refs})
+            t_curate = time.perf_counter() - start
+            gallery = Gallery(records)
+            start = time.perf_counter()
+            best, dist = gallery.match(probes)
+            t_match = time.perf_counter() - start
+            correct = (best == owners) & (dist < THRESHOLD)
+            print(f"{method:>9} {budget:>6} {correct.mean():7.1%} {correct[side].mean():9.1%} "
+                  f"{t_curate * 1000:9.1f} {t_match * 1000:8.1f}")
@@ -0,0 +1,62 @@
+"""
+Speed / recall trade-off of downscaled detection (DETECTION_WIDTH) on the uploads/ corpus.
+Full-resolution detections are the reference; recall = share of reference faces still found
+(IoU >= 0.5 after mapping boxes back to full resolution).
+
+Usage: python bench_detection_resolution.py [width ...]   (0 = full resolution)
+"""
+import os
+import sys
+import time
+
+import cv2
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline import _detect_faces, iter_sampled_frames
+from detectors import lease_face_detector, use_mediapipe
+
+SAMPLE_FPS = 2.0
+IOU_MATCH = 0.5
+
+
+def iou(a, b):
+    ax, ay, aw, ah = a[:4]
+    bx, by, bw, bh = b[:4]
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union else 0.0
+
+
+def load_frames(videos):
+    frames = []
+    for v in videos:
+        cap = cv2.VideoCapture(v)
+        frames.extend(frame for _, _, frame in iter_sampled_frames(cap, SAMPLE_FPS))
+        cap.release()
+    return frames
+
+
+if __name__ == "__main__":
+    widths = [int(w) for w in sys.argv[1:]] or [0, 960, 640, 480, 320]
+    uploads = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+    videos = sorted(os.path.join(uploads, f) for f in os.listdir(uploads) if f.endswith((".mp4", ".mov", ".webm")))
+    frames = load_frames(videos)
+    print(f"{len(frames)} frames from {len(videos)} videos")
+
+    with lease_face_detector(False, use_mediapipe()) as (face_detection, face_cascade):
+        reference = [_detect_faces(f, face_detection, face_cascade, False, None) for f in frames]
+        n_ref = sum(len(r) for r in reference)
+        print(f"{'width':>6s} {'ms/frame':>9s} {'faces':>6s} {'recall':>7s}")
+        for width in widths:
+            start = time.perf_counter()
+            found = [_detect_faces(f, face_detection, face_cascade, False, width or None) for f in frames]
+            ms = (time.perf_counter() - start) * 1000.0 / max(1, len(frames))
+            hits = sum(
+                1 for ref, got in zip(reference, found) for r in ref
+                if any(iou(r, g) >= IOU_MATCH for g in got)
+            )
+            recall = hits / n_ref if n_ref else 1.0
+            print(f"{width or 'full':>6} {ms:9.1f} {sum(len(f) for f in found):6d} {recall:7.2%}")
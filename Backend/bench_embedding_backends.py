@@ -0,0 +1,78 @@
+"""
+Import time, first-embedding latency and peak RSS of each embedding backend, each measured in a
+fresh interpreter (so one backend's imports do not count against the other), plus the largest
+cosine distance between the two backends' vectors on the same crops when both are available.
+
+Usage: python bench_embedding_backends.py [backend ...]   (default: opencv deepface)
+"""
+import glob
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+N_CROPS = 16
+
+_CHILD = r"""
+import glob, json, os, resource, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {here!r})
+import cv2
+import embeddings
+backend = embeddings.get_backend()
+t_load = time.perf_counter() - t0
+if backend is None or backend.name != {name!r}:
+    print(json.dumps({{"error": "backend unavailable"}}))
+    sys.exit(0)
+paths = sorted(glob.glob(os.path.join({here!r}, "temp", "**", "*.jpg"), recursive=True))[:{n}]
+crops = [cv2.imread(p) for p in paths]
+t1 = time.perf_counter()
+embs = backend.embed(crops[:1], 1)
+t_first = time.perf_counter() - t1
+embs = backend.embed(crops, embeddings.EMBEDDING_BATCH_SIZE)
+print(json.dumps({{
+    "load_s": t_load,
+    "first_embed_s": t_first,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    "tensorflow": "tensorflow" in sys.modules,
+    "embeddings": embs,
+}}))
+"""
+
+
+def run(name):
+    env = dict(os.environ, EMBEDDING_BACKEND=name, EMBEDDING_CACHE="0")
+    env.pop("EMBEDDING_SOCKET", None)
+    code = _CHILD.format(here=HERE, name=name, n=N_CROPS)
+    proc = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    lines = [l for l in proc.stdout.splitlines() if l.startswith("{")]
+    if not lines:
+        return {"error": (proc.stderr.strip().splitlines() or ["no output"])[-1]}
+    return json.loads(lines[-1])
+
+
+def max_cosine_distance(a, b):
+    a = np.array([e for e in a if e], dtype=np.float64)
+    b = np.array([e for e in b if e], dtype=np.float64)
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    return float((1 - (a * b).sum(axis=1)).max())
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or ["opencv", "deepface"]
+    if not glob.glob(os.path.join(HERE, "temp", "**", "*.jpg"), recursive=True):
+        sys.exit("No face crops under temp/; run a registration first")
+    results = {name: run(name) for name in names}
+    print(f"{'backend':>9s} {'load s':>8s} {'1st emb s':>10s} {'RSS MB':>8s} {'TF loaded':>10s}")
+    for name, r in results.items():
+        if "error" in r:
+            print(f"{name:>9s}  unavailable: {r['error']}")
+            continue
+        print(f"{name:>9s} {r['load_s']:8.2f} {r['first_embed_s']:10.3f} {r['rss_mb']:8.0f} {str(r['tensorflow']):>10s}")
+    ok = [r for r in results.values() if "error" not in r]
+    if len(ok) == 2:
+        print(f"max cosine distance between backends: {max_cosine_distance(ok[0]['embeddings'], ok[1]['embeddings']):.2e}")
@@ -0,0 +1,98 @@
+"""
+Effect of the embedding codec (float32 / float16 / int8) on the gallery and on attendance decisions.
+
+Decisions: every stored reference vector in data/students.json is used as a float32 probe against
+every other stored vector encoded with each codec. We report the largest change in cosine
+distance and how many "dist < ATTENDANCE_COSINE_THRESHOLD" decisions flip compared with the
+uncompressed float64 result.
+
+Size / load time: a synthetic gallery (default 1000 students x (centroid + 5 references)) drawn
+from the real vectors is written as JSON with each codec, then parsed and decoded as the
+attendance path does.
+
+Usage: python bench_embedding_codec.py [students]
+"""
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_codec import as_codes, decode_student, encode, encode_student
+
+ATTENDANCE_COSINE_THRESHOLD = 0.40 # keep in sync with pipeline.py (not imported: it pulls in cv2)
+STUDENTS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "students.json")
+CODECS = ["float32", "float16", "int8"]
+
+
+def stored_vectors(students):
+    vecs = []
+    for s in students:
+        for e in [s.get("embedding")] + list(s.get("embeddings_list") or []):
+            if e:
+                vecs.append(np.asarray(e, dtype=np.float64))
+    return vecs
+
+
+def cosine_matrix(probes, refs):
+    p = probes / np.linalg.norm(probes, axis=1, keepdims=True)
+    r = refs / np.linalg.norm(refs, axis=1, keepdims=True)
+    return 1 - p @ r.T
+
+
+def decision_report(vecs):
+    probes = np.array(vecs, dtype=np.float32)
+    exact = cosine_matrix(np.array(vecs), np.array(vecs))
+    off_diag = ~np.eye(len(vecs), dtype=bool)
+    near = int((np.abs(exact - ATTENDANCE_COSINE_THRESHOLD)[off_diag] < 0.01).sum())
+    print(f"{len(vecs)} stored vectors, {off_diag.sum()} probe/reference pairs, "
+          f"{near} within +-0.01 of the {ATTENDANCE_COSINE_THRESHOLD} threshold")
+    print(f"{'codec':>8s} {'max|d dist|':>12s} {'flips':>6s}")
+    for codec in CODECS:
+        refs = np.array([as_codes(encode(v, codec)) for v in vecs], dtype=np.float64)
+        dist = cosine_matrix(probes.astype(np.float64), refs)
+        delta = np.abs(dist - exact)[off_diag].max()
+        flips = int(((dist < ATTENDANCE_COSINE_THRESHOLD) != (exact < ATTENDANCE_COSINE_THRESHOLD))[off_diag].sum())
+        print(f"{codec:>8s} {delta:12.2e} {flips:6d}")
+
+
+def synthetic_gallery(vecs, n_students, seed=0):
+    rng = np.random.default_rng(seed)
+    students = []
+    for i in range(n_students):
+        picks = [vecs[j] + rng.normal(0, 0.01, vecs[j].shape) for j in rng.integers(0, len(vecs), 6)]
+        students.append({
+            "id": f"s{i}", "name": f"Student {i}", "roll_no": str(i), "classId": "c1",
+            "embedding": picks[0].tolist(), "embeddings_list": [p.tolist() for p in picks[1:]],
+        })
+    return students
+
+
+def size_report(vecs, n_students):
+    students = synthetic_gallery(vecs, n_students)
+    print(f"\nGallery of {n_students} students x 6 vectors ({len(vecs[0])}-d)")
+    print(f"{'storage':>8s} {'JSON MB':>8s} {'load+decode ms':>15s} {'RAM MB':>7s}")
+    for codec in ["list"] + CODECS:
+        stored = students if codec == "list" else [encode_student(s, codec) for s in students]
+        text = json.dumps(stored)
+        start = time.perf_counter()
+        gallery = [decode_student(s) for s in json.loads(text)]
+        ms = (time.perf_counter() - start) * 1000.0
+        if codec == "list":
+            ram = sum(32 * len(v) for s in stored for v in [s["embedding"]] + s["embeddings_list"])
+        else:
+            ram = sum(q.codes.nbytes for g in gallery for q in [g["embedding"]] + g["embeddings_list"])
+        print(f"{codec:>8s} {len(text) / 1e6:8.2f} {ms:15.1f} {ram / 1e6:7.2f}")
+
+
+if __name__ == "__main__":
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    with open(STUDENTS_FILE, "r", encoding="utf-8") as f:
+        vecs = stored_vectors(json.load(f))
+    if len(vecs) < 2:
+        sys.exit("Need at least two stored embeddings in data/students.json")
+    decision_report(vecs)
+    size_report(vecs, n_students)
@@ -0,0 +1,69 @@
+"""
+Embedding store benchmark: student records with inline embeddings (float lists, and int8 codec
+strings - the previous default) vs records holding an embedding_ref into the memory-mapped matrix
+(embedding_store.py). Both sets live in a temporary SQLite store; reports record bytes, the time
+to load (parse) all students, the time to build the attendance Gallery, and whether both
+galleries give the same matches.
+
+Usage: python bench_embedding_store.py [students] [dim] [refs] [thumbnail_chars]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embedding_codec import encode_student
+from embedding_store import EmbeddingStore
+from gallery import Gallery
+import embedding_store
+from storage import SqliteStore
+
+
+def synthetic_students(n, dim, refs, thumbnail_chars, seed=0):
+    rng = np.random.default_rng(seed)
+    out = []
+    for i in range(n):
+        vectors = rng.normal(size=(refs, dim)).astype(np.float32)
+        out.append({"id": f"s{i}", "name": f"Student {i}", "roll_no": f"23XX{i:04d}", "classId": f"C{201 + i % 10}",
+                    "embedding": vectors.mean(axis=0).tolist(), "embeddings_list": vectors.tolist(),
+                    "face_base64": "A" * thumbnail_chars})
+    return out
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - start)
+    return out, best
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    dim = int(sys.argv[2]) if len(sys.argv) > 2 else 128
+    refs = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    thumbnail_chars = int(sys.argv[4]) if len(sys.argv) > 4 else 0 # face_base64 size (0 = embeddings only)
+    students = synthetic_students(n, dim, refs, thumbnail_chars)
+    probes = [np.asarray(s["embeddings_list"][0]) for s in students[::10]]
+    print(f"{n} students, {refs} references each, {dim}-d, {thumbnail_chars}-char thumbnails")
+    print(f"{'records':>8} {'MB':>7} {'load ms':>8} {'gallery ms':>10}")
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        embedding_store._store = EmbeddingStore(os.path.join(folder, "embeddings"))
+        for label, records in (("floats", students), ("int8", [encode_student(s, "int8") for s in students]),
+                               ("ref", [embedding_store._store.pack(s) for s in students])):
+            store = SqliteStore(os.path.join(folder, f"{label}.db"))
+            store.save_students(records)
+            loaded, t_load = timed(store.load_students)
+            gallery, t_gallery = timed(lambda: Gallery(loaded))
+            results.append(gallery.match(probes)[0])
+            size = sum(len(json.dumps(r)) for r in loaded)
+            print(f"{label:>8} {size / 1e6:7.2f} {t_load * 1000:8.1f} {t_gallery * 1000:10.1f}")
+            store.close()
+    print(f"same matches: {all(np.array_equal(results[0], r) for r in results[1:])}")
@@ -0,0 +1,66 @@
+"""
+Embedding throughput (embeddings/s) of embeddings.embed_faces at batch sizes 1 / 8 / 32 on CPU,
+using the face crops written to temp/ by earlier registration and attendance runs.
+
+Usage: python bench_embeddings.py [batch_size ...] [--crops N]
+"""
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ["EMBEDDING_CACHE"] = "0" # measure the model, not cache hits
+
+import embeddings
+from embeddings import embed_faces
+
+DEFAULT_BATCH_SIZES = [1, 8, 32]
+DEFAULT_CROPS = 256
+REPEATS = 3
+
+
+def load_crops(n):
+    here = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(here, "temp", "**", "*.jpg"), recursive=True))
+    crops = [c for c in (cv2.imread(p) for p in paths[:n]) if c is not None]
+    # Recycle crops when the corpus is small so every batch size sees the same workload
+    while crops and len(crops) < n:
+        crops.extend(crops[:n - len(crops)])
+    return crops
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    n_crops = DEFAULT_CROPS
+    if "--crops" in args:
+        i = args.index("--crops")
+        n_crops = int(args[i + 1])
+        del args[i:i + 2]
+    batch_sizes = [int(b) for b in args] or DEFAULT_BATCH_SIZES
+
+    crops = load_crops(n_crops)
+    if not crops:
+        sys.exit("No face crops under temp/; run a registration first")
+    if not isinstance(embeddings.get_backend(), embeddings.OpenCVSFaceBackend):
+        sys.exit("SFace weights not available; the batched path needs " + embeddings._sface_weights_path())
+
+    embed_faces(crops[:8]) # warm-up (graph init)
+    print(f"{len(crops)} crops, cv2 threads={cv2.getNumThreads()}")
+    print(f"{'batch':>6s} {'emb/s':>8s} {'ms/emb':>8s}")
+    reference = None
+    for batch_size in batch_sizes:
+        best = float("inf")
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            out = embed_faces(crops, batch_size=batch_size)
+            best = min(best, time.perf_counter() - start)
+        # Batching must not change the vectors
+        out = np.array(out, dtype=np.float32)
+        if reference is None:
+            reference = out
+        drift = float(np.abs(out - reference).max())
+        print(f"{batch_size:6d} {len(crops) / best:8.1f} {best * 1000.0 / len(crops):8.2f}   max|diff| vs first={drift:.2e}")
@@ -0,0 +1,56 @@
+"""
+Throughput of extract_faces_from_video on the uploads/ corpus:
+single process vs segmented multi-process (EXTRACTION_PROCESSES) extraction.
+
+Usage: python bench_extraction.py [processes] [video ...]
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import pipeline
+from pipeline import extract_faces_from_video, _video_duration_ms
+
+
+def run(video_path, processes):
+    faces_dir = tempfile.mkdtemp(prefix="bench_faces_")
+    try:
+        start = time.perf_counter()
+        tracks = extract_faces_from_video(video_path, faces_dir, processes=processes)
+        return time.perf_counter() - start, len(tracks)
+    finally:
+        shutil.rmtree(faces_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else (os.cpu_count() or 2)
+    videos = sys.argv[2:]
+    if not videos:
+        uploads = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads")
+        videos = sorted(
+            os.path.join(uploads, f) for f in os.listdir(uploads)
+            if f.endswith((".mp4", ".mov", ".avi", ".webm", ".mkv"))
+        )
+
+    # Uploads in this corpus are short; let every clip be split so stitching gets exercised
+    pipeline.SEGMENT_MIN_SECONDS = float(os.environ.get("BENCH_SEGMENT_MIN_SECONDS", 1))
+
+    total_video_s = total_single_s = total_multi_s = 0.0
+    print(f"{'video':45s} {'len_s':>6s} {'1p_s':>7s} {'tracks':>6s} {f'{processes}p_s':>7s} {'tracks':>6s}")
+    for v in videos:
+        video_s = _video_duration_ms(v) / 1000.0
+        t1, n1 = run(v, 1)
+        tn, nn = run(v, processes)
+        total_video_s += video_s
+        total_single_s += t1
+        total_multi_s += tn
+        print(f"{os.path.basename(v):45s} {video_s:6.1f} {t1:7.2f} {n1:6d} {tn:7.2f} {nn:6d}")
+
+    if total_single_s and total_multi_s:
+        print(f"\nThroughput (video seconds / wall second): "
+              f"1 process {total_video_s / total_single_s:.2f}x, "
+              f"{processes} processes {total_video_s / total_multi_s:.2f}x")
@@ -0,0 +1,103 @@
+"""
+Attendance matching benchmark: the old per-probe / per-student loop vs gallery.Gallery, on a
+synthetic class (default 60 students x 5 references, 500 probe faces, 128-d) with probes drawn
+near real students plus unknown faces. Also checks that both produce the same votes.
+
+Usage: python bench_matcher.py [students] [probes] [dim]
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from gallery import Gallery
+
+THRESHOLD = 0.40 # pipeline.ATTENDANCE_COSINE_THRESHOLD
+
+
+def _cosine_distance(emb1, emb2):
+    emb1 = np.array(emb1)
+    emb2 = np.array(emb2)
+    norm1 = np.linalg.norm(emb1)
+    norm2 = np.linalg.norm(emb2)
+    if norm1 < 1e-10 or norm2 < 1e-10:
+        return 1.0
+    return 1 - np.dot(emb1, emb2) / (norm1 * norm2)
+
+
+def legacy_match(emb, known_students):
+    """pipeline._match_embedding_to_student before gallery.py."""
+    best_match = None
+    min_dist = 999.0
+    for student in known_students:
+        embeddings_list = student.get("embeddings_list", [])
+        if embeddings_list:
+            for known_emb in embeddings_list:
+                if not known_emb:
+                    continue
+                dist = _cosine_distance(emb, known_emb)
+                if dist < min_dist:
+                    min_dist = dist
+                    best_match = student
+        else:
+            known_emb = student.get("embedding")
+            if not known_emb:
+                continue
+            dist = _cosine_distance(emb, known_emb)
+            if dist < min_dist:
+                min_dist = dist
+                best_match = student
+    return best_match, min_dist
+
+
+def synthetic_class(n_students, n_probes, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(n_students, dim))
+    students = []
+    for i, c in enumerate(centers):
+        refs = [(c + rng.normal(0, 0.3, dim)).tolist() for _ in range(5)]
+        students.append({"id": f"s{i}", "name": f"Student {i}",
+                         "embedding": np.mean(refs, axis=0).tolist(), "embeddings_list": refs})
+    # A few legacy records: centroid only / nothing stored
+    students[0]["embeddings_list"] = []
+    students[1]["embeddings_list"], students[1]["embedding"] = [], None
+    owners = rng.integers(0, n_students, n_probes)
+    probes = [(centers[o] + rng.normal(0, 0.5, dim)).tolist() if k % 5 else rng.normal(size=dim).tolist()
+              for k, o in enumerate(owners)]
+    return students, probes
+
+
+def votes_from(matches):
+    votes, log = {}, []
+    for k, (student, dist) in enumerate(matches):
+        if student and dist < THRESHOLD:
+            votes[student["id"]] = votes.get(student["id"], 0) + 1
+            log.append((k, student["id"], round(float(dist), 12)))
+    return votes, log
+
+
+if __name__ == "__main__":
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    n_probes = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    dim = int(sys.argv[3]) if len(sys.argv) > 3 else 128
+    students, probes = synthetic_class(n_students, n_probes, dim)
+
+    start = time.perf_counter()
+    old = [legacy_match(p, students) for p in probes]
+    t_old = time.perf_counter() - start
+
+    start = time.perf_counter()
+    gallery = Gallery(students)
+    t_build = time.perf_counter() - start
+    best, dists = gallery.match(probes)
+    t_new = time.perf_counter() - start
+    new = [(gallery.student(int(b)), float(d)) for b, d in zip(best, dists)]
+
+    same = votes_from(old) == votes_from(new)
+    print(f"{n_students} students ({gallery.n_refs} references), {n_probes} probes, {dim}-d")
+    print(f"legacy loop   {t_old * 1000:9.1f} ms")
+    print(f"Gallery       {t_new * 1000:9.1f} ms  (build {t_build * 1000:.1f} ms)  speedup {t_old / t_new:.0f}x")
+    print(f"identical votes / match log: {same}")
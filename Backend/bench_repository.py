@@ -0,0 +1,67 @@
+"""
+Repository benchmark: the dashboard lookups (a student's classes by roll no, a teacher's classes,
+a class's students, one student by id) served straight from the store vs through the
+Repository's cached indexes, for the SQLite and JSON backends in a temp dir.
+
+Usage: python bench_repository.py [students] [classes]
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from repository import Repository
+from storage import JsonStore, SqliteStore
+
+
+def synthetic(n_students, n_classes):
+    classes = [{"id": f"C{i}", "name": f"Class {i}", "teacherId": f"T{i % 50}"} for i in range(n_classes)]
+    students = [{"id": f"s{i}", "name": f"Student {i}", "roll_no": f"R{i % (n_students // 4)}",
+                 "classId": f"C{i % n_classes}", "face_base64": "A" * 2000} for i in range(n_students)]
+    return students, classes
+
+
+def timed(fn, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def direct_lookups(store):
+    return {
+        "classes by roll": lambda: (lambda ids: [c for c in store.load_classes() if c.get("id") in ids])(
+            store.class_ids_for_roll_no("R7")),
+        "classes by teacher": lambda: store.load_classes("T3"),
+        "students of class": lambda: store.load_students("C5"),
+        "student by id": lambda: next((s for s in store.load_students() if s["id"] == "s999"), None),
+    }
+
+
+def repo_lookups(repo):
+    return {
+        "classes by roll": lambda: repo.classes_for_roll_no("R7"),
+        "classes by teacher": lambda: repo.classes("T3"),
+        "students of class": lambda: repo.students("C5"),
+        "student by id": lambda: repo.student("s999"),
+    }
+
+
+if __name__ == "__main__":
+    n_students = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    n_classes = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    students, classes = synthetic(n_students, n_classes)
+    print(f"{n_students} students, {n_classes} classes (ms per lookup)")
+    print(f"{'backend':>7} {'lookup':>19} {'store':>9} {'repository':>11}")
+    for name, make in (("sqlite", lambda d: SqliteStore(os.path.join(d, "b.db"))), ("json", JsonStore)):
+        with tempfile.TemporaryDirectory() as folder:
+            store = make(folder)
+            store.save_students(students)
+            store.save_classes(classes)
+            repo = Repository(store)
+            direct, cached = direct_lookups(store), repo_lookups(repo)
+            for lookup in direct:
+                assert direct[lookup]() == cached[lookup]()
+                print(f"{name:>7} {lookup:>19} {timed(direct[lookup], 5):9.2f} {timed(cached[lookup]):11.3f}")
@@ -0,0 +1,80 @@
+"""
+Storage benchmark: JsonStore (whole-file rewrites) vs SqliteStore (WAL, row inserts) in a temp dir.
+
+1. Attendance write latency as history grows (sessions shaped like data/attendance.json).
+2. Lost writes: several processes insert attendance sessions concurrently, as gunicorn workers do.
+
+Usage: python bench_storage.py [max_history] [processes] [writes_per_process]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage import JsonStore, SqliteStore
+
+SESSION_STUDENTS = 30 # present_students per session (each a full student record, as the app saves them)
+
+
+def fake_session(class_id="C201"):
+    student = {"id": str(uuid.uuid4()), "name": "Student", "roll_no": "23XX0000", "classId": class_id,
+               "embedding": "int8:0.01:" + "A" * 172, "face_base64": "B" * 2000}
+    return {"id": str(uuid.uuid4()), "classId": class_id, "date": "2026-10-17T10:00:00.000Z",
+            "present_students": [student] * SESSION_STUDENTS}
+
+
+def open_store(kind, folder):
+    return JsonStore(folder) if kind == "json" else SqliteStore(os.path.join(folder, "bench.db"))
+
+
+def write_latency(kind, folder, checkpoints):
+    store = open_store(kind, folder)
+    out, n = [], 0
+    for target in checkpoints:
+        while n < target:
+            store.insert_attendance(fake_session())
+            n += 1
+        start = time.perf_counter()
+        for _ in range(5):
+            store.insert_attendance(fake_session())
+        out.append((time.perf_counter() - start) / 5)
+        n += 5
+    return out
+
+
+def _writer(args):
+    kind, folder, n = args
+    store = open_store(kind, folder)
+    for _ in range(n):
+        store.insert_attendance(fake_session())
+
+
+def lost_writes(kind, folder, processes, per_process):
+    open_store(kind, folder) # create the schema before the writers start
+    with multiprocessing.Pool(processes) as pool:
+        pool.map(_writer, [(kind, folder, per_process)] * processes)
+    return processes * per_process - len(open_store(kind, folder).load_attendance())
+
+
+if __name__ == "__main__":
+    max_history = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    per_process = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    checkpoints = [c for c in (0, 30, 100, 300, 1000, 3000) if c <= max_history]
+
+    print(f"attendance write latency (ms) vs sessions already stored ({SESSION_STUDENTS} students each)")
+    print(f"{'history':>8} {'json':>9} {'sqlite':>9}")
+    with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+        json_ms = write_latency("json", a, checkpoints)
+        sqlite_ms = write_latency("sqlite", b, checkpoints)
+    for c, j, s in zip(checkpoints, json_ms, sqlite_ms):
+        print(f"{c:>8} {j * 1000:9.2f} {s * 1000:9.2f}")
+
+    print(f"\n{processes} processes x {per_process} concurrent attendance writes")
+    for kind in ("json", "sqlite"):
+        with tempfile.TemporaryDirectory() as folder:
+            print(f"{kind:>8}: {lost_writes(kind, folder, processes, per_process)} writes lost")
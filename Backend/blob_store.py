@@ -0,0 +1,61 @@
+"""
+Content-addressed blob store for face thumbnails.
+
+A blob is saved once under the SHA-256 of its bytes (data/thumbnails/<2 hex>/<64 hex>,
+THUMBNAIL_DIR), so the same student thumbnail attached to every attendance session of a term is
+stored a single time and records only carry the 64-character key. Files are written to a temporary
+name and renamed into place, so concurrent writers of the same content are harmless and readers
+never see a partial blob.
+"""
+import hashlib
+import os
+import re
+import threading
+from pathlib import Path
+
+THUMBNAIL_DIR = Path(os.environ.get("THUMBNAIL_DIR", Path(__file__).parent / "data" / "thumbnails"))
+_KEY_RE = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobStore:
+    def __init__(self, folder=THUMBNAIL_DIR):
+        self.folder = Path(folder)
+
+    def _path(self, key):
+        if not isinstance(key, str) or not _KEY_RE.fullmatch(key): # keys come from stored records: never a path
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return self.folder / key[:2] / key
+
+    def put(self, data):
+        """Store bytes (no-op when already present); returns the key."""
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return key
+
+    def get(self, key):
+        """Bytes of a blob, or None if it is missing."""
+        try:
+            with open(self._path(key), "rb") as f:
+                return f.read()
+        except (OSError, ValueError):
+            return None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_thumbnail_store():
+    """The THUMBNAIL_DIR store, created once per process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore(THUMBNAIL_DIR)
+    return _store
@@ -1,15 +1,15 @@
 import sys
 print(f"Python: {sys.version}")
 
-packages = ["flask", "flask_cors", "cv2", "numpy", "sklearn", "deepface", "pandas", "openpyxl"]
+packages = ["flask", "flask_cors", "cv2", "numpy", "scipy", "deepface", "pandas", "openpyxl"]
 missing = []
 
 for p in packages:
     try:
         if p == "cv2":
             import cv2
-        elif p == "sklearn":
-            import sklearn
+        elif p == "scipy":
+            import scipy.optimize
         elif p == "deepface":
             import deepface
         elif p == "flask_cors":
@@ -0,0 +1,128 @@
+"""
+Online clustering of face-track embeddings for registration.
+
+run_pipeline used to wait for extraction, embed everything and run sklearn
+DBSCAN(metric="cosine", min_samples=1), which builds the full pairwise distance matrix. With
+min_samples=1 every point is a core point, so DBSCAN clusters are exactly the connected components
+of the graph "cosine distance <= eps". OnlineClusterer maintains those components with union-find
+while embeddings arrive: each new batch is compared with the points seen so far in one
+(batch x n) matrix product, so memory stays O(n * d) instead of O(n^2) and clusters are final as
+soon as the last track is added. labels() numbers clusters the way DBSCAN does for a given point
+order (by first member), so results match the batch path exactly.
+
+merge_pass() is an optional extra step that also joins clusters whose centroids are within a
+(usually tighter) distance - useful when one person's tracks split into a few chains.
+
+run_pipeline feeds it through embeddings.EmbeddingStream as tracks finalize, so embedding and
+clustering overlap with decoding and only the last partial batch is left when the video ends.
+"""
+import numpy as np
+
+INITIAL_CAPACITY = 256
+
+
+def _unit(x):
+    x = np.asarray(x, dtype=np.float64)
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return np.divide(x, norms, out=np.zeros_like(x), where=norms >= 1e-10)
+
+
+class OnlineClusterer:
+    """Incremental DBSCAN(min_samples=1, metric="cosine") via union-find."""
+
+    def __init__(self, eps):
+        self.eps = eps
+        self.keys = []
+        self._vectors = None # (capacity, d) unit rows; first len(keys) are valid
+        self._parent = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _find(self, i):
+        parent = self._parent
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+        while parent[i] != root: # path compression
+            parent[i], i = root, parent[i]
+        return root
+
+    def _union(self, a, b):
+        ra, rb = self._find(a), self._find(b)
+        if ra != rb:
+            self._parent[max(ra, rb)] = min(ra, rb)
+
+    def _grow(self, n_new, dim):
+        n = len(self.keys)
+        if self._vectors is None:
+            self._vectors = np.empty((max(INITIAL_CAPACITY, n_new), dim))
+        elif n + n_new > len(self._vectors):
+            grown = np.empty((max(2 * len(self._vectors), n + n_new), dim))
+            grown[:n] = self._vectors[:n]
+            self._vectors = grown
+        self._parent = np.concatenate([self._parent, np.arange(n, n + n_new, dtype=np.int64)])
+
+    def add(self, keys, embeddings):
+        """Add a batch of (key, embedding); embeddings must all have the same dimension."""
+        if not keys:
+            return
+        x = _unit(embeddings)
+        n = len(self.keys)
+        self._grow(len(keys), x.shape[1])
+        self._vectors[n:n + len(keys)] = x
+        self.keys.extend(keys)
+        # New points against everything so far (including each other): one matmul per batch
+        dist = 1.0 - x @ self._vectors[:n + len(keys)].T
+        rows, cols = np.nonzero(dist <= self.eps)
+        keep = cols < rows + n # each pair once, no self pairs
+        rows, cols = rows[keep] + n, cols[keep]
+        # Old neighbours only matter once per (new point, current cluster)
+        old = cols < n
+        targets = cols.copy()
+        targets[old] = self._roots(n)[cols[old]]
+        pairs = np.unique(np.stack([rows, targets], axis=1), axis=0) if len(rows) else ()
+        for r, c in pairs:
+            self._union(int(r), int(c))
+
+    def _roots(self, n):
+        """Root of each of the first n points (vectorized pointer jumping)."""
+        roots = self._parent[:n].copy()
+        while True:
+            nxt = roots[roots]
+            if np.array_equal(nxt, roots):
+                return roots
+            roots = nxt
+
+    def merge_pass(self, merge_eps):
+        """Join clusters whose (normalized mean) centroids are within merge_eps. Returns #merges."""
+        roots = np.array([self._find(i) for i in range(len(self.keys))], dtype=np.int64)
+        uniq, inverse = np.unique(roots, return_inverse=True)
+        if len(uniq) < 2:
+            return 0
+        sums = np.zeros((len(uniq), self._vectors.shape[1]))
+        np.add.at(sums, inverse, self._vectors[:len(self.keys)])
+        centroids = _unit(sums)
+        dist = 1.0 - centroids @ centroids.T
+        merges = 0
+        for a, b in zip(*np.nonzero(np.triu(dist <= merge_eps, k=1))):
+            ra, rb = self._find(uniq[a]), self._find(uniq[b])
+            if ra != rb:
+                self._union(ra, rb)
+                merges += 1
+        return merges
+
+    def labels(self, order=None):
+        """
+        Cluster label per key, numbered by first member in `order` (default: insertion order),
+        which is how DBSCAN numbers clusters for points given in that order.
+        Returns (keys_in_order, labels).
+        """
+        index = {k: i for i, k in enumerate(self.keys)}
+        keys = list(order) if order is not None else list(self.keys)
+        label_of_root = {}
+        labels = []
+        for k in keys:
+            root = self._find(index[k])
+            labels.append(label_of_root.setdefault(root, len(label_of_root)))
+        return keys, labels
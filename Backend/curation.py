@@ -0,0 +1,119 @@
+"""
+Reference curation: which embeddings of a student are kept as embeddings_list.
+
+run_pipeline used to keep the REFERENCE_BUDGET embeddings closest to the cluster centroid, which
+are mostly near-duplicates of the dominant pose; a probe from a different angle then only has the
+centroid side of the cluster to match against. curate_references() instead keeps a fixed budget
+of references that cover the cluster:
+
+    kmedoids  (default) k-medoids on cosine distance, seeded by farthest-point selection from the
+              most central face. Each reference is the medoid of a group of faces, so single
+              outliers (blurry / misdetected crops) are not picked on their own.
+    fps       farthest-point selection from the most central face: maximal spread, cheapest.
+    centroid  the old behaviour (closest to the centroid).
+
+The stored centroid ("embedding") stays the plain mean. Matching cost is one row per reference,
+so a small diverse budget keeps galleries small and Gallery.match fast.
+
+Existing records in the configured store (storage.get_store()) can be re-curated offline (e.g.
+after lowering the budget):
+
+    python curation.py [budget] [kmedoids|fps|centroid]
+"""
+import os
+import sys
+
+import numpy as np
+
+REFERENCE_BUDGET = int(os.environ.get("REFERENCE_BUDGET", 5)) # References stored per student
+CURATION_METHOD = os.environ.get("CURATION_METHOD", "kmedoids") # kmedoids | fps | centroid
+CURATION_MAX_POOL = 1000 # Larger clusters are subsampled (evenly) before the O(n^2) distance matrix
+KMEDOIDS_ITERS = 10
+
+
+def _unit(x):
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    return np.divide(x, norms, out=np.zeros_like(x), where=norms >= 1e-10)
+
+
+def farthest_point(dist, k, start):
+    """Indices of k points chosen greedily, each farthest from those already chosen."""
+    chosen = [start]
+    nearest = dist[start].copy()
+    while len(chosen) < k:
+        nxt = int(nearest.argmax())
+        if nearest[nxt] <= 1e-12: # only duplicates left
+            break
+        chosen.append(nxt)
+        nearest = np.minimum(nearest, dist[nxt])
+    return chosen
+
+
+def k_medoids(dist, k, iters=KMEDOIDS_ITERS):
+    """Medoid indices (largest group first) by alternating assignment / medoid update."""
+    medoids = farthest_point(dist, k, int(dist.sum(axis=1).argmin()))
+    for _ in range(iters):
+        assign = dist[:, medoids].argmin(axis=1)
+        updated = []
+        for j in range(len(medoids)):
+            members = np.flatnonzero(assign == j)
+            updated.append(int(members[dist[np.ix_(members, members)].sum(axis=1).argmin()]))
+        if updated == medoids:
+            break
+        medoids = updated
+    sizes = np.bincount(dist[:, medoids].argmin(axis=1), minlength=len(medoids))
+    return [medoids[j] for j in np.argsort(-sizes, kind="stable")]
+
+
+def _closest_to_centroid(x, centroid, k):
+    c = centroid / (np.linalg.norm(centroid) + 1e-10)
+    return list(np.argsort(1.0 - x @ c, kind="stable")[:k])
+
+
+def curate_references(embeddings, budget=REFERENCE_BUDGET, method=CURATION_METHOD):
+    """(centroid, references) for the embeddings of one person; references are a subset of them."""
+    vectors = np.asarray(embeddings, dtype=np.float64)
+    centroid = vectors.mean(axis=0).tolist()
+    if len(vectors) <= budget:
+        return centroid, vectors.tolist()
+    pool = np.arange(len(vectors))
+    if len(pool) > CURATION_MAX_POOL:
+        pool = np.linspace(0, len(vectors) - 1, CURATION_MAX_POOL).astype(int)
+    x = _unit(vectors[pool])
+    if method == "centroid":
+        picked = _closest_to_centroid(x, np.asarray(centroid), budget)
+    else:
+        dist = 1.0 - x @ x.T
+        if method == "fps":
+            picked = farthest_point(dist, budget, int(dist.sum(axis=1).argmin()))
+        elif method == "kmedoids":
+            picked = k_medoids(dist, budget)
+        else:
+            raise ValueError(f"Unknown curation method: {method}")
+    return centroid, [vectors[pool[i]].tolist() for i in picked]
+
+
+def curate_store(store, budget=REFERENCE_BUDGET, method=CURATION_METHOD):
+    """Re-curate the references of every student in store (centroids are kept)."""
+    from embedding_store import pack_student, student_vectors
+
+    students = store.load_students()
+    updated = []
+    before = after = 0
+    for student in students:
+        centroid, refs = student_vectors(student)
+        before += len(refs)
+        if len(refs) > budget:
+            _, refs = curate_references(refs, budget, method)
+            updated.append(pack_student({**student, "embedding": None if centroid is None else centroid.tolist(),
+                                         "embeddings_list": refs}))
+        after += len(refs)
+    store.update_students(updated) # only the re-curated rows
+    print(f"{len(students)} students, {before} -> {after} references ({method}, budget {budget})")
+
+
+if __name__ == "__main__":
+    from storage import get_store
+
+    curate_store(get_store(), int(sys.argv[1]) if len(sys.argv) > 1 else REFERENCE_BUDGET,
+                 sys.argv[2] if len(sys.argv) > 2 else CURATION_METHOD)
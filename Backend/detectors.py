@@ -0,0 +1,127 @@
+"""
+Process-wide registry of warm face detectors (MediaPipe / Haar Cascade).
+
+Building a MediaPipe FaceDetection graph or loading the Haar XML costs hundreds of ms, so
+instances are created once per process and reused across requests. Instances are keyed by
+(backend, confidence) and leased to one thread at a time - MediaPipe graphs are not thread-safe.
+gunicorn workers call preload_detectors() from post_fork (see gunicorn.conf.py) so the first
+request after a deploy does not pay the construction cost.
+"""
+import os
+import threading
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+FACE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+MAX_IDLE_PER_KEY = 8 # Warm instances kept per key; extra ones are closed when returned
+
+
+def use_mediapipe():
+    """MediaPipe unless we are on Render/Heroku (Free Tier), which is memory constrained."""
+    # Force Haar Cascade on Render to save RAM (MediaPipe is ~100MB overhead)
+    return not (os.environ.get("RENDER") or os.environ.get("DYNO"))
+
+
+def detection_confidence(strict_quality):
+    return 0.5 if strict_quality else 0.2
+
+
+class DetectorRegistry:
+    """Pool of idle detectors per key. lease() hands out an instance exclusively to the caller."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {} # key -> list of (face_detection, face_cascade)
+        self._mediapipe_failed = False
+
+    def key_for(self, strict_quality, mediapipe=True):
+        if mediapipe and not self._mediapipe_failed:
+            return ("mediapipe", detection_confidence(strict_quality))
+        # Haar has no construction-time confidence; strictness only changes detectMultiScale args
+        return ("haar", None)
+
+    def _create(self, key):
+        """Return (face_detection, face_cascade); exactly one is set, or both None if nothing loaded."""
+        backend, confidence = key
+        if backend == "mediapipe":
+            try:
+                import mediapipe as mp
+                face_detection = mp.solutions.face_detection.FaceDetection(
+                    model_selection=1, min_detection_confidence=confidence
+                )
+                return face_detection, None
+            except Exception as e:
+                print(f"DEBUG: MediaPipe init failed ({e}), falling back to Haar Cascade")
+                # Do not retry the import on every request
+                self._mediapipe_failed = True
+                return self._create(("haar", None))
+
+        face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
+        if face_cascade.empty():
+            print("ERROR: Could not load Haar Cascade XML")
+            return None, None
+        return None, face_cascade
+
+    @contextmanager
+    def lease(self, strict_quality, mediapipe=True):
+        """Yield (face_detection, face_cascade) for exclusive use by the calling thread."""
+        key = self.key_for(strict_quality, mediapipe)
+        with self._lock:
+            idle = self._idle.get(key)
+            detector = idle.pop() if idle else None
+        if detector is None:
+            detector = self._create(key)
+            # MediaPipe may have fallen back to Haar while creating
+            key = self.key_for(strict_quality, mediapipe)
+        if detector[0] is None and detector[1] is None: # nothing to pool
+            yield detector
+            return
+        try:
+            yield detector
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < MAX_IDLE_PER_KEY:
+                    idle.append(detector)
+                    detector = None
+            if detector is not None:
+                _close(detector)
+
+    def preload(self, strict_modes=(True, False), mediapipe=None):
+        """Create (and run once, to finish lazy graph init) one detector per strictness mode."""
+        if mediapipe is None:
+            mediapipe = use_mediapipe()
+        blank = np.zeros((64, 64, 3), dtype=np.uint8)
+        for strict_quality in strict_modes:
+            with self.lease(strict_quality, mediapipe) as (face_detection, face_cascade):
+                if face_detection:
+                    face_detection.process(blank)
+                elif face_cascade is not None:
+                    face_cascade.detectMultiScale(blank[:, :, 0])
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for detectors in idle.values():
+            for detector in detectors:
+                _close(detector)
+
+
+def _close(detector):
+    face_detection, _ = detector
+    if face_detection:
+        face_detection.close()
+
+
+REGISTRY = DetectorRegistry()
+
+
+def lease_face_detector(strict_quality, mediapipe=True):
+    return REGISTRY.lease(strict_quality, mediapipe)
+
+
+def preload_detectors():
+    """Warm-up hook for server start (gunicorn post_fork)."""
+    REGISTRY.preload()
@@ -0,0 +1,163 @@
+"""
+Content-addressed on-disk cache of face embeddings.
+
+Key = blake2b(model name, alignment flag, crop shape, crop pixels), so re-running registration or
+attendance on the same video (e.g. after changing a threshold) reuses every embedding instead of
+running the model again. Entries live in memory as an OrderedDict in LRU order and are persisted
+to one compact binary file (oldest first), rewritten atomically by flush():
+
+    b"EMBC" | uint32 version | uint32 dim | uint32 count | count * (16-byte key, dim float32)
+
+The file is bounded by EMBEDDING_CACHE_MAX_ENTRIES (least recently used entries are evicted).
+Hits only reorder entries in memory: a request answered entirely from the cache does not rewrite
+the file, and the new order is saved with the next flush that has new entries to write.
+When another process has rewritten the file since we loaded it, its entries are merged in as
+older ones before we write, so gunicorn workers do not throw away each other's work.
+"""
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH", str(Path(__file__).parent / "data" / "embedding_cache.bin"))
+CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 20000)) # ~10 MB for 128-d SFace
+CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE", "1") != "0"
+_MAGIC = b"EMBC"
+_VERSION = 1
+_HEADER = struct.Struct("<4sIII")
+_KEY_BYTES = 16
+
+
+def crop_key(crop, model_name, align):
+    h = hashlib.blake2b(digest_size=_KEY_BYTES)
+    h.update(f"{model_name}|{int(bool(align))}|{crop.shape}|{crop.dtype}".encode())
+    h.update(np.ascontiguousarray(crop).data)
+    return h.digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=CACHE_PATH, max_entries=CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = None # key -> float32 vector, least recently used first
+        self._dim = None
+        self._dirty = False
+        self._loaded_mtime = None
+        self._lock = threading.Lock()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_file(self):
+        """OrderedDict of the entries on disk (empty if missing or unreadable)."""
+        entries = OrderedDict()
+        try:
+            with open(self.path, "rb") as f:
+                magic, version, dim, count = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != _MAGIC or version != _VERSION:
+                    return entries, None
+                raw = np.frombuffer(f.read(), dtype=np.uint8)
+        except (OSError, struct.error):
+            return entries, None
+        record = _KEY_BYTES + dim * 4
+        count = min(count, len(raw) // record)
+        records = raw[:count * record].reshape(count, record)
+        vectors = records[:, _KEY_BYTES:].copy().view("<f4")
+        for row, vec in zip(records, vectors):
+            entries[row[:_KEY_BYTES].tobytes()] = vec
+        return entries, dim
+
+    def _ensure_loaded(self):
+        if self._entries is None:
+            self._loaded_mtime = self._mtime()
+            self._entries, self._dim = self._read_file()
+
+    def get_many(self, keys):
+        """List aligned with keys: cached embedding (list of floats) or None."""
+        with self._lock:
+            self._ensure_loaded()
+            out = []
+            for key in keys:
+                vec = self._entries.get(key)
+                if vec is None:
+                    self.misses += 1
+                    out.append(None)
+                else:
+                    self.hits += 1
+                    self._entries.move_to_end(key) # recency alone does not dirty the file
+                    out.append(vec.tolist())
+            return out
+
+    def put_many(self, items):
+        """items: iterable of (key, embedding)."""
+        with self._lock:
+            self._ensure_loaded()
+            for key, emb in items:
+                vec = np.asarray(emb, dtype=np.float32)
+                if self._dim is None:
+                    self._dim = len(vec)
+                if len(vec) != self._dim:
+                    continue # different model output size; never mix in one file
+                self._entries[key] = vec
+                self._entries.move_to_end(key)
+                self._dirty = True
+            self._evict()
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def flush(self):
+        """Write the cache file if anything changed (atomic replace)."""
+        with self._lock:
+            if not self._dirty or self._entries is None:
+                return
+            if self._mtime() != self._loaded_mtime:
+                disk, dim = self._read_file()
+                if dim == self._dim:
+                    merged = OrderedDict((k, v) for k, v in disk.items() if k not in self._entries)
+                    merged.update(self._entries)
+                    self._entries = merged
+                    self._evict()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, _VERSION, self._dim or 0, len(self._entries)))
+                for key, vec in self._entries.items():
+                    f.write(key)
+                    f.write(vec.astype("<f4").tobytes())
+            os.replace(tmp, self.path)
+            self._loaded_mtime = self._mtime()
+            self._dirty = False
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries or ()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+_cache = None
+
+
+def get_cache():
+    """Process-wide cache, or None when EMBEDDING_CACHE=0."""
+    global _cache
+    if CACHE_ENABLED and _cache is None:
+        _cache = EmbeddingCache()
+    return _cache
@@ -0,0 +1,110 @@
+"""
+Compact embedding storage: float32 / float16 / int8 with a per-vector scale.
+
+students.json used to hold every embedding as a JSON list of Python floats (~11 bytes per
+dimension). encode() turns a vector into a short string instead:
+
+    "<codec>:<scale>:<base64 of the little-endian codes>"     e.g. "int8:0.0123:AQL+..."
+
+int8 stores round(v / scale) with scale = max|v| / 127, so a 128-d SFace vector is 128 bytes.
+Cosine distance is scale-invariant, so the matcher compares probes directly against the stored
+codes (cosine_distance / as_codes) without ever applying the scale. decode() also
+accepts the old plain lists, so existing records keep working. Records that keep their embeddings
+inline (EMBEDDING_MATRIX=0, see embedding_store.py) can be re-encoded in the configured store with
+
+    python embedding_codec.py migrate [int8|float16|float32]
+"""
+import base64
+import os
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+CODECS = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+EMBEDDING_STORAGE = os.environ.get("EMBEDDING_STORAGE", "int8") # Codec for newly saved students
+
+QuantizedEmbedding = namedtuple("QuantizedEmbedding", ["codes", "scale"])
+
+
+def quantize(vec, codec=EMBEDDING_STORAGE):
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    if codec == "int8":
+        peak = float(np.abs(vec).max()) if vec.size else 0.0
+        scale = peak / 127.0 if peak > 0 else 1.0
+        codes = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+        return QuantizedEmbedding(codes, scale)
+    return QuantizedEmbedding(vec.astype(CODECS[codec]), 1.0)
+
+
+def encode(vec, codec=EMBEDDING_STORAGE):
+    """Vector (list / array) -> storage string. Empty or missing vectors stay as they are."""
+    if vec is None or isinstance(vec, str) or len(vec) == 0:
+        return vec
+    q = quantize(vec, codec)
+    data = base64.b64encode(q.codes.astype(CODECS[codec]).tobytes()).decode("ascii")
+    return f"{codec}:{q.scale!r}:{data}"
+
+
+def decode(value):
+    """Storage string, plain list or QuantizedEmbedding -> QuantizedEmbedding (None if empty)."""
+    if value is None or isinstance(value, QuantizedEmbedding):
+        return value
+    if isinstance(value, str):
+        codec, scale, data = value.split(":", 2)
+        return QuantizedEmbedding(np.frombuffer(base64.b64decode(data), dtype=CODECS[codec]), float(scale))
+    if len(value) == 0:
+        return None
+    return QuantizedEmbedding(np.asarray(value, dtype=np.float64), 1.0) # plain lists keep full precision
+
+
+def to_float(value):
+    """Dequantized float32 vector."""
+    q = decode(value)
+    return q.codes.astype(np.float32) * np.float32(q.scale)
+
+
+def as_codes(value):
+    """The stored codes as float64 *without* applying the scale - enough for cosine comparisons."""
+    return decode(value).codes.astype(np.float64)
+
+
+def cosine_distance(a, b):
+    """Cosine distance between two embeddings in any supported representation."""
+    a, b = as_codes(a), as_codes(b)
+    na, nb = np.linalg.norm(a), np.linalg.norm(b)
+    if na < 1e-10 or nb < 1e-10:
+        return 1.0
+    return float(1 - np.dot(a, b) / (na * nb))
+
+
+def encode_student(student, codec=EMBEDDING_STORAGE):
+    """Copy of a student record with its embeddings in storage form (inline: any embedding_ref is dropped)."""
+    out = {k: v for k, v in student.items() if k != "embedding_ref"}
+    out["embedding"] = encode(student.get("embedding"), codec)
+    out["embeddings_list"] = [encode(e, codec) for e in student.get("embeddings_list") or [] if e]
+    return out
+
+
+def decode_student(student):
+    """Copy of a student record with embeddings decoded once (QuantizedEmbedding) for matching."""
+    out = dict(student)
+    out["embedding"] = decode(student.get("embedding"))
+    out["embeddings_list"] = [q for q in (decode(e) for e in student.get("embeddings_list") or []) if q is not None]
+    return out
+
+
+def migrate(store, codec=EMBEDDING_STORAGE):
+    """Re-encode the inline embeddings of every student in store (embedding_ref records are left alone)."""
+    students = store.load_students()
+    inline = [s for s in students if not s.get("embedding_ref") and (s.get("embedding") or s.get("embeddings_list"))]
+    store.update_students([encode_student(s, codec) for s in inline])
+    print(f"{len(inline)} of {len(students)} students re-encoded ({codec})")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "migrate":
+        sys.exit("Usage: python embedding_codec.py migrate [int8|float16|float32]")
+    from storage import get_store
+
+    migrate(get_store(), sys.argv[2] if len(sys.argv) > 2 else EMBEDDING_STORAGE)
@@ -0,0 +1,170 @@
+"""
+Optional shared embedding service.
+
+Without it every gunicorn worker loads its own copy of the SFace model on its first embedding
+request. With EMBEDDING_SERVER=1, gunicorn.conf.py starts this module as one extra process before
+forking workers. That process holds the only model copy and answers batched requests on a Unix
+socket (EMBEDDING_SOCKET); embeddings.embed_faces sends its preprocessed crops there and only
+loads a local model if the server cannot be reached.
+
+Requests from different workers are coalesced: a single batcher thread collects whatever crops
+arrive within EMBEDDING_COALESCE_MS (up to EMBEDDING_BATCH_SIZE) and runs them as one forward pass.
+
+Wire format (network byte order):
+    request:  uint32 n, then n * 112*112*3 uint8 preprocessed images
+    response: uint32 n, uint32 dim, then n * dim float32    (n = 0xFFFFFFFF on error)
+
+Run standalone: python embedding_server.py [socket_path]
+"""
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from embeddings import EMBEDDING_BATCH_SIZE, SFACE_INPUT_SIZE, OpenCVSFaceBackend, get_backend
+
+DEFAULT_SOCKET = "/tmp/smart-attendance-embed.sock"
+COALESCE_MS = float(os.environ.get("EMBEDDING_COALESCE_MS", 5)) # Wait for other workers' crops
+CLIENT_TIMEOUT_S = 120.0
+_ERROR = 0xFFFFFFFF
+_IMAGE_BYTES = SFACE_INPUT_SIZE[0] * SFACE_INPUT_SIZE[1] * 3
+
+
+class _Pending:
+    __slots__ = ("images", "result", "done")
+
+    def __init__(self, images):
+        self.images = images
+        self.result = None
+        self.done = threading.Event()
+
+
+class _Batcher(threading.Thread):
+    """Owns the model; merges queued requests into batches of up to max_batch images."""
+
+    def __init__(self, model, max_batch=EMBEDDING_BATCH_SIZE, coalesce_ms=COALESCE_MS):
+        super().__init__(daemon=True)
+        self.model = model
+        self.max_batch = max_batch
+        self.coalesce_s = coalesce_ms / 1000.0
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+
+    def submit(self, images):
+        pending = _Pending(images)
+        self.requests.put(pending)
+        pending.done.wait()
+        return pending.result
+
+    def run(self):
+        while True:
+            group = [self.requests.get()]
+            n = len(group[0].images)
+            deadline = time.monotonic() + self.coalesce_s
+            while n < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                group.append(item)
+                n += len(item.images)
+            self._run_group(group)
+
+    def _run_group(self, group):
+        images = [img for p in group for img in p.images]
+        try:
+            feats = np.concatenate([
+                self.model.forward(images[i:i + self.max_batch])
+                for i in range(0, len(images), self.max_batch)
+            ], axis=0)
+        except Exception as e:
+            print(f"DEBUG: embedding server forward failed: {e}")
+            feats = None
+        self.batches += 1
+        self.images += len(images)
+        start = 0
+        for p in group:
+            if feats is not None:
+                p.result = feats[start:start + len(p.images)]
+            start += len(p.images)
+            p.done.set()
+
+
+def _read_exact(read, n):
+    data = read(n)
+    if data is None or len(data) != n:
+        raise ConnectionError("short read")
+    return data
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            (n,) = struct.unpack("!I", _read_exact(self.rfile.read, 4))
+            payload = _read_exact(self.rfile.read, n * _IMAGE_BYTES)
+        except ConnectionError:
+            return
+        images = list(np.frombuffer(payload, dtype=np.uint8).reshape(n, *SFACE_INPUT_SIZE, 3))
+        feats = self.server.batcher.submit(images) if n else np.empty((0, 0), np.float32)
+        if feats is None:
+            self.wfile.write(struct.pack("!II", _ERROR, 0))
+            return
+        feats = np.ascontiguousarray(feats, dtype=">f4")
+        self.wfile.write(struct.pack("!II", len(feats), feats.shape[1] if feats.ndim == 2 else 0))
+        self.wfile.write(feats.tobytes())
+
+
+class EmbeddingServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, model):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path) # stale socket from a previous run
+        super().__init__(socket_path, _Handler)
+        self.batcher = _Batcher(model)
+        self.batcher.start()
+
+
+def embed_remote(images, socket_path, timeout=CLIENT_TIMEOUT_S):
+    """Send preprocessed images to the server; returns (N, dim) float32. Raises OSError if the
+    server is unreachable and RuntimeError if it could not embed."""
+    payload = np.ascontiguousarray(np.stack(images), dtype=np.uint8).tobytes()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.sendall(struct.pack("!I", len(images)) + payload)
+        rfile = sock.makefile("rb")
+        n, dim = struct.unpack("!II", _read_exact(rfile.read, 8))
+        if n == _ERROR:
+            raise RuntimeError("embedding server could not embed the batch")
+        data = _read_exact(rfile.read, n * dim * 4)
+    return np.frombuffer(data, dtype=">f4").astype(np.float32).reshape(n, dim)
+
+
+def serve(socket_path=DEFAULT_SOCKET):
+    backend = get_backend()
+    if not isinstance(backend, OpenCVSFaceBackend):
+        sys.exit("Embedding server: needs the OpenCV SFace backend (model file unavailable)")
+    with EmbeddingServer(socket_path, backend.model) as server:
+        print(f"DEBUG: embedding server listening on {socket_path} (pid {os.getpid()})")
+        try:
+            server.serve_forever()
+        finally:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+
+
+if __name__ == "__main__":
+    serve(sys.argv[1] if len(sys.argv) > 1 else os.environ.get("EMBEDDING_SOCKET", DEFAULT_SOCKET))
@@ -0,0 +1,207 @@
+"""
+Binary embedding store, kept apart from the student records.
+
+Student records used to carry their centroid and reference embeddings inline (codec strings or
+float lists), so every request that loads students - class lists, present_students, attendance
+sessions that copy them - parsed and shipped hundreds of numbers per student. Now the vectors
+live in contiguous little-endian float32 matrix files (one per dimension) under
+EMBEDDING_MATRIX_DIR, and a record only keeps a reference to its block of rows:
+
+    "embedding_ref": {"file": "128d-0.f32", "row": 812, "refs": 5, "centroid": true}
+
+Row `row` is the centroid (when "centroid" is true), followed by the `refs` reference rows. Files
+are append-only: new students and refreshed references get a new block, written under an flock so
+gunicorn workers never interleave rows. Readers memory-map the files read-only and get NumPy
+views of the rows (Gallery builds its matrix straight from them); the mapping is extended when
+another worker has appended past it.
+
+Existing records with inline embeddings keep working and are moved into the store with
+
+    python embedding_store.py migrate
+
+Blocks replaced by a refresh stay in the file until `python embedding_store.py compact` (run
+with the server stopped) rewrites the live rows into a new generation file and updates the refs.
+"""
+import os
+import re
+import sys
+import threading
+from pathlib import Path
+
+import numpy as np
+
+from embedding_codec import encode_student, to_float
+
+try:
+    import fcntl
+except ImportError: # Windows: appends are only serialized within this process
+    fcntl = None
+
+DATA_FOLDER = Path(__file__).parent / "data"
+EMBEDDING_MATRIX = os.environ.get("EMBEDDING_MATRIX", "1") != "0" # 0 = keep new embeddings inline (codec strings)
+EMBEDDING_MATRIX_DIR = Path(os.environ.get("EMBEDDING_MATRIX_DIR", DATA_FOLDER / "embeddings"))
+_DTYPE = np.dtype("<f4")
+_FILE_RE = re.compile(r"^(\d+)d-(\d+)\.f32$") # <dim>d-<generation>.f32
+
+
+def _file_name(dim, generation):
+    return f"{dim}d-{generation}.f32"
+
+
+class EmbeddingStore:
+    def __init__(self, folder=EMBEDDING_MATRIX_DIR):
+        self.folder = Path(folder)
+        self._lock = threading.Lock()
+        self._maps = {} # file name -> read-only memmap of the rows written when it was mapped
+        self._current = {} # dim -> file name new blocks are appended to
+
+    def _current_file(self, dim):
+        if dim not in self._current:
+            generations = [int(m.group(2)) for m in map(_FILE_RE.match, os.listdir(self.folder))
+                           if m and int(m.group(1)) == dim] if self.folder.exists() else []
+            self._current[dim] = _file_name(dim, max(generations, default=0))
+        return self._current[dim]
+
+    def append(self, vectors):
+        """Write a (n, dim) block; returns (file name, first row)."""
+        block = np.ascontiguousarray(vectors, dtype=_DTYPE)
+        dim = block.shape[1]
+        row_bytes = dim * _DTYPE.itemsize
+        self.folder.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            name = self._current_file(dim)
+            with open(self.folder / name, "ab") as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                size = os.fstat(f.fileno()).st_size
+                pad = -size % row_bytes # a torn row from a crash is skipped, not continued
+                if pad:
+                    f.write(b"\0" * pad)
+                f.write(block.tobytes())
+                f.flush()
+        return name, (size + pad) // row_bytes
+
+    def _mapped(self, name, min_rows):
+        with self._lock:
+            m = self._maps.get(name)
+            if m is None or len(m) < min_rows:
+                dim = int(_FILE_RE.match(name).group(1))
+                rows = os.path.getsize(self.folder / name) // (dim * _DTYPE.itemsize)
+                if rows < min_rows:
+                    raise ValueError(f"{name} has {rows} rows, reference needs {min_rows}")
+                # Views handed out earlier keep the old mapping alive; it stays valid (append-only)
+                m = self._maps[name] = np.memmap(self.folder / name, dtype=_DTYPE, mode="r", shape=(rows, dim))
+            return m
+
+    def rows(self, ref):
+        """All rows of a block (centroid first when present), as a read-only view."""
+        count = int(ref.get("centroid", False)) + ref["refs"]
+        return self._mapped(ref["file"], ref["row"] + count)[ref["row"]:ref["row"] + count]
+
+    def put(self, centroid, references):
+        """Store one student's vectors; returns the embedding_ref (None when there are none)."""
+        has_centroid = centroid is not None and len(centroid) > 0
+        block = ([centroid] if has_centroid else []) + list(references)
+        if not block:
+            return None
+        name, row = self.append(np.array(block, dtype=np.float32))
+        return {"file": name, "row": int(row), "refs": len(references), "centroid": has_centroid}
+
+    # Student records
+
+    def vectors(self, student):
+        """(centroid or None, (n, dim) references) of a record, stored by reference or inline."""
+        ref = student.get("embedding_ref")
+        if ref:
+            rows = self.rows(ref)
+            return (rows[0] if ref.get("centroid") else None), rows[int(ref.get("centroid", False)):]
+        refs = [to_float(e) for e in student.get("embeddings_list") or [] if e is not None and len(e) > 0]
+        emb = student.get("embedding")
+        centroid = to_float(emb) if emb is not None and len(emb) > 0 else None
+        dim = len(refs[0]) if refs else (len(centroid) if centroid is not None else 0)
+        return centroid, np.array(refs, dtype=np.float32).reshape(len(refs), dim)
+
+    def pack(self, student):
+        """Copy of a record with its inline embeddings moved into the store (replacing any old ref)."""
+        if "embedding" not in student and "embeddings_list" not in student:
+            return dict(student) # already packed
+        out = {k: v for k, v in student.items() if k not in ("embedding", "embeddings_list", "embedding_ref")}
+        centroid, refs = self.vectors(out | {"embedding": student.get("embedding"),
+                                             "embeddings_list": student.get("embeddings_list")})
+        if len(refs) and centroid is not None and len(refs[0]) != len(centroid):
+            centroid = None # centroid from another model than the references: not comparable
+        out["embedding_ref"] = self.put(centroid, refs)
+        return out
+
+    def reference_rows(self, student):
+        """Rows a matcher compares against: the references, or the centroid when there are none."""
+        ref = student["embedding_ref"]
+        rows = self.rows(ref)
+        if ref["refs"]:
+            return rows[int(ref.get("centroid", False)):]
+        return rows
+
+    def compact(self, students):
+        """
+        Rewrite the rows referenced by students into new generation files; returns the updated
+        records and the files that are no longer referenced (callers delete them after saving).
+        """
+        old_files = {s["embedding_ref"]["file"] for s in students if s.get("embedding_ref")}
+        old_files |= {p.name for p in self.folder.glob("*.f32")} if self.folder.exists() else set()
+        with self._lock:
+            for dim in {int(_FILE_RE.match(n).group(1)) for n in old_files if _FILE_RE.match(n)}:
+                generation = int(_FILE_RE.match(self._current_file(dim)).group(2)) + 1
+                self._current[dim] = _file_name(dim, generation)
+        out = []
+        for student in students:
+            ref = student.get("embedding_ref")
+            if ref:
+                student = {**student, "embedding_ref": self.put(*self.vectors(student))}
+            out.append(student)
+        return out, sorted(old_files - set(self._current.values()))
+
+
+def pack_student(student):
+    """A record as it is saved: embeddings in the matrix store, or encoded inline (EMBEDDING_MATRIX=0)."""
+    if EMBEDDING_MATRIX:
+        return get_embedding_store().pack(student)
+    return encode_student(student)
+
+
+def student_vectors(student):
+    """(centroid or None, (n, dim) float32 references) of a record in any storage form."""
+    return get_embedding_store().vectors(student)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store():
+    """The EMBEDDING_MATRIX_DIR store, created once per process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = EmbeddingStore(EMBEDDING_MATRIX_DIR)
+    return _store
+
+
+if __name__ == "__main__":
+    from storage import get_store
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "compact"):
+        sys.exit("Usage: python embedding_store.py migrate|compact")
+    records = get_store()
+    students = records.load_students()
+    store = get_embedding_store()
+    if sys.argv[1] == "migrate":
+        inline = [s for s in students if not s.get("embedding_ref") and (s.get("embedding") or s.get("embeddings_list"))]
+        records.update_students([store.pack(s) for s in inline])
+        print(f"{EMBEDDING_MATRIX_DIR}: moved the embeddings of {len(inline)} of {len(students)} students")
+    else:
+        students, unused = store.compact(students)
+        records.update_students([s for s in students if s.get("embedding_ref")])
+        for name in unused:
+            os.remove(store.folder / name)
+        print(f"{EMBEDDING_MATRIX_DIR}: {len(students)} students rewritten, removed {unused}")
@@ -0,0 +1,320 @@
+"""
+Batched face embeddings (SFace) behind a small backend interface: a backend has a `name` and
+embed(crops, batch_size) -> list aligned with crops, each an embedding (list of floats) or None.
+
+Backends (EMBEDDING_BACKEND):
+    opencv   - OpenCVSFaceBackend: the SFace ONNX model run through cv2.dnn in batches of
+               EMBEDDING_BATCH_SIZE, loaded from a local file (SFACE_MODEL_PATH, default: the file
+               DeepFace downloads to ~/.deepface/weights). Never imports DeepFace / TensorFlow.
+    deepface - DeepFaceBackend: per-crop DeepFace.represent (the original path).
+    auto     - opencv when the model file exists (asking DeepFace to download it otherwise),
+               deepface if that fails. Default.
+
+Both backends run the same weights on the same input: OpenCVSFaceBackend applies exactly the
+preprocessing DeepFace.represent(detector_backend="skip") applies before FaceRecognizerSF, so its
+vectors are directly comparable with the embeddings already stored in students.json and no
+migration is needed (bench_embedding_backends.py checks this when both are installed).
+
+When EMBEDDING_SOCKET is set the forward pass is delegated to the shared embedding server
+(embedding_server.py) instead of loading a backend in this process. Crops already seen are
+answered from the on-disk embedding cache (embedding_cache.py) first.
+
+EmbeddingStream runs embed_faces on a background thread for crops that arrive one at a time
+(tracks as they finalize), so embedding overlaps with video decoding.
+"""
+import logging
+import os
+import queue
+import threading
+
+import cv2
+import numpy as np
+
+from embedding_cache import crop_key, get_cache
+
+EMBEDDING_MODEL = "SFace"
+EMBEDDING_ALIGN = True # Part of the embedding cache key
+EMBEDDING_BATCH_SIZE = int(os.environ.get("EMBEDDING_BATCH_SIZE", 32)) # Crops per forward pass
+SFACE_INPUT_SIZE = (112, 112)
+SFACE_WEIGHTS_FILE = "face_recognition_sface_2021dec.onnx" # Same file DeepFace downloads
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "auto") # opencv | deepface | auto
+
+
+def _sface_weights_path():
+    """SFACE_MODEL_PATH, else where DeepFace keeps the SFace weights (DEEPFACE_HOME or home)."""
+    if os.environ.get("SFACE_MODEL_PATH"):
+        return os.environ["SFACE_MODEL_PATH"]
+    home = os.environ.get("DEEPFACE_HOME") or os.path.expanduser("~")
+    return os.path.join(home, ".deepface", "weights", SFACE_WEIGHTS_FILE)
+
+
+def preprocess_face(crop):
+    """
+    BGR crop -> 112x112 uint8 image laid out exactly as DeepFace feeds FaceRecognizerSF:
+    BGR->RGB flip, aspect-preserving resize, zero padding, then the /255 *255 uint8 round-trip.
+    """
+    img = crop[:, :, ::-1]
+    th, tw = SFACE_INPUT_SIZE
+    factor = min(th / img.shape[0], tw / img.shape[1])
+    img = cv2.resize(img, (int(img.shape[1] * factor), int(img.shape[0] * factor)))
+    d0, d1 = th - img.shape[0], tw - img.shape[1]
+    img = np.pad(img, ((d0 // 2, d0 - d0 // 2), (d1 // 2, d1 - d1 // 2), (0, 0)), "constant")
+    if img.shape[:2] != SFACE_INPUT_SIZE:
+        img = cv2.resize(img, (tw, th))
+    img = img.astype(np.float32)
+    if img.max() > 1:
+        img = img / 255.0
+    return (img * 255).astype(np.uint8)
+
+
+class SFaceBatchModel:
+    """The SFace ONNX graph loaded through cv2.dnn; forward() embeds a whole batch at once."""
+
+    def __init__(self, weights_path):
+        self.net = cv2.dnn.readNetFromONNX(weights_path)
+        self._lock = threading.Lock() # cv2.dnn.Net is not safe to run from several threads
+        self.batched = True
+
+    def forward(self, images):
+        """images: list of preprocess_face() outputs -> (N, 128) float32."""
+        with self._lock:
+            if self.batched:
+                try:
+                    return self._run(images)
+                except cv2.error as e:
+                    # Some exports pin the batch dimension to 1; keep working one image at a time
+                    print(f"DEBUG: batched SFace forward failed ({e}), using batch size 1")
+                    self.batched = False
+            return np.concatenate([self._run([img]) for img in images], axis=0)
+
+    def _run(self, images):
+        # Same blob FaceRecognizerSF.feature() builds: no scaling, no mean, swapRB=True
+        blob = cv2.dnn.blobFromImages(images, 1.0, SFACE_INPUT_SIZE, (0, 0, 0), True, False)
+        self.net.setInput(blob)
+        return self.net.forward().reshape(len(images), -1)
+
+
+def _import_deepface():
+    """Lazy DeepFace import so startup stays cheap on Render; None if unavailable."""
+    try:
+        from deepface import DeepFace
+        return DeepFace
+    except ImportError:
+        print("DEBUG: DeepFace import failed (Lazy Load)")
+    except Exception as e:
+        print(f"DEBUG: DeepFace init failed: {e}")
+    return None
+
+
+class OpenCVSFaceBackend:
+    name = "opencv"
+
+    def __init__(self, weights_path):
+        self.model = SFaceBatchModel(weights_path)
+
+    def embed(self, crops, batch_size):
+        images = [preprocess_face(c) for c in crops]
+        feats = np.concatenate([
+            self.model.forward(images[start:start + batch_size])
+            for start in range(0, len(images), batch_size)
+        ], axis=0)
+        return [f.tolist() for f in feats]
+
+
+class DeepFaceBackend:
+    name = "deepface"
+
+    def __init__(self, DeepFace):
+        self.DeepFace = DeepFace
+
+    def embed(self, crops, batch_size):
+        return [self._represent(c) for c in crops]
+
+    def _represent(self, crop):
+        try:
+            objs = self.DeepFace.represent(
+                img_path=crop,
+                detector_backend="skip", # We already detected/cropped
+                align=EMBEDDING_ALIGN,
+                model_name=EMBEDDING_MODEL, # Much lighter model for Free Tier
+                enforce_detection=False,
+            )
+            if objs:
+                return objs[0]["embedding"]
+        except Exception:
+            pass
+        return None
+
+
+def _create_backend(kind):
+    if kind in ("opencv", "auto"):
+        path = _sface_weights_path()
+        if not os.path.exists(path) and kind == "auto":
+            # Let DeepFace download its weights file the first time
+            DeepFace = _import_deepface()
+            if DeepFace is not None:
+                try:
+                    DeepFace.build_model(EMBEDDING_MODEL)
+                except Exception as e:
+                    print(f"DEBUG: SFace weights download failed: {e}")
+        if os.path.exists(path):
+            try:
+                return OpenCVSFaceBackend(path)
+            except cv2.error as e:
+                print(f"DEBUG: could not load SFace model {path}: {e}")
+        else:
+            print(f"DEBUG: SFace model file not found: {path}")
+        if kind == "opencv":
+            return None
+    DeepFace = _import_deepface()
+    return DeepFaceBackend(DeepFace) if DeepFace is not None else None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+_backend_failed = False
+
+
+def get_backend():
+    """The EMBEDDING_BACKEND backend, created once per process; None if nothing can embed."""
+    global _backend, _backend_failed
+    if _backend is not None or _backend_failed:
+        return _backend
+    with _backend_lock:
+        if _backend is None and not _backend_failed:
+            _backend = _create_backend(EMBEDDING_BACKEND)
+            _backend_failed = _backend is None
+            if _backend is not None:
+                print(f"DEBUG: embedding backend: {_backend.name}")
+    return _backend
+
+
+def embed_faces(crops, batch_size=None, flush=True):
+    """
+    Embed a list of BGR crops. Returns a list aligned with crops holding an embedding (list of
+    floats, as DeepFace returns) or None where the crop could not be embedded.
+    flush=False leaves new cache entries in memory (callers embedding many small batches call
+    flush_cache() once at the end).
+    """
+    batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+    results = [None] * len(crops)
+    valid = [i for i, c in enumerate(crops) if c is not None and c.ndim == 3 and c.size]
+    if not valid:
+        return results
+
+    cache = get_cache()
+    if cache is not None:
+        keys = {i: crop_key(crops[i], EMBEDDING_MODEL, EMBEDDING_ALIGN) for i in valid}
+        for i, emb in zip(valid, cache.get_many([keys[i] for i in valid])):
+            results[i] = emb
+        valid = [i for i in valid if results[i] is None]
+
+    if valid:
+        _compute(crops, valid, results, batch_size)
+
+    if cache is not None:
+        cache.put_many((keys[i], results[i]) for i in valid if results[i] is not None)
+        if flush:
+            flush_cache()
+    return results
+
+
+def flush_cache():
+    """Persist the embedding cache (no-op when disabled or unchanged)."""
+    cache = get_cache()
+    if cache is None:
+        return
+    try:
+        cache.flush()
+    except OSError as e:
+        print(f"DEBUG: embedding cache not saved: {e}")
+    logging.info(f"Embedding cache: {cache.stats()}")
+
+
+def _compute(crops, valid, results, batch_size):
+    """Fill results[i] for every index in valid (embedding server, else the local backend)."""
+    feats = _embed_via_server([preprocess_face(crops[i]) for i in valid]) if os.environ.get("EMBEDDING_SOCKET") else None
+    if feats is not None:
+        embs = [f.tolist() for f in feats]
+    else:
+        backend = get_backend()
+        if backend is None:
+            return
+        embs = backend.embed([crops[i] for i in valid], batch_size)
+    for i, emb in zip(valid, embs):
+        results[i] = emb
+
+
+def _embed_via_server(images):
+    """Embeddings from the shared embedding server (EMBEDDING_SOCKET), or None to embed locally."""
+    from embedding_server import embed_remote
+    try:
+        return embed_remote(images, os.environ["EMBEDDING_SOCKET"])
+    except (OSError, RuntimeError) as e:
+        print(f"DEBUG: embedding server unavailable ({e}), embedding in-process")
+        return None
+
+
+class EmbeddingStream:
+    """
+    submit(key, crop) queues a crop; a background thread embeds full batches and hands each to
+    on_batch(keys, embeddings) (crops that fail are skipped). eager=True embeds whatever is queued
+    as soon as the thread is free instead (lower latency, smaller batches). close() embeds the
+    remainder, waits, persists the embedding cache and returns {key: embedding}.
+    """
+
+    def __init__(self, on_batch=None, batch_size=None, eager=False):
+        self.on_batch = on_batch
+        self.batch_size = max(1, batch_size or EMBEDDING_BATCH_SIZE)
+        self.eager = eager
+        self.embeddings = {}
+        self._queue = queue.Queue()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, key, crop):
+        self._queue.put((key, crop))
+
+    def _run(self):
+        batch = []
+        while True:
+            item = self._queue.get()
+            if item is not None:
+                batch.append(item)
+            while self.eager and item is not None and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    batch.append(item)
+            # Full batches (one forward pass each) unless eager, plus the remainder at close()
+            full = self.eager or len(batch) >= self.batch_size
+            if batch and (item is None or full) and self._error is None:
+                try:
+                    self._process(batch)
+                except Exception as e: # surfaced by close()
+                    self._error = e
+                batch = []
+            if item is None:
+                return
+
+    def _process(self, batch):
+        embs = embed_faces([crop for _, crop in batch], self.batch_size, flush=False)
+        keys, vectors = [], []
+        for (key, _), emb in zip(batch, embs):
+            if emb:
+                self.embeddings[key] = emb
+                keys.append(key)
+                vectors.append(emb)
+        if self.on_batch and keys:
+            self.on_batch(keys, vectors)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        flush_cache()
+        if self._error is not None:
+            raise self._error
+        return self.embeddings
@@ -0,0 +1,261 @@
+"""
+Vectorized gallery matching for attendance.
+
+Gallery L2-normalizes every reference embedding of a class once into one contiguous matrix with a
+row -> student index. match() then scores all probe faces of a video against all references with a
+single matrix multiply and reduces to each probe's nearest student in NumPy, replacing the
+per-probe / per-student / per-reference Python loop of pipeline._match_embedding_to_student.
+
+Reference selection and tie-breaking follow the old loop exactly: a student contributes its
+non-empty embeddings_list entries, or its centroid when embeddings_list is empty; the first
+student (in gallery order) reaching the minimum distance wins. Zero vectors score distance 1.0.
+Records whose vectors live in the binary embedding store (embedding_ref) are read from its
+memory-mapped rows; inline embeddings are decoded as before.
+
+GalleryCache keeps one prepared Gallery per classId in the process, so attendance requests for a
+hot class skip loading the students and building the matrix. Entries are tagged with the storage
+version of the students / classes tables (store.version); any write by any gunicorn worker changes
+it and the next request rebuilds. Writes made by this worker through student_added() /
+class_removed() update the cache in place instead when the SQLite write counters show no other
+write in between (otherwise, and always with JSON files, it is dropped); students_updated() drops
+it after records were rewritten. The all-students gallery (no classId) switches to AnnGallery,
+backed by a persisted IVF-flat index, once it holds ANN_MIN_REFS reference embeddings.
+"""
+import threading
+
+import numpy as np
+
+import ann_index
+from embedding_codec import as_codes
+from embedding_store import get_embedding_store
+
+NO_MATCH_DIST = 999.0 # What the old loop returned when nothing could be compared
+
+
+def _unit_rows(vectors):
+    m = np.array(vectors, dtype=np.float64)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    # Zero vectors become all-zero rows: dot product 0 -> distance 1.0, as _cosine_distance returns
+    return np.divide(m, norms, out=np.zeros_like(m), where=norms >= 1e-10)
+
+
+def _reference_rows(student):
+    if student.get("embedding_ref"):
+        return get_embedding_store().reference_rows(student) # view into the mapped matrix
+    embeddings_list = student.get("embeddings_list", [])
+    candidates = embeddings_list if embeddings_list else [student.get("embedding")]
+    return [as_codes(emb) for emb in candidates if emb is not None and len(emb) > 0]
+
+
+class Gallery:
+    def __init__(self, students):
+        self.students = list(students)
+        blocks, owners = [], []
+        for idx, student in enumerate(self.students):
+            rows = _reference_rows(student)
+            if len(rows):
+                blocks.append(np.asarray(rows, dtype=np.float64))
+                owners.extend([idx] * len(rows))
+        self.row_student = np.array(owners, dtype=np.int64)
+        self.matrix = _unit_rows(np.concatenate(blocks)) if blocks else np.zeros((0, 0))
+        self._index_segments()
+
+    def _index_segments(self):
+        # Rows are grouped by student: segment starts for np.minimum.reduceat
+        self._seg_students, self._seg_starts = np.unique(self.row_student, return_index=True)
+
+    def with_student(self, student):
+        """
+        New Gallery equal to rebuilding with student appended; only the new rows are normalized.
+        Copy-on-write, so requests still matching against this instance are unaffected.
+        """
+        g = type(self).__new__(type(self))
+        g.students = self.students + [student]
+        g.matrix, g.row_student = self.matrix, self.row_student
+        rows = _reference_rows(student)
+        if len(rows):
+            new = _unit_rows(rows)
+            g.matrix = np.vstack([self.matrix, new]) if self.n_refs else new
+            g.row_student = np.concatenate([self.row_student, np.full(len(rows), len(self.students), dtype=np.int64)])
+        g._index_segments()
+        return g
+
+    def __len__(self):
+        return len(self.students)
+
+    @property
+    def n_refs(self):
+        return len(self.row_student)
+
+    def distances(self, probes):
+        """(n_probes, n_students_with_refs) minimum cosine distance per student."""
+        p = _unit_rows([as_codes(e) for e in probes])
+        dist = 1.0 - p @ self.matrix.T
+        return np.minimum.reduceat(dist, self._seg_starts, axis=1)
+
+    def match(self, probes):
+        """
+        Nearest student per probe embedding.
+        Returns (best, dist): best[i] is an index into self.students or -1, dist[i] the distance.
+        """
+        n = len(probes)
+        if n == 0 or self.n_refs == 0:
+            return np.full(n, -1, dtype=np.int64), np.full(n, NO_MATCH_DIST)
+        per_student = self.distances(probes)
+        col = per_student.argmin(axis=1) # first minimum = first student in gallery order
+        return self._seg_students[col], per_student[np.arange(n), col]
+
+    def match_margin(self, probes):
+        """
+        match() plus each probe's margin: distance to the second-nearest student minus distance to
+        the nearest (inf with a single matchable student). Always exact (full matmul).
+        """
+        n = len(probes)
+        if n == 0 or self.n_refs == 0:
+            return np.full(n, -1, dtype=np.int64), np.full(n, NO_MATCH_DIST), np.zeros(n)
+        per_student = self.distances(probes)
+        col = per_student.argmin(axis=1)
+        dist = per_student[np.arange(n), col]
+        if per_student.shape[1] < 2:
+            return self._seg_students[col], dist, np.full(n, np.inf)
+        second = np.partition(per_student, 1, axis=1)[:, 1]
+        return self._seg_students[col], dist, second - dist
+
+    @property
+    def matchable(self):
+        """Indices of the students that have at least one reference embedding."""
+        return self._seg_students
+
+    def student(self, idx):
+        return self.students[idx] if idx >= 0 else None
+
+    def row_keys(self):
+        return [self.students[i]["id"] for i in self.row_student]
+
+
+class AnnGallery(Gallery):
+    """
+    Gallery searched through an IVF-flat index (ann_index.py) instead of the full matmul; used for
+    institution-wide sessions (no classId) once there are ANN_MIN_REFS references.
+    """
+
+    @classmethod
+    def from_gallery(cls, gallery, index_path=None):
+        g = cls.__new__(cls)
+        g.__dict__.update(gallery.__dict__)
+        g.index_path = index_path
+        g.index = ann_index.load_or_build(g.matrix, g.row_keys(), index_path) if g.n_refs else None
+        return g
+
+    def with_student(self, student):
+        g = super().with_student(student)
+        g.index_path = self.index_path
+        n_new = g.n_refs - self.n_refs
+        if n_new == 0:
+            g.index = self.index
+        elif self.index is None:
+            g.index = ann_index.load_or_build(g.matrix, g.row_keys(), self.index_path)
+        else:
+            g.index = self.index.extended(g.matrix[-n_new:])
+            if g.index.needs_retrain():
+                g.index = ann_index.IVFFlatIndex.train(g.matrix)
+            if self.index_path:
+                g.index.save(self.index_path, g.row_keys())
+        return g
+
+    def match(self, probes):
+        n = len(probes)
+        if n == 0 or self.index is None:
+            return np.full(n, -1, dtype=np.int64), np.full(n, NO_MATCH_DIST)
+        rows, dists = self.index.search([as_codes(e) for e in probes])
+        best = np.where(rows >= 0, self.row_student[np.maximum(rows, 0)], -1)
+        return best, np.where(rows >= 0, dists, NO_MATCH_DIST)
+
+
+class GalleryCache:
+    """classId -> prepared Gallery, valid for one version stamp of the data files."""
+
+    def __init__(self, load_students, version, ann_index_path=None):
+        self.load_students = load_students # load_students(class_id=None) -> student records
+        self.version = version # () -> (students stamp, classes stamp), changing with every write
+        self.ann_index_path = ann_index_path # None disables the ANN index for the all-students gallery
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._galleries = {}
+
+    def stamp(self):
+        return self.version()
+
+    def _sync(self, stamp):
+        if stamp != self._stamp:
+            self._galleries.clear()
+            self._stamp = stamp
+
+    def get(self, class_id):
+        """Gallery for class_id (None = all students)."""
+        class_id = class_id or None
+        stamp = self.stamp()
+        with self._lock:
+            self._sync(stamp)
+            gallery = self._galleries.get(class_id)
+            if gallery is not None:
+                self.hits += 1
+                return gallery
+        self.misses += 1
+        gallery = Gallery(self.load_students(class_id))
+        if class_id is None and self.ann_index_path and gallery.n_refs >= ann_index.ANN_MIN_REFS:
+            gallery = AnnGallery.from_gallery(gallery, self.ann_index_path)
+        with self._lock:
+            if self._stamp == stamp:
+                self._galleries[class_id] = gallery
+        return gallery
+
+    def _only_own_write(self, stamp_before, stamp_after, table):
+        """
+        True when the cache was current at stamp_before and stamp_after differs from it by exactly
+        one write to table (0 = students, 1 = classes). Only write counters (SQLite) can tell;
+        file stamps (JSON) never qualify.
+        """
+        if self._stamp != stamp_before or stamp_before is None or stamp_after is None:
+            return False
+        if not all(isinstance(v, int) for v in stamp_before + stamp_after):
+            return False
+        expected = list(stamp_before)
+        expected[table] += 1
+        return list(stamp_after) == expected
+
+    def student_added(self, student, stamp_before):
+        """
+        Called after this worker stored a new student. If that insert is the only write since
+        stamp_before, update the affected galleries in place and adopt the new stamp; otherwise
+        another worker may have written in between and everything is dropped.
+        """
+        stamp_after = self.stamp()
+        with self._lock:
+            if not self._only_own_write(stamp_before, stamp_after, 0):
+                self._galleries.clear()
+                self._stamp = None
+                return
+            for class_id in {student.get("classId") or None, None}:
+                gallery = self._galleries.get(class_id)
+                if gallery is not None:
+                    self._galleries[class_id] = gallery.with_student(student)
+            self._stamp = stamp_after
+
+    def students_updated(self):
+        """Called after this worker rewrote existing student records: drop every prepared gallery."""
+        with self._lock:
+            self._galleries.clear()
+            self._stamp = None
+
+    def class_removed(self, class_id, stamp_before):
+        stamp_after = self.stamp()
+        with self._lock:
+            if not self._only_own_write(stamp_before, stamp_after, 1):
+                self._galleries.clear()
+                self._stamp = None
+                return
+            self._galleries.pop(class_id, None)
+            self._stamp = stamp_after
@@ -0,0 +1,68 @@
+"""gunicorn settings (picked up automatically from the working directory by `gunicorn app:app`)."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+EMBEDDING_SERVER_START_TIMEOUT = float(os.environ.get("EMBEDDING_SERVER_START_TIMEOUT", 60)) # Wait this long for the model to load
+
+_embedding_server = None
+
+
+def _wait_for_socket(socket_path, process, timeout):
+    """True once socket_path accepts a connection; False if the process exits or timeout passes."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and process.poll() is None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(socket_path)
+                return True
+            except OSError:
+                pass
+        time.sleep(0.1)
+    return False
+
+
+def on_starting(server):
+    # EMBEDDING_SERVER=1: one process holds the SFace model for all workers (see embedding_server.py)
+    global _embedding_server
+    if os.environ.get("EMBEDDING_SERVER") != "1":
+        return
+    from embedding_server import DEFAULT_SOCKET
+    socket_path = os.environ.pop("EMBEDDING_SOCKET", DEFAULT_SOCKET) # only exported once the server answers
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_server.py")
+    _embedding_server = subprocess.Popen([sys.executable, script, socket_path])
+    if _wait_for_socket(socket_path, _embedding_server, EMBEDDING_SERVER_START_TIMEOUT):
+        os.environ["EMBEDDING_SOCKET"] = socket_path # inherited by workers
+        server.log.info(f"Embedding server started (pid {_embedding_server.pid}) on {socket_path}")
+    else:
+        if _embedding_server.poll() is None: # still loading after the timeout: no worker will use it
+            _embedding_server.terminate()
+            try:
+                _embedding_server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                _embedding_server.kill()
+                _embedding_server.wait()
+        _embedding_server = None
+        server.log.warning(f"Embedding server not reachable on {socket_path}; workers embed in-process")
+
+
+def on_exit(server):
+    if _embedding_server is not None and _embedding_server.poll() is None:
+        _embedding_server.terminate()
+        _embedding_server.wait(timeout=10)
+
+
+def post_fork(server, worker):
+    # Build face detectors before the worker takes traffic so the first request is not slow
+    try:
+        from detectors import preload_detectors
+        preload_detectors()
+    except Exception as e:
+        server.log.warning(f"Detector preload failed: {e}")
+
+
+def worker_exit(server, worker):
+    from detectors import REGISTRY
+    REGISTRY.close_all()
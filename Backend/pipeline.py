@@ -1,14 +1,27 @@
 """
 Face detection, clustering and registration pipeline based on new_pipeline.ipynb.
-Flow: video -> extract faces (Haar/DeepFace) -> embeddings (DeepFace) -> DBSCAN cluster -> return clusters.
+Flow: video -> extract faces (Haar/DeepFace) -> embeddings (DeepFace) -> online DBSCAN-style clustering -> return clusters.
 """
 import os
 import json
 import base64
 import cv2
+import queue
+import threading
+import multiprocessing
 import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from sklearn.cluster import DBSCAN
+
+from tracker import FaceTracker
+from quality import frontal_from_keypoints, passes as quality_passes, score_face
+from detectors import lease_face_detector, use_mediapipe as _use_mediapipe, detection_confidence
+from embeddings import EmbeddingStream, embed_faces
+from clustering import OnlineClusterer
+from curation import curate_references
+import embedding_codec
+from gallery import AnnGallery, Gallery
 
 # Optional: DeepFace for embeddings (notebook uses VGG-Face)
 # DeepFace is disabled due to compatibility issues
@@ -21,12 +34,29 @@ DEEPFACE_AVAILABLE = True # Assume available, will check inside function
 METRIC = "cosine" # Changing to cosine as it is standard for VGG-Face
 EPS = 0.4 # Slightly looser for cosine
 MIN_SAMPLES = 5
-FRAME_SAMPLE_INTERVAL = 15 # Sample more frequently
+DETECTION_WIDTH = int(os.environ.get("DETECTION_WIDTH", 0)) # Detector input size (longer side, px); 0 = full resolution
+HAAR_MIN_WINDOW = 24 # Haar frontalface cascade window; smaller faces cannot be found
+MEDIAPIPE_MIN_FACE = 20 # Smallest face (px) the full-range MediaPipe model finds reliably
+FRAME_SAMPLE_FPS = 15.0 # Frames analysed per second of video (independent of source fps)
+SEEK_MIN_GAP_S = 2.0 # Seek instead of grabbing when consecutive samples are this far apart
+STALE_TRACK_SECONDS = 1.5 # Close tracks unseen for this long (was 45 frames @ 30fps)
+TRACK_USE_VELOCITY = False # Constant-velocity prediction in the tracker (helps fast pans)
+EXTRACTION_PROCESSES = int(os.environ.get("EXTRACTION_PROCESSES", 1)) # >1 splits long videos into segments
+SEGMENT_MIN_SECONDS = 60 # Never cut segments shorter than this
+EXTRACTION_WORKERS = int(os.environ.get("EXTRACTION_WORKERS", min(4, os.cpu_count() or 1))) # Detection threads
 MAX_FACES = 2000
 ATTENDANCE_COSINE_THRESHOLD = 0.40  # Reverted to 0.40 since 0.30 didn't stop false pos (0.27)
 ATTENDANCE_MIN_VOTES = 1
 ATTENDANCE_MIN_SHARPNESS = 40.0
-FACE_CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+ATTENDANCE_EARLY_EXIT = os.environ.get("ATTENDANCE_EARLY_EXIT", "0") == "1" # Opt-in default for /api/process-attendance-video
+ATTENDANCE_IDLE_STOP_SECONDS = float(os.environ.get("ATTENDANCE_IDLE_STOP_SECONDS", 15)) # Early exit: stop after this long without new faces (0 = off)
+ATTENDANCE_STREAM_BATCH = 8 # Early exit: at most this many crops per embedding/vote batch
+EARLY_EXIT_MIN_VOTES = 2 # Confident votes every student needs before the roster counts as resolved
+EARLY_EXIT_MARGIN = 0.10 # ... each beating the second-nearest student by this much cosine distance
+REGISTRATION_MIN_SHARPNESS = 60.0 # strict_quality detections below this are dropped
+KNOWN_CLUSTER_MIN_FRACTION = 0.5 # Share of a cluster's faces that must match one registered student
+REGISTRATION_CLUSTER_EPS = 0.25 # Tight cosine eps for registration clusters - prevents merging different people
+REGISTRATION_MERGE_EPS = float(os.environ.get("REGISTRATION_MERGE_EPS", 0)) # >0: also join clusters with centroids this close
 
 
 
@@ -36,206 +66,528 @@ import logging
 logging.basicConfig(filename='backend_debug.log', level=logging.DEBUG, 
                     format='%(asctime)s %(levelname)s:%(message)s')
 
-def extract_faces_from_video(video_path, faces_dir, max_faces=MAX_FACES, strict_quality=False, min_track_frames=1):
-    """Extract face crops from video using MediaPipe with Haar Cascade fallback + Simple Tracking."""
-    Path(faces_dir).mkdir(parents=True, exist_ok=True)
-    cap = cv2.VideoCapture(video_path)
-    frame_idx = 0
-    
-    # Tracking state: {track_id: {'center': (cx, cy), 'best_score': float, 'best_file': str, 'frames': int, 'last_seen': int, 'face_w': int}}
-    tracks = {}
-    next_track_id = 0
-    # Tracking parameters
-    MIN_TRACK_FRAMES = min_track_frames # Uses argument now
-    STALE_THRESHOLD = 45 # Close tracks unseen for this many sampled frames
+def _frame_timestamp_ms(cap, frame_idx):
+    """Timestamp of the last grabbed frame. Browser webm uploads report fps=1000, so prefer the
+    container timestamp and only fall back to frame_idx / fps when the backend has none."""
+    t_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+    if t_ms > 0 or frame_idx == 0:
+        return t_ms
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if not fps or fps != fps or fps > 240:
+        fps = 30.0
+    return frame_idx * 1000.0 / fps
 
-    logging.info(f"Starting face extraction for {video_path}")
-    
-    # Try initializing MediaPipe
-    # Check if we are on Render (Free Tier) which is memory constrained
-    IS_RENDER = os.environ.get("RENDER") or os.environ.get("DYNO")
-    
-    # Force Haar Cascade on Render to save RAM (MediaPipe is ~100MB overhead)
-    if IS_RENDER:
-        print("DEBUG: Production environment detected. Forcing Haar Cascade to save memory.")
-        face_detection = None
-    else:
-        try:
-            import mediapipe as mp
-            mp_face_detection = mp.solutions.face_detection
-            confidence = 0.5 if strict_quality else 0.2
-            face_detection = mp_face_detection.FaceDetection(model_selection=1, min_detection_confidence=confidence)
-            print(f"DEBUG: Using MediaPipe for face detection (strict={strict_quality}, conf={confidence})")
-        except Exception as e:
-            print(f"DEBUG: MediaPipe init failed ({e}), falling back to Haar Cascade")
-            face_detection = None
-
-    # Load Haar Cascade if MediaPipe failed
-    face_cascade = None
-    if not face_detection:
-        face_cascade = cv2.CascadeClassifier(FACE_CASCADE_PATH)
-        if face_cascade.empty():
-            print("ERROR: Could not load Haar Cascade XML")
-            return {} # Return empty dict on error
-    
-    detected_faces_metadata = {} # track_id -> best_file
 
-    while cap.isOpened() and len(detected_faces_metadata) < max_faces:
-        ret, frame = cap.read()
+def iter_sampled_frames(cap, sample_fps=FRAME_SAMPLE_FPS, seek_min_gap_s=SEEK_MIN_GAP_S, start_ms=0.0, end_ms=None):
+    """
+    Yield (frame_idx, t_ms, frame) for ~sample_fps frames per second of video time.
+    Skipped frames are only grab()bed (no retrieve / colour conversion); when samples are more
+    than seek_min_gap_s apart we seek by timestamp instead of grabbing through the gap.
+    sample_fps=None (or <= 0) yields every frame. start_ms/end_ms restrict to [start_ms, end_ms).
+    """
+    interval_ms = 1000.0 / sample_fps if sample_fps and sample_fps > 0 else 0.0
+    use_seek = interval_ms >= seek_min_gap_s * 1000.0
+    seek_pending = start_ms > 0
+    next_sample_ms = float(start_ms)
+    last_t_ms = -1.0
+    last_frame_idx = -1
+
+    while cap.isOpened():
+        if seek_pending:
+            seek_pending = False
+            cap.set(cv2.CAP_PROP_POS_MSEC, next_sample_ms)
+            grabbed = cap.grab()
+            if not grabbed or _frame_timestamp_ms(cap, last_frame_idx + 1) <= last_t_ms:
+                # Timestamp seek failed (browser webm reports fps=1000 and has no cues):
+                # rewind to where we were and grab through gaps from now on
+                use_seek = False
+                cap.set(cv2.CAP_PROP_POS_FRAMES, last_frame_idx + 1)
+                grabbed = cap.grab()
+        else:
+            grabbed = cap.grab()
+        if not grabbed:
+            break
+        frame_idx = max(0, int(cap.get(cv2.CAP_PROP_POS_FRAMES)) - 1)
+        t_ms = _frame_timestamp_ms(cap, frame_idx)
+        if end_ms is not None and t_ms >= end_ms:
+            break
+        if t_ms + 0.5 < next_sample_ms:
+            continue
+
+        ret, frame = cap.retrieve()
         if not ret:
             break
-        
-        # Sample every 2nd frame for speed while maintaining good coverage
-        if frame_idx % 2 != 0:
-            frame_idx += 1
+        last_t_ms, last_frame_idx = t_ms, frame_idx
+        # Advance on the sampling grid (not from t_ms) so jittery timestamps do not drift the rate
+        while interval_ms and next_sample_ms <= t_ms + 0.5:
+            next_sample_ms += interval_ms
+        seek_pending = use_seek
+        yield frame_idx, t_ms, frame
+
+
+def _detection_scale(iw, ih, detect_width=None, min_face_px=None, detector_min_face=30):
+    """
+    Factor (<= 1) by which to shrink a frame before running the detector.
+    detect_width: fixed detection resolution (longer frame side in pixels, so portrait phone clips match).
+    min_face_px: adaptive - smallest face (in original pixels) we still need to find; the frame is
+    shrunk until that face reaches the detector's own minimum size.
+    With both set the larger scale wins, so neither limit costs recall.
+    """
+    scales = []
+    if detect_width:
+        scales.append(detect_width / float(max(iw, ih)))
+    if min_face_px:
+        scales.append(detector_min_face / float(min_face_px))
+    if not scales:
+        return 1.0
+    return min(1.0, max(scales))
+
+
+def _detect_faces(frame, face_detection, face_cascade, strict_quality, detect_width=None, min_face_px=None):
+    """Detect faces in a BGR frame -> list of (x, y, w, h, quality) that pass the shape/quality checks.
+    quality is a quality.FaceQuality computed once here and carried through tracking and embedding.
+    Detection may run on a downscaled copy (see _detection_scale); boxes, quality and crops always
+    refer to the original full-resolution frame."""
+    ih, iw, _ = frame.shape
+    current_faces_rects = [] # (x, y, w, h, frontal)
+    # Relaxed parameters
+    min_size = 40 if strict_quality else 30
+    scale = _detection_scale(iw, ih, detect_width, min_face_px, HAAR_MIN_WINDOW if face_cascade is not None else MEDIAPIPE_MIN_FACE)
+    small = frame if scale >= 1.0 else cv2.resize(frame, (max(1, int(iw * scale)), max(1, int(ih * scale))), interpolation=cv2.INTER_AREA)
+
+    if face_detection:
+        # MediaPipe - relative boxes, so they map straight back onto the full-resolution frame
+        rgb_frame = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+        results = face_detection.process(rgb_frame)
+
+        if results.detections:
+            for detection in results.detections:
+                bboxC = detection.location_data.relative_bounding_box
+                x = int(bboxC.xmin * iw)
+                y = int(bboxC.ymin * ih)
+                w = int(bboxC.width * iw)
+                h = int(bboxC.height * ih)
+                frontal = 1.0
+                kp = detection.location_data.relative_keypoints
+                if len(kp) >= 3: # right eye, left eye, nose tip
+                    frontal = frontal_from_keypoints((kp[0].x, kp[0].y), (kp[1].x, kp[1].y), (kp[2].x, kp[2].y))
+                current_faces_rects.append((x, y, w, h, frontal))
+    else:
+        # Haar Cascade
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        scaled_min = max(HAAR_MIN_WINDOW, int(round(min_size * scale)))
+        faces = face_cascade.detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=4, # Lowered from 8
+            minSize=(scaled_min, scaled_min), # Lowered from 50
+            flags=cv2.CASCADE_SCALE_IMAGE
+        )
+        for (x, y, w, h) in faces:
+            current_faces_rects.append((int(x / scale), int(y / scale), int(w / scale), int(h / scale), 1.0))
+
+    detections = []
+    for (x, y, w, h, frontal) in current_faces_rects:
+        # Check aspect ratio
+        if h <= 0:
+            continue
+        aspect_ratio = w / float(h)
+        if aspect_ratio < 0.5 or aspect_ratio > 2.0: # Relaxed from 0.6-1.5
             continue
 
-        try:
-            ih, iw, _ = frame.shape
-            current_faces_rects = [] # (x, y, w, h)
-
-            if face_detection:
-                # MediaPipe
-                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                results = face_detection.process(rgb_frame)
-                
-                if results.detections:
-                    for detection in results.detections:
-                        bboxC = detection.location_data.relative_bounding_box
-                        x = int(bboxC.xmin * iw)
-                        y = int(bboxC.ymin * ih)
-                        w = int(bboxC.width * iw)
-                        h = int(bboxC.height * ih)
-                        current_faces_rects.append((x, y, w, h))
-            else:
-                # Haar Cascade
-                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                # Relaxed parameters
-                min_size = (40, 40) if strict_quality else (30, 30)
-                faces = face_cascade.detectMultiScale(
-                    gray, 
-                    scaleFactor=1.1, 
-                    minNeighbors=4, # Lowered from 8
-                    minSize=min_size, # Lowered from 50
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-                for (x, y, w, h) in faces:
-                     current_faces_rects.append((x, y, w, h))
-            
-            # --- Tracking Updating Logic ---
-            used_track_ids = set()
-            
-            for (x, y, w, h) in current_faces_rects:
-                cx, cy = x + w//2, y + h//2
-                
-                # Check aspect ratio
-                aspect_ratio = w / float(h)
-                if aspect_ratio < 0.5 or aspect_ratio > 2.0: # Relaxed from 0.6-1.5
-                     continue
-
-                # Calculate sharpness
-                x_s, y_s = max(0, x), max(0, y)
-                x_e, y_e = min(iw, x+w), min(ih, y+h)
-                face_img = frame[y_s:y_e, x_s:x_e]
-                
-                if face_img.size == 0: continue
-                
-                gray_face = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-                sharpness = cv2.Laplacian(gray_face, cv2.CV_64F).var()
-                
-                # Removed strict sharpness filter (was < 50.0)
-                # if sharpness < 50.0: continue
-                
-                # STRICT MODE SHARPNESS CHECK
-                if strict_quality and sharpness < 60.0:
-                     continue
+        # Score quality once (sharpness, brightness, contrast, size, pose)
+        x_s, y_s = max(0, x), max(0, y)
+        x_e, y_e = min(iw, x+w), min(ih, y+h)
+        face_img = frame[y_s:y_e, x_s:x_e]
 
-                # Score: prefer sharpest image
-                face_score = sharpness
-                
-                # Match to existing tracks — use adaptive distance based on face size
-                matched_id = None
-                # Adaptive threshold: ~1.5x face width prevents merging adjacent people
-                adaptive_max_dist = max(50, int(w * 1.5))
-                min_d = adaptive_max_dist
-                
-                for tid, tdata in tracks.items():
-                    if tid in used_track_ids: continue
-                    tcx, tcy = tdata['center']
-                    dist = ((cx - tcx)**2 + (cy - tcy)**2)**0.5
-                    if dist < min_d:
-                        min_d = dist
-                        matched_id = tid
-                
-                if matched_id is not None:
-                    # Update track
-                    tracks[matched_id]['center'] = (cx, cy)
-                    tracks[matched_id]['frames'] += 1
-                    tracks[matched_id]['last_seen'] = frame_idx
-                    used_track_ids.add(matched_id)
-                    
-                    # Is this face better?
-                    if face_score > tracks[matched_id]['best_score']:
-                        # Save new best
-                        name = f"track{matched_id}_best.jpg"
-                        
-                        # Process and save
-                        saved, _ = process_face_crop(frame, x, y, w, h, faces_dir, name)
-                        if saved:
-                             tracks[matched_id]['best_score'] = face_score
-                             tracks[matched_id]['best_file'] = name
-                else:
-                    # New track
-                    new_id = next_track_id
-                    next_track_id += 1
-                    
-                    name = f"track{new_id}_best.jpg"
-                    
-                    saved, _ = process_face_crop(frame, x, y, w, h, faces_dir, name)
-                    if saved:
-                        tracks[new_id] = {
-                            'center': (cx, cy),
-                            'best_score': face_score,
-                            'best_file': name,
-                            'frames': 1,
-                            'last_seen': frame_idx,
-                            'face_w': w
-                        }
-                        used_track_ids.add(new_id)
-
-            # Also check if an existing track should NOT match — 
-            # if >1 detection matched same track, keep closest and spawn new tracks for others
-            stale_ids = [tid for tid, tdata in tracks.items() 
-                         if (frame_idx - tdata['last_seen']) > STALE_THRESHOLD 
-                         and tid not in used_track_ids]
-            for tid in stale_ids:
-                # Finalize stale track into results if it has enough frames
-                if tracks[tid]['frames'] >= MIN_TRACK_FRAMES:
-                    detected_faces_metadata[tid] = tracks[tid]['best_file']
-                del tracks[tid]
-                    
+        if face_img.size == 0: continue
+
+        gray_face = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
+        quality = score_face(gray_face, w, h, frontal)
+
+        # STRICT MODE SHARPNESS CHECK
+        if strict_quality and quality.sharpness < REGISTRATION_MIN_SHARPNESS:
+            continue
+
+        detections.append((x, y, w, h, quality))
+    return detections
+
+
+def _iter_frame_detections(video_path, strict_quality, sample_fps, workers, use_mediapipe, start_ms=0.0, end_ms=None,
+                           detect_width=None, min_face_px=None):
+    """
+    Decode -> detect stages. Yields (frame_idx, t_ms, frame, detections) in frame order.
+
+    workers <= 1 runs everything on the calling thread. Otherwise one thread decodes into a
+    bounded queue and a pool of detection threads works on it; each call leases a warm detector
+    from the process-wide registry, so no instance is ever shared between threads.
+    OpenCV/MediaPipe release the GIL so this scales with cores.
+    At most ~2 * workers frames are in flight, which keeps memory flat on long videos.
+    """
+    def detect(frame_idx, frame):
+        try:
+            with lease_face_detector(strict_quality, use_mediapipe) as (face_detection, face_cascade):
+                return _detect_faces(frame, face_detection, face_cascade, strict_quality, detect_width, min_face_px)
         except Exception as e:
             logging.error(f"Frame {frame_idx}: {e}")
-            pass
+            return []
 
-        frame_idx += 1
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if workers <= 1:
+            for frame_idx, t_ms, frame in iter_sampled_frames(cap, sample_fps, start_ms=start_ms, end_ms=end_ms):
+                yield frame_idx, t_ms, frame, detect(frame_idx, frame)
+            return
+
+        frames_q = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+        _DONE = object()
+
+        def decode():
+            try:
+                for item in iter_sampled_frames(cap, sample_fps, start_ms=start_ms, end_ms=end_ms):
+                    while not stop.is_set():
+                        try:
+                            frames_q.put(item, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                logging.error(f"Decode failed for {video_path}: {e}")
+            finally:
+                frames_q.put(_DONE)
+
+        decoder = threading.Thread(target=decode, name="face-decode", daemon=True)
+        decoder.start()
+        in_flight = deque()
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="face-detect")
+        try:
+            while True:
+                item = frames_q.get()
+                if item is _DONE:
+                    break
+                frame_idx, t_ms, frame = item
+                in_flight.append((frame_idx, t_ms, frame, executor.submit(detect, frame_idx, frame)))
+                # Ordered hand-off to the tracking stage; also bounds the number of in-flight frames
+                while len(in_flight) > workers:
+                    frame_idx, t_ms, frame, fut = in_flight.popleft()
+                    yield frame_idx, t_ms, frame, fut.result()
+            while in_flight:
+                frame_idx, t_ms, frame, fut = in_flight.popleft()
+                yield frame_idx, t_ms, frame, fut.result()
+        finally:
+            stop.set()
+            # Unblock the decoder if it is waiting on a full queue, then let it exit
+            while decoder.is_alive():
+                try:
+                    frames_q.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            executor.shutdown(wait=True, cancel_futures=True)
+    finally:
+        cap.release()
+
+
+class EarlyStop:
+    """
+    Early termination of single-process extraction (see _track_faces). request(reason) may be
+    called from any thread; idle_ms > 0 also stops once no new track has started for that long
+    (video time). After extraction, reason / stopped_at_ms tell why and where it ended
+    ("end_of_video", "max_faces", "no_new_faces" or the requested reason).
+    """
 
-    if face_detection:
-        face_detection.close()
-        
-    cap.release()
-    
-    # Collect results — include ALL tracks (even single-frame ones for registration)
-    final_dict = {}
-    for tid, tdata in tracks.items():
-        if tdata['frames'] >= MIN_TRACK_FRAMES:
-             final_dict[tid] = tdata['best_file']
-             
-    logging.info(f"Finished extraction. Found {len(final_dict)} unique tracks (from {next_track_id} total created, {len(tracks)} still active at end).")
-    print(f"DEBUG: Extracted {len(final_dict)} unique tracks (created {next_track_id} total)")
-    return final_dict
-
-def process_face_crop(frame, x, y, w, h, faces_dir, filename):
+    def __init__(self, idle_ms=0):
+        self.idle_ms = idle_ms
+        self.reason = None
+        self.stopped_at_ms = None
+        self._event = threading.Event()
+
+    def request(self, reason):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    def requested(self):
+        return self._event.is_set()
+
+    def finish(self, reason, t_ms):
+        self.reason = reason
+        self.stopped_at_ms = t_ms
+
+
+def _track_faces(video_path, max_faces, strict_quality, min_track_frames, sample_fps, workers,
+                 use_mediapipe, start_ms=0.0, end_ms=None, name_prefix="", detect_width=None, min_face_px=None,
+                 use_velocity=TRACK_USE_VELOCITY, on_track=None, early_stop=None):
+    """
+    Tracking stage over [start_ms, end_ms) of the video. Returns (tracks, next_track_id) where
+    tracks is a list of track records (finalized stale tracks first, then those still active):
+    {'id', 'center', 'first_center', 'first_seen', 'last_seen', 'best_score', 'best_crop', 'best_quality',
+     'best_file', 'frames', 'face_w'}.
+    Nothing is written to disk here; best_file is the name the crop gets if it is persisted.
+    Association is done by tracker.FaceTracker (vectorized cost matrix + optimal assignment).
+    on_track(record) is called for every record as soon as it is final, in the returned order.
+    early_stop (EarlyStop) ends the loop when requested or after its idle time without new tracks
+    and records where and why extraction ended.
+    """
+    tracker = FaceTracker(STALE_TRACK_SECONDS * 1000.0, use_velocity=use_velocity)
+    finished = [] # finalized stale tracks, in closing order
+    n_finalized_ok = 0 # how many of those count towards max_faces
+
+    frames = _iter_frame_detections(video_path, strict_quality, sample_fps, workers, use_mediapipe, start_ms, end_ms,
+                                    detect_width, min_face_px)
+    last_new_ms = None # video time of the latest new track (idle stop)
+    t_ms = start_ms
+    stop_reason = "end_of_video"
+    try:
+        for frame_idx, t_ms, frame, detections in frames:
+            if n_finalized_ok >= max_faces:
+                stop_reason = "max_faces"
+                break
+            if early_stop is not None:
+                if early_stop.requested():
+                    stop_reason = early_stop.reason
+                    break
+                if early_stop.idle_ms and last_new_ms is not None and t_ms - last_new_ms >= early_stop.idle_ms:
+                    stop_reason = "no_new_faces"
+                    break
+
+            try:
+                # --- Tracking Updating Logic ---
+                # Score: prefer sharpest image
+                boxes = [d[:4] for d in detections]
+                scores = [d[4].sharpness for d in detections]
+                for det, tid, is_new, improves in tracker.update(t_ms, boxes, scores):
+                    if is_new:
+                        last_new_ms = t_ms
+                    if not improves:
+                        continue
+                    # Is this face better? Keep it in memory; only the final best is written
+                    x, y, w, h, quality = detections[det]
+                    crop = cut_face_crop(frame, x, y, w, h)
+                    if crop is not None:
+                        tracker.set_best(tid, quality.sharpness, crop, quality)
+                    elif is_new:
+                        tracker.drop(tid)
+
+                # Finalize stale tracks
+                for record in tracker.pop_stale(t_ms):
+                    record['best_file'] = f"{name_prefix}track{record['id']}_best.jpg"
+                    finished.append(record)
+                    if record['frames'] >= min_track_frames:
+                        n_finalized_ok += 1
+                    if on_track:
+                        on_track(record)
+
+            except Exception as e:
+                logging.error(f"Frame {frame_idx}: {e}")
+                pass
+    finally:
+        frames.close()
+    if early_stop is not None:
+        early_stop.finish(stop_reason, t_ms)
+
+    remaining = tracker.pop_all()
+    for record in remaining:
+        record['best_file'] = f"{name_prefix}track{record['id']}_best.jpg"
+        if on_track:
+            on_track(record)
+    return finished + remaining, tracker.next_id
+
+
+def _video_duration_ms(video_path):
+    """Duration from frame count / fps. Both are derived from the container duration, so this holds
+    even for browser webm where fps is reported as 1000."""
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        n_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        cap.release()
+    if not fps or fps != fps or n_frames <= 0:
+        return 0.0
+    return n_frames * 1000.0 / fps
+
+
+def _track_segment(job):
+    """Process-pool entry point: track one time segment (job = _track_faces kwargs) with its own decoder/detector."""
+    tracks, _ = _track_faces(**job)
+    return tracks
+
+
+def _stitch_segment_tracks(segment_tracks, boundaries_ms):
+    """
+    Join tracks that cross segment boundaries. A track still alive at the end of segment k is
+    continued by the nearest track that starts in segment k+1 within the stale window, using the
+    same centre-distance gate as the tracker (max(50, 1.5 * face width)). Returns a flat list of
+    merged track records keeping the best crop of each chain.
+    """
+    stale_ms = STALE_TRACK_SECONDS * 1000.0
+    merged = [] # flat list of records; chains are merged in place
+    open_tracks = [] # records from the previous segment still alive at its end
+    for seg, tracks in enumerate(segment_tracks):
+        boundary = boundaries_ms[seg] # start of this segment
+        starters = [t for t in tracks if t['first_seen'] - boundary <= stale_ms] if seg > 0 else []
+        used = set()
+        continued = {} # id(starter) -> record it continues
+        # Closest pairs first, so two neighbours never swap identities
+        pairs = []
+        for prev in open_tracks:
+            pcx, pcy = prev['center']
+            for t in starters:
+                cx, cy = t['first_center']
+                dist = ((cx - pcx)**2 + (cy - pcy)**2)**0.5
+                if dist < max(50, int(t['face_w'] * 1.5)):
+                    pairs.append((dist, id(prev), prev, t))
+        pairs.sort(key=lambda p: p[0])
+        for dist, prev_key, prev, t in pairs:
+            if prev_key in used or id(t) in continued:
+                continue
+            used.add(prev_key)
+            continued[id(t)] = prev
+
+        end = boundaries_ms[seg + 1] if seg + 1 < len(boundaries_ms) else None
+        next_open = []
+        for t in tracks:
+            prev = continued.get(id(t))
+            if prev is not None:
+                # Extend the earlier record with this segment's part
+                if t['best_score'] > prev['best_score']:
+                    prev['best_score'], prev['best_crop'], prev['best_quality'] = t['best_score'], t['best_crop'], t['best_quality']
+                prev['frames'] += t['frames']
+                prev['center'], prev['last_seen'], prev['face_w'] = t['center'], t['last_seen'], t['face_w']
+                record = prev
+            else:
+                record = dict(t)
+                merged.append(record)
+            if end is not None and end - record['last_seen'] <= stale_ms:
+                next_open.append(record)
+        open_tracks = next_open
+    return merged
+
+
+def _segmented_face_tracks(video_path, processes, max_faces, strict_quality, min_track_frames, sample_fps,
+                           workers, use_mediapipe, detect_width, min_face_px):
+    """
+    Split the video into `processes` time segments, track each in its own process (own decoder,
+    detector and tracker), then stitch tracks across boundaries. Returns merged track records, or
+    None when the video is too short to be worth splitting.
+    """
+    duration_ms = _video_duration_ms(video_path)
+    n_segments = min(processes, int(duration_ms // (SEGMENT_MIN_SECONDS * 1000.0)))
+    if n_segments < 2:
+        return None
+    if workers is None:
+        workers = max(1, EXTRACTION_WORKERS // n_segments)
+
+    boundaries_ms = [duration_ms * i / n_segments for i in range(n_segments)]
+    common = dict(video_path=video_path, max_faces=max_faces, strict_quality=strict_quality,
+                  min_track_frames=min_track_frames, sample_fps=sample_fps, workers=workers,
+                  use_mediapipe=use_mediapipe, detect_width=detect_width, min_face_px=min_face_px)
+    jobs = [
+        dict(common, start_ms=boundaries_ms[i], end_ms=boundaries_ms[i + 1] if i + 1 < n_segments else None,
+             name_prefix=f"seg{i}_")
+        for i in range(n_segments)
+    ]
+    logging.info(f"Segmented extraction of {video_path}: {n_segments} segments x {workers} workers")
+
+    # spawn, not fork: MediaPipe/OpenCV thread pools do not survive fork reliably
+    with ProcessPoolExecutor(max_workers=n_segments, mp_context=multiprocessing.get_context("spawn")) as pool:
+        segment_tracks = list(pool.map(_track_segment, jobs))
+
+    merged = _stitch_segment_tracks(segment_tracks, boundaries_ms)
+    n_created = sum(len(t) for t in segment_tracks)
+    logging.info(f"Stitched {n_created} segment tracks into {len(merged)} tracks ({n_segments} segments).")
+    # Renumber so ids stay unique across segments
+    for i, record in enumerate(merged):
+        record['id'] = i
+    return merged
+
+
+def extract_face_tracks(video_path, faces_dir=None, max_faces=MAX_FACES, strict_quality=False, min_track_frames=1,
+                        sample_fps=FRAME_SAMPLE_FPS, workers=None, processes=None,
+                        detect_width=DETECTION_WIDTH, min_face_px=None, on_track=None, early_stop=None):
+    """
+    Extract face tracks from video using MediaPipe with Haar Cascade fallback + Simple Tracking.
+    Returns the track records (see _track_faces) with at least min_track_frames frames; each carries
+    its sharpest crop in memory as 'best_crop' so the embedding stage never re-reads JPEGs.
+    If faces_dir is given, only those final crops are written there (one JPEG per track).
+
+    Frames are sampled at sample_fps frames per second of video time (see iter_sampled_frames) and
+    detection runs on `workers` threads (default EXTRACTION_WORKERS); tracking stays ordered.
+    processes > 1 (default EXTRACTION_PROCESSES) splits long videos into segments tracked in
+    separate processes and stitched back together.
+    detect_width / min_face_px run detection on a downscaled frame (see _detection_scale).
+    on_track(record) receives each returned track as soon as it is final (while the rest of the
+    video is still being processed; after stitching for segmented extraction).
+    early_stop (EarlyStop) lets the caller end decoding early; it forces single-process extraction.
+    """
+    if faces_dir:
+        Path(faces_dir).mkdir(parents=True, exist_ok=True)
+    if processes is None:
+        processes = EXTRACTION_PROCESSES
+
+    # Tracking parameters
+    MIN_TRACK_FRAMES = min_track_frames # Uses argument now
+
+    logging.info(f"Starting face extraction for {video_path} ({processes} processes, {workers or EXTRACTION_WORKERS} detection workers)")
+
+    use_mediapipe = _use_mediapipe()
+    if not use_mediapipe:
+        print("DEBUG: Production environment detected. Forcing Haar Cascade to save memory.")
+    # Probe once on this thread so we know which backend the workers will get (and fail fast).
+    # Detectors come warm from the registry, so this is free after the first request.
+    with lease_face_detector(strict_quality, use_mediapipe) as (face_detection, face_cascade):
+        if face_detection:
+            print(f"DEBUG: Using MediaPipe for face detection (strict={strict_quality}, conf={detection_confidence(strict_quality)})")
+        elif face_cascade is None:
+            return [] # Return empty list on error
+
+    n_emitted = 0
+    def emit(record):
+        # Only what ends up in final_tracks below (same filter, same order, same cap)
+        nonlocal n_emitted
+        if on_track and record['frames'] >= MIN_TRACK_FRAMES and n_emitted < max_faces:
+            n_emitted += 1
+            on_track(record)
+
+    tracks = None
+    if processes > 1 and early_stop is None:
+        tracks = _segmented_face_tracks(video_path, processes, max_faces, strict_quality, MIN_TRACK_FRAMES,
+                                        sample_fps, workers, use_mediapipe, detect_width, min_face_px)
+        for record in tracks or ():
+            emit(record)
+    if tracks is None:
+        tracks, _ = _track_faces(video_path, max_faces, strict_quality, MIN_TRACK_FRAMES, sample_fps,
+                                 workers or EXTRACTION_WORKERS, use_mediapipe,
+                                 detect_width=detect_width, min_face_px=min_face_px, on_track=emit,
+                                 early_stop=early_stop)
+    n_created = len(tracks)
+
+    # Collect results — include ALL tracks (finalized stale ones + those still active at the end)
+    final_tracks = [t for t in tracks if t['frames'] >= MIN_TRACK_FRAMES][:max_faces]
+    if faces_dir:
+        for t in final_tracks:
+            cv2.imwrite(os.path.join(faces_dir, t['best_file']), t['best_crop'])
+
+    logging.info(f"Finished extraction. Found {len(final_tracks)} unique tracks (from {n_created} total created).")
+    print(f"DEBUG: Extracted {len(final_tracks)} unique tracks (created {n_created} total)")
+    return final_tracks
+
+
+def extract_faces_from_video(video_path, faces_dir, max_faces=MAX_FACES, strict_quality=False, min_track_frames=1,
+                             sample_fps=FRAME_SAMPLE_FPS, workers=None, processes=None,
+                             detect_width=DETECTION_WIDTH, min_face_px=None):
+    """Extract face crops into faces_dir and return {track_id: best_file} (see extract_face_tracks)."""
+    tracks = extract_face_tracks(video_path, faces_dir, max_faces, strict_quality, min_track_frames, sample_fps,
+                                 workers, processes, detect_width, min_face_px)
+    return {t['id']: t['best_file'] for t in tracks}
+
+
+def cut_face_crop(frame, x, y, w, h):
+    """Crop a detection (plus margin) out of the full-resolution frame. Returns a copy that does
+    not pin the frame in memory, or None if the crop is empty / too small."""
     ih, iw, _ = frame.shape
     margin = 20
     x_start = max(0, x - margin)
@@ -244,63 +596,36 @@ def process_face_crop(frame, x, y, w, h, faces_dir, filename):
     y_end = min(ih, y + h + margin)
     
     face_crop = frame[y_start:y_end, x_start:x_end]
-    if face_crop.size == 0: return False, 0.0
+    if face_crop.size == 0: return None
 
     # Check minimum size
     if face_crop.shape[0] < 30 or face_crop.shape[1] < 30:
-        return False, 0.0
-        
-    # Calculate sharpness
-    gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY)
-    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
-
-    path = os.path.join(faces_dir, filename)
-    cv2.imwrite(path, face_crop)
-    return True, sharpness
+        return None
 
+    return face_crop.copy()
 
 
+def encode_face_base64(face_crop):
+    """JPEG-encode an in-memory crop for the API (no temp file)."""
+    ok, buf = cv2.imencode(".jpg", face_crop)
+    return base64.b64encode(buf.tobytes()).decode("utf-8") if ok else None
 def get_embedding_for_face(image_path):
-    """Notebook: DeepFace.represent with model VGG-Face."""
-    # Lazy Import to prevent startup timeout/OOM
-    try:
-        from deepface import DeepFace
-    except ImportError:
-        print("DEBUG: DeepFace import failed (Lazy Load)")
-        return None
-    except Exception as e:
-        print(f"DEBUG: DeepFace init failed: {e}")
+    """Embedding for one face: image_path may be a file path or an in-memory BGR crop.
+    Batch callers should use embeddings.embed_faces directly."""
+    crop = cv2.imread(image_path) if isinstance(image_path, str) else image_path
+    if crop is None:
         return None
-
-    try:
-        objs = DeepFace.represent(
-            img_path=image_path,
-            detector_backend="skip", # We already detected/cropped
-            align=True,
-            model_name="SFace", # Much lighter model for Free Tier
-            enforce_detection=False,
-        )
-        if objs and len(objs) > 0:
-            return objs[0]["embedding"]
-    except Exception as e:
-        # print(f"Error embedding {image_path}: {e}")
-        pass
-    return None
+    return embed_faces([crop], batch_size=1)[0]
 
 
 def get_embeddings_dict(faces_dir, max_faces=1500):
     """Build dict face_filename -> embedding for all faces in faces_dir."""
     files = [f for f in os.listdir(faces_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-    result = {}
     # sort by frame/face index if possible to keep order
     files.sort()
-    
-    for i, f in enumerate(files[:max_faces]):
-        path = os.path.join(faces_dir, f)
-        emb = get_embedding_for_face(path)
-        if emb:
-            result[f] = emb
-    return result
+    files = files[:max_faces]
+    crops = [cv2.imread(os.path.join(faces_dir, f)) for f in files]
+    return {f: emb for f, emb in zip(files, embed_faces(crops)) if emb}
 
 
 def get_embedding_2D_array(dictionary_frame_to_embedding):
@@ -315,20 +640,45 @@ def get_embedding_2D_array(dictionary_frame_to_embedding):
 
 def get_dict_label_to_file(labels, frame_list):
     """Notebook: cluster_id -> list of face filenames."""
-    labels = np.array(labels)
     dict_label_to_file = {}
-    for uid in np.unique(labels):
-        dict_label_to_file[int(uid)] = [
-            frame_list[i] for i in range(len(labels)) if labels[i] == uid
-        ]
-    return dict_label_to_file
+    for label, frame in zip(labels, frame_list):
+        dict_label_to_file.setdefault(int(label), []).append(frame)
+    return dict(sorted(dict_label_to_file.items()))
+
+
+def match_clusters_to_gallery(member_embeddings, gallery, threshold=ATTENDANCE_COSINE_THRESHOLD,
+                              min_fraction=KNOWN_CLUSTER_MIN_FRACTION):
+    """
+    Clusters that are an already registered student: {cluster_id: (student idx, votes, mean dist)}.
+    All member embeddings of all clusters are matched in one Gallery.match call; a cluster is known
+    when at least min_fraction of its members match the same student under threshold.
+    """
+    cluster_ids = list(member_embeddings)
+    sizes = [len(member_embeddings[c]) for c in cluster_ids]
+    best, dist = gallery.match([e for c in cluster_ids for e in member_embeddings[c]])
+    owner = np.repeat(np.arange(len(cluster_ids)), sizes)
+    accepted = (best >= 0) & (dist < threshold)
+    known = {}
+    for k, cid in enumerate(cluster_ids):
+        hits = accepted & (owner == k)
+        if not hits.any():
+            continue
+        students, counts = np.unique(best[hits], return_counts=True)
+        top = counts.argmax()
+        if counts[top] >= min_fraction * sizes[k]:
+            same = hits & (best == students[top])
+            known[cid] = (int(students[top]), int(counts[top]), float(dist[same].mean()))
+    return known
 
 
-def run_pipeline(video_path, output_base_dir, use_deepface=True):
+def run_pipeline(video_path, output_base_dir, use_deepface=True, gallery=None):
     """
     Run full pipeline for REGISTRATION: 
-    extract faces -> embeddings -> DBSCAN -> return clusters with representative face base64.
+    extract faces -> embeddings -> clusters (clustering.OnlineClusterer, streamed during extraction)
+    -> return clusters with representative face base64.
     Now returns multiple embeddings per cluster for better attendance matching.
+    With a gallery (the class's registered students), clusters matching a registered student are
+    returned under "known_students" (with all their embeddings) instead of "clusters".
     """
     video_name = os.path.basename(video_path)
     video_stem = Path(video_name).stem
@@ -338,45 +688,56 @@ def run_pipeline(video_path, output_base_dir, use_deepface=True):
         pass
     os.makedirs(faces_dir, exist_ok=True)
 
-    # 1) Extract faces
-    tracks_dict = extract_faces_from_video(video_path, faces_dir, strict_quality=True, min_track_frames=3)
+    # 1) Extract faces (best crop per track stays in memory; faces_dir only gets the final thumbnails)
+    # 2) Embeddings + clustering run alongside: every usable track is embedded and clustered
+    #    as soon as it closes, so clusters are ready when extraction ends
+    clusterer = OnlineClusterer(REGISTRATION_CLUSTER_EPS)
+    stream = EmbeddingStream(on_batch=clusterer.add) if use_deepface else None
+
+    def on_track(t):
+        # Quality was scored at detection time; skip embeddings for crops we would not keep anyway
+        if quality_passes(t['best_quality'], REGISTRATION_MIN_SHARPNESS):
+            stream.submit(t['best_file'], t['best_crop'])
+
+    try:
+        tracks = extract_face_tracks(video_path, faces_dir, strict_quality=True, min_track_frames=3,
+                                     on_track=on_track if stream else None)
+    finally:
+        dict_embedding = stream.close() if stream else {}
+    usable = [t for t in tracks if quality_passes(t['best_quality'], REGISTRATION_MIN_SHARPNESS)]
+    if usable:
+        tracks = usable
+    elif stream and tracks:
+        # Nothing passed the quality gate: cluster everything rather than leave the teacher nothing to label
+        clusterer = OnlineClusterer(REGISTRATION_CLUSTER_EPS)
+        stream = EmbeddingStream(on_batch=clusterer.add)
+        for t in tracks:
+            stream.submit(t['best_file'], t['best_crop'])
+        dict_embedding = stream.close()
+    tracks_dict = {t['id']: t['best_file'] for t in tracks}
+    crops = {t['best_file']: t['best_crop'] for t in tracks}
     n_faces = len(tracks_dict)
     
     if n_faces == 0:
         return {"faces_detected": 0, "clusters": [], "message": "No faces detected"}
 
-    # 2) Embeddings
-    dict_embedding = {}
     X = []
     frame_list = []
     
     if use_deepface:
-        # DeepFace usage logic
-        frame_list = list(tracks_dict.values())
-        frame_list.sort()
-        
-        for f in frame_list:
-             path = os.path.join(faces_dir, f)
-             emb = get_embedding_for_face(path)
-             if emb:
-                 dict_embedding[f] = emb
-        
-        X, frame_list = get_embedding_2D_array(dict_embedding)
-        
-        metric = METRIC
-        eps = 0.25  # Tight eps for Facenet512 cosine — prevents merging different people
-        min_samples = 1  # Allow single-track clusters (each person might only appear once)
+        frame_list = sorted(dict_embedding)
+        X = [dict_embedding[f] for f in frame_list]
+        # 3) Clusters: connected components of "cosine distance <= eps", identical to
+        #    DBSCAN(eps, min_samples=1, metric="cosine") numbered over the sorted file names
+        if REGISTRATION_MERGE_EPS > 0:
+            merges = clusterer.merge_pass(REGISTRATION_MERGE_EPS)
+            logging.info(f"Cluster merge pass joined {merges} cluster pairs")
+        frame_list, labels = clusterer.labels(order=frame_list)
     else:
         print("DEBUG: DeepFace not available, using Tracks as clusters")
         frame_list = list(tracks_dict.values())
         frame_list.sort()
         X = []
-
-    # 3) DBSCAN
-    if len(X) > 0:
-        db = DBSCAN(eps=eps, min_samples=min_samples, metric=metric).fit(X)
-        labels = db.labels_.tolist()
-    else:
         labels = list(range(len(frame_list)))
 
     # 4) Build cluster_id -> list of filenames
@@ -400,8 +761,10 @@ def run_pipeline(video_path, output_base_dir, use_deepface=True):
 
     # 5) For each cluster: representative face + multiple embeddings
     clusters_out = []
+    member_embeddings = {} # cluster_id -> all member embeddings (for gallery matching)
+    rep_files = {} # cluster_id -> representative face file
 
-    logging.info(f"DBSCAN produced {len([l for l in labels if l != -1])} clustered faces in {len(set(l for l in labels if l != -1))} clusters + {labels.count(-1)} noise faces (included as individual clusters)")
+    logging.info(f"Clustering produced {len([l for l in labels if l != -1])} clustered faces in {len(set(l for l in labels if l != -1))} clusters + {labels.count(-1)} noise faces (included as individual clusters)")
     print(f"DEBUG: {len(unique_labels)} total clusters (incl. noise-as-individual) from {len(frame_list)} face embeddings")
     
     for cid in unique_labels:
@@ -409,7 +772,6 @@ def run_pipeline(video_path, output_base_dir, use_deepface=True):
         if not files:
             continue
         rep_file = files[len(files)//2]
-        rep_path = os.path.join(faces_dir, rep_file)
         
         # Calculate centroid embedding (backward compatible)
         centroid = []
@@ -418,42 +780,49 @@ def run_pipeline(video_path, output_base_dir, use_deepface=True):
              try:
                  cluster_embeddings = [dict_embedding[f] for f in files if f in dict_embedding]
                  if cluster_embeddings:
-                     centroid = np.mean(cluster_embeddings, axis=0).tolist()
-                     # Store top embeddings (up to 5) sorted by distance from centroid
-                     # This gives diverse reference points for matching
-                     centroid_np = np.array(centroid)
-                     scored = []
-                     for emb in cluster_embeddings:
-                         emb_np = np.array(emb)
-                         dist = 1 - np.dot(centroid_np, emb_np) / (np.linalg.norm(centroid_np) * np.linalg.norm(emb_np) + 1e-10)
-                         scored.append((dist, emb))
-                     # Sort by distance to centroid, pick diverse set
-                     scored.sort(key=lambda x: x[0])
-                     # Take closest + some spread
-                     top_n = min(5, len(scored))
-                     embeddings_list = [s[1] for s in scored[:top_n]]
+                     centroid, embeddings_list = curate_references(cluster_embeddings)
+                     member_embeddings[str(cid)] = cluster_embeddings
              except Exception as e:
                  logging.error(f"Embedding error for cluster {cid}: {e}")
         
-        face_base64 = None
-        if os.path.isfile(rep_path):
-            with open(rep_path, "rb") as f:
-                face_base64 = base64.b64encode(f.read()).decode("utf-8")
+        rep_files[str(cid)] = rep_file
         
         clusters_out.append({
             "cluster_id": str(cid),
             "count": len(files),
-            "face_base64": face_base64,
+            "face_base64": None, # filled in below, only for clusters that need labeling
             "embedding": centroid,  # Backward compatible centroid
             "embeddings_list": embeddings_list  # NEW: multiple reference embeddings
         })
 
+    # 6) Incremental registration: clusters that are already registered students of the class are
+    #    reported separately (no thumbnail) so the teacher only labels new faces
+    known_out = []
+    if gallery is not None and gallery.n_refs and member_embeddings:
+        known = match_clusters_to_gallery(member_embeddings, gallery)
+        for c in clusters_out:
+            if c["cluster_id"] in known:
+                idx, votes, dist = known[c["cluster_id"]]
+                student = gallery.student(idx)
+                known_out.append({
+                    "cluster_id": c["cluster_id"],
+                    "count": c["count"],
+                    "student_id": student["id"],
+                    "name": student.get("name"),
+                    "roll_no": student.get("roll_no"),
+                    "votes": votes,
+                    "distance": round(dist, 4),
+                    "embeddings_list": member_embeddings[c["cluster_id"]], # for refreshing the student
+                })
+        clusters_out = [c for c in clusters_out if c["cluster_id"] not in known]
+        print(f"DEBUG: {len(known_out)} clusters matched registered students, {len(clusters_out)} new")
+    for c in clusters_out:
+        c["face_base64"] = encode_face_base64(crops[rep_files[c["cluster_id"]]])
+
     # Fallback: If no clusters found but faces exist
-    if len(clusters_out) == 0 and len(frame_list) > 0:
+    if len(clusters_out) == 0 and len(known_out) == 0 and len(frame_list) > 0:
         for i, fname in enumerate(frame_list[:20]):
-            path = os.path.join(faces_dir, fname)
-            with open(path, "rb") as f:
-                face_base64 = base64.b64encode(f.read()).decode("utf-8")
+            face_base64 = encode_face_base64(crops[fname])
             single_emb = dict_embedding.get(fname, [])
             clusters_out.append({
                 "cluster_id": f"single_{i}",
@@ -463,22 +832,20 @@ def run_pipeline(video_path, output_base_dir, use_deepface=True):
                 "embeddings_list": [single_emb] if single_emb else []
             })
 
-    return {
+    result = {
         "faces_detected": n_faces,
         "unique_faces_registered": len(clusters_out),
         "clusters": clusters_out,
     }
+    if gallery is not None:
+        result["known_students"] = known_out
+    return result
 
 
 def _cosine_distance(emb1, emb2):
-    """Compute cosine distance between two embedding vectors."""
-    emb1 = np.array(emb1)
-    emb2 = np.array(emb2)
-    norm1 = np.linalg.norm(emb1)
-    norm2 = np.linalg.norm(emb2)
-    if norm1 < 1e-10 or norm2 < 1e-10:
-        return 1.0
-    return 1 - np.dot(emb1, emb2) / (norm1 * norm2)
+    """Compute cosine distance between two embedding vectors (lists, codec strings or
+    QuantizedEmbedding; quantized ones are compared on their codes)."""
+    return embedding_codec.cosine_distance(emb1, emb2)
 
 
 def _match_embedding_to_student(emb, known_students):
@@ -487,43 +854,50 @@ def _match_embedding_to_student(emb, known_students):
     Uses multi-embedding matching: checks embeddings_list first (multiple reference points),
     falls back to single centroid embedding.
     Returns (best_student, min_distance) or (None, 999).
+    Matching many probes: build one gallery.Gallery and call match() instead.
     """
-    best_match = None
-    min_dist = 999.0
-    
-    for student in known_students:
-        # Try multi-embedding matching first (more accurate)
-        embeddings_list = student.get("embeddings_list", [])
-        if embeddings_list:
-            for known_emb in embeddings_list:
-                if not known_emb:
-                    continue
-                dist = _cosine_distance(emb, known_emb)
-                if dist < min_dist:
-                    min_dist = dist
-                    best_match = student
-        else:
-            # Fallback to single centroid embedding (backward compatible)
-            known_emb = student.get("embedding")
-            if not known_emb:
-                continue
-            dist = _cosine_distance(emb, known_emb)
-            if dist < min_dist:
-                min_dist = dist
-                best_match = student
-    
-    return best_match, min_dist
+    gallery = Gallery(known_students)
+    best, dists = gallery.match([emb])
+    return gallery.student(int(best[0])), float(dists[0])
 
 
-def recognize_faces_in_video(video_path, known_students, output_base_dir):
+class RosterResolver:
+    """
+    Confident attendance votes while tracks stream in. The roster is resolved once every matchable
+    student of the gallery has min_votes probes under the attendance threshold that beat the
+    runner-up student by at least margin.
+    """
+
+    def __init__(self, gallery, min_votes=EARLY_EXIT_MIN_VOTES, margin=EARLY_EXIT_MARGIN):
+        self.gallery = gallery
+        self.min_votes = min_votes
+        self.margin = margin
+        self.votes = np.zeros(len(gallery), dtype=np.int64)
+
+    def add(self, embeddings):
+        """Count a batch of probe embeddings; returns True once the roster is resolved."""
+        best, dist, margin = self.gallery.match_margin(embeddings)
+        confident = (best >= 0) & (dist < ATTENDANCE_COSINE_THRESHOLD) & (margin >= self.margin)
+        self.votes += np.bincount(best[confident], minlength=len(self.votes))
+        return self.resolved()
+
+    def resolved(self):
+        return bool((self.votes[self.gallery.matchable] >= self.min_votes).all())
+
+
+def recognize_faces_in_video(video_path, known_students, output_base_dir, early_exit=False):
     """
     Attendance Mode:
     1. Extract faces from video.
-    2. Get embeddings (skip blurry crops).
+    2. Get embeddings (skip blurry crops) - streamed while the video is decoded.
     3. Match against known_students using multi-embedding + majority voting.
+       known_students may be a list of student records or a prepared gallery.Gallery.
     4. Return list of present student IDs.
+    early_exit stops decoding once every student is confidently present (RosterResolver; class
+    galleries only) or after ATTENDANCE_IDLE_STOP_SECONDS without new faces. Votes are then
+    counted over the faces seen so far and "stop" reports when and why processing ended.
     """
-    # Lazy import check happens inside get_embedding_for_face now
+    # Lazy import check happens inside embeddings.embed_faces now
     # if not DEEPFACE_AVAILABLE:
     #    return {"error": "DeepFace not available"}
 
@@ -532,70 +906,85 @@ def recognize_faces_in_video(video_path, known_students, output_base_dir):
     data_dir = os.path.join(output_base_dir, "attendance_" + video_stem)
     faces_dir = os.path.join(data_dir, "faces")
     os.makedirs(faces_dir, exist_ok=True)
-    
-    # Extract faces
-    extract_faces_from_video(video_path, faces_dir, max_faces=500, strict_quality=False, min_track_frames=1)
-    
-    # Get embeddings — with sharpness filter for quality
-    dict_embedding = {}
-    files = [f for f in os.listdir(faces_dir) if f.lower().endswith((".jpg", ".jpeg", ".png"))]
-    files.sort()
-    
-    for f in files:
-        path = os.path.join(faces_dir, f)
-        # Check sharpness before computing expensive embedding
-        try:
-            img = cv2.imread(path)
-            if img is None:
-                continue
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
-            if sharpness < ATTENDANCE_MIN_SHARPNESS:
-                logging.debug(f"Skipping blurry face {f} (sharpness={sharpness:.1f})")
-                continue
-        except Exception:
-            continue
-        
-        emb = get_embedding_for_face(path)
-        if emb:
-            dict_embedding[f] = emb
+
+    gallery = known_students if isinstance(known_students, Gallery) else Gallery(known_students)
+    early_stop = EarlyStop(ATTENDANCE_IDLE_STOP_SECONDS * 1000.0) if early_exit else None
+    # Institution-wide (ANN) galleries are never fully resolved; they only get the idle stop
+    roster = RosterResolver(gallery) if early_exit and not isinstance(gallery, AnnGallery) and len(gallery.matchable) else None
+
+    def on_roster_batch(keys, embs):
+        if roster.add(embs):
+            early_stop.request("roster_resolved")
+
+    on_batch = on_roster_batch if roster is not None else None
+
+    # Embeddings are computed as tracks finalize (right away, in small batches, when early exit needs the votes)
+    stream = EmbeddingStream(on_batch=on_batch, batch_size=ATTENDANCE_STREAM_BATCH if early_exit else None,
+                             eager=early_exit)
+
+    def on_track(t):
+        # Check quality before computing expensive embedding (scored once at detection time)
+        q = t['best_quality']
+        if not quality_passes(q, ATTENDANCE_MIN_SHARPNESS):
+            logging.debug(f"Skipping low-quality face {t['best_file']} (sharpness={q.sharpness:.1f}, brightness={q.brightness:.0f}, frontal={q.frontal:.2f})")
+            return
+        stream.submit(t['best_file'], t['best_crop'])
+
+    # Extract faces (crops handed over in memory; faces_dir keeps one thumbnail per track)
+    try:
+        extract_face_tracks(video_path, faces_dir, max_faces=500, strict_quality=False, min_track_frames=1,
+                            on_track=on_track, early_stop=early_stop)
+    finally:
+        embeddings = stream.close()
+    dict_embedding = {f: embeddings[f] for f in sorted(embeddings)}
     
     # --- Majority Voting ---
-    # Count how many face crops match each student
-    vote_counts = {}  # student_id -> count of matching crops
-    vote_dists = {}   # student_id -> list of distances
-    usage_log = []
-    
-    for fname, emb in dict_embedding.items():
-        best_match, min_dist = _match_embedding_to_student(emb, known_students)
-        
-        if best_match and min_dist < ATTENDANCE_COSINE_THRESHOLD:
-            sid = best_match["id"]
-            vote_counts[sid] = vote_counts.get(sid, 0) + 1
-            vote_dists.setdefault(sid, []).append(min_dist)
-            usage_log.append({
-                "face": fname,
-                "match": best_match["name"],
-                "dist": float(min_dist)
-            })
-        
-        # DEBUG: Log all close matches to understand false positives
-        if best_match and min_dist < 0.60:
-             logging.info(f"DEBUG MATCH: Face {fname} matched {best_match['name']} ({best_match['id']}) with dist {min_dist:.4f}")
-    
+    # One matmul scores every probe crop against every reference embedding of the class
+    fnames = list(dict_embedding)
+    best, dists = gallery.match([dict_embedding[f] for f in fnames])
+    accepted = np.flatnonzero((best >= 0) & (dists < ATTENDANCE_COSINE_THRESHOLD))
+
+    # Count how many face crops match each student (in order of first vote)
+    voted, first = np.unique(best[accepted], return_index=True)
+    voted = voted[np.argsort(first)]
+    counts = np.bincount(best[accepted], minlength=len(gallery))
+    dist_sums = np.bincount(best[accepted], weights=dists[accepted], minlength=len(gallery))
+    vote_counts = {gallery.students[i]["id"]: int(counts[i]) for i in voted}  # student_id -> count of matching crops
+    avg_dists = {gallery.students[i]["id"]: dist_sums[i] / counts[i] for i in voted}
+    usage_log = [{
+        "face": fnames[i],
+        "match": gallery.students[best[i]]["name"],
+        "dist": float(dists[i])
+    } for i in accepted]
+
+    # DEBUG: Log all close matches to understand false positives
+    for i in np.flatnonzero((best >= 0) & (dists < 0.60)):
+        match = gallery.students[best[i]]
+        logging.info(f"DEBUG MATCH: Face {fnames[i]} matched {match['name']} ({match['id']}) with dist {dists[i]:.4f}")
+
     # Only mark present if student has >= ATTENDANCE_MIN_VOTES matching crops
-    present_students = set()
+    present_students = []
     for sid, count in vote_counts.items():
         if count >= ATTENDANCE_MIN_VOTES:
-            present_students.add(sid)
-            avg_dist = sum(vote_dists[sid]) / len(vote_dists[sid])
+            present_students.append(sid)
+            avg_dist = avg_dists[sid]
             logging.info(f"Student {sid} marked present: {count} votes, avg_dist={avg_dist:.4f}")
         else:
             logging.info(f"Student {sid} NOT marked present: only {count} vote(s), needs {ATTENDANCE_MIN_VOTES}")
             
-    return {
-        "present_student_ids": list(present_students),
+    result = {
+        "present_student_ids": present_students,
         "total_faces_processed": len(dict_embedding),
         "vote_counts": {sid: cnt for sid, cnt in vote_counts.items()},
+        "avg_distances": {sid: round(float(avg_dists[sid]), 4) for sid in present_students}, # match score per present student
         "logs": usage_log
     }
+    if early_stop is not None:
+        duration_ms = _video_duration_ms(video_path)
+        result["stop"] = {
+            "reason": early_stop.reason,
+            "stopped_at_s": round(early_stop.stopped_at_ms / 1000.0, 2) if early_stop.stopped_at_ms is not None else None,
+            "video_duration_s": round(duration_ms / 1000.0, 2) if duration_ms else None,
+        }
+        logging.info(f"Attendance processing stopped ({early_stop.reason}) at {result['stop']['stopped_at_s']}s of {result['stop']['video_duration_s']}s")
+    return result
@@ -0,0 +1,49 @@
+"""
+Single-pass face quality scoring.
+
+Every detection is scored once, on the detection box in the full-resolution frame, right after
+detection: Laplacian sharpness, brightness, contrast, face size and a cheap frontal-pose estimate.
+The tracker keeps the FaceQuality of each track's best crop, and the registration / attendance
+stages use passes() to drop unusable tracks *before* computing embeddings instead of re-reading
+and re-scoring crops.
+"""
+from collections import namedtuple
+
+import cv2
+
+FaceQuality = namedtuple("FaceQuality", ["sharpness", "brightness", "contrast", "face_size", "frontal"])
+
+MIN_BRIGHTNESS = 30.0 # Mean grey level; darker faces embed badly
+MAX_BRIGHTNESS = 230.0 # Blown-out faces
+MIN_CONTRAST = 10.0 # Grey-level std dev
+MIN_FACE_SIZE = 30 # Shorter box side in px (same floor as the crop size check)
+MIN_FRONTAL = 0.25 # Strong profiles give poor SFace embeddings
+
+
+def frontal_from_keypoints(right_eye, left_eye, nose):
+    """Yaw proxy from MediaPipe keypoints: 1.0 when the nose sits midway between the eyes,
+    falling to 0 when it reaches either eye."""
+    eye_dist = abs(left_eye[0] - right_eye[0])
+    if eye_dist < 1e-6:
+        return 0.0
+    offset = abs(nose[0] - (left_eye[0] + right_eye[0]) / 2.0) / (eye_dist / 2.0)
+    return float(max(0.0, 1.0 - offset))
+
+
+def score_face(gray_face, w, h, frontal=1.0):
+    """FaceQuality for a grey face box. frontal comes from detector keypoints when available; the
+    Haar frontalface cascade only fires on near-frontal faces, so its detections default to 1.0."""
+    sharpness = cv2.Laplacian(gray_face, cv2.CV_64F).var()
+    mean, std = cv2.meanStdDev(gray_face)
+    return FaceQuality(float(sharpness), float(mean[0][0]), float(std[0][0]), int(min(w, h)), float(frontal))
+
+
+def passes(quality, min_sharpness=0.0):
+    """Is this face worth an embedding?"""
+    return (
+        quality.sharpness >= min_sharpness
+        and MIN_BRIGHTNESS <= quality.brightness <= MAX_BRIGHTNESS
+        and quality.contrast >= MIN_CONTRAST
+        and quality.face_size >= MIN_FACE_SIZE
+        and quality.frontal >= MIN_FRONTAL
+    )
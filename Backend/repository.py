@@ -0,0 +1,113 @@
+"""
+Read-through cache of parsed students, classes and attendance sessions with secondary indexes.
+
+The dashboard endpoints used to load and parse every record on every request and then scan them
+(all students to find a roll no's classes, all classes to find those ids). Repository keeps one
+parsed snapshot per table in the process with the indexes those endpoints need:
+
+    students:   id -> student, classId -> students, roll_no -> classIds
+    classes:    id -> class, teacherId -> classes (+ position, to keep class order)
+    attendance: classId -> sessions (filled per class on first request)
+
+so lookups cost O(result size). Like GalleryCache, each snapshot is tagged with the store's version
+of its table (SQLite version counter, file mtime for JSON, log position for the attendance log); a
+write by any gunicorn worker changes it and the next read reloads that table. Returned records are shared between requests - callers copy before modifying them.
+"""
+import threading
+
+
+class _Snapshot:
+    def __init__(self, stamp, records):
+        self.stamp = stamp
+        self.records = records
+
+
+class Repository:
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._snapshots = {} # table -> _Snapshot
+        self._attendance = {} # classId -> sessions, valid for self._attendance_stamp
+        self._attendance_stamp = None
+
+    def _snapshot(self, table, build):
+        stamp = self.store.version(table)
+        snapshot = self._snapshots.get(table)
+        if snapshot is not None and snapshot.stamp == stamp:
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        snapshot = build(stamp)
+        with self._lock:
+            self._snapshots[table] = snapshot
+        return snapshot
+
+    def _students(self):
+        def build(stamp):
+            snapshot = _Snapshot(stamp, self.store.load_students())
+            snapshot.by_id, snapshot.by_class, snapshot.class_ids_by_roll = {}, {}, {}
+            for s in snapshot.records:
+                snapshot.by_id[s.get("id")] = s
+                snapshot.by_class.setdefault(s.get("classId"), []).append(s)
+                snapshot.class_ids_by_roll.setdefault(s.get("roll_no"), set()).add(s.get("classId"))
+            return snapshot
+        return self._snapshot("students", build)
+
+    def _classes(self):
+        def build(stamp):
+            snapshot = _Snapshot(stamp, self.store.load_classes())
+            snapshot.by_id, snapshot.by_teacher, snapshot.position = {}, {}, {}
+            for n, c in enumerate(snapshot.records):
+                snapshot.by_id[c.get("id")] = c
+                snapshot.position[c.get("id")] = n
+                snapshot.by_teacher.setdefault(c.get("teacherId"), []).append(c)
+            return snapshot
+        return self._snapshot("classes", build)
+
+    # students
+
+    def students(self, class_id=None):
+        snapshot = self._students()
+        return list(snapshot.by_class.get(class_id, [])) if class_id else list(snapshot.records)
+
+    def student(self, student_id):
+        return self._students().by_id.get(student_id)
+
+    def class_ids_for_roll_no(self, roll_no):
+        return set(self._students().class_ids_by_roll.get(roll_no, ()))
+
+    # classes
+
+    def classes(self, teacher_id=None):
+        snapshot = self._classes()
+        return list(snapshot.by_teacher.get(teacher_id, [])) if teacher_id else list(snapshot.records)
+
+    def classes_for_roll_no(self, roll_no):
+        """Classes the student with this roll no is enrolled in (in class order)."""
+        snapshot = self._classes()
+        found = [i for i in self.class_ids_for_roll_no(roll_no) if i in snapshot.by_id]
+        return [snapshot.by_id[i] for i in sorted(found, key=snapshot.position.get)]
+
+    # attendance
+
+    def attendance(self, class_id=None):
+        """Sessions of a class (cached per class), or all sessions (not cached) when class_id is None."""
+        if not class_id:
+            return self.store.load_attendance()
+        stamp = self.store.version("attendance")
+        with self._lock:
+            if stamp != self._attendance_stamp:
+                self._attendance.clear()
+                self._attendance_stamp = stamp
+            sessions = self._attendance.get(class_id)
+        if sessions is not None:
+            self.hits += 1
+            return list(sessions)
+        self.misses += 1
+        sessions = self.store.load_attendance(class_id)
+        with self._lock:
+            if self._attendance_stamp == stamp:
+                self._attendance[class_id] = sessions
+        return list(sessions)
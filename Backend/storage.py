@@ -0,0 +1,431 @@
+"""
+Persistence for students, classes, attendance sessions and registrations.
+
+app.py used to load a whole JSON file, change a list and rewrite the file (indent=2) on every
+request, with nothing stopping two gunicorn workers from overwriting each other. The app now goes
+through a store (STORAGE_BACKEND):
+
+    sqlite - SqliteStore (default): one SQLite database (DATABASE_PATH, data/smart_attendance.db)
+             in WAL mode. Each record is a row (the original JSON document plus indexed columns:
+             classId, roll_no, teacherId), so writes are single-row inserts/updates whose cost
+             does not grow with attendance history, and workers are serialized by SQLite's lock.
+    json   - JsonStore: the original data/*.json files, whole-file rewrites (no migration needed).
+
+Both keep insertion order and return the same plain dicts (as stored in the JSON files) and have
+the same methods: load_/save_ students, classes, attendance and registrations, insert_student
+(False when the roll_no already exists in that class), update_students, class_ids_for_roll_no,
+insert_class (assigns the id with next_class_id and returns the record), delete_class,
+insert_attendance, put_/get_registration and version. A per-table version counter (bumped in the
+same transaction as every write) tells caches in other workers that data changed.
+
+A new database is filled from data/*.json automatically the first time it is opened; the import
+can also be run by hand (JSON files are left untouched):
+
+    python storage.py import [data_dir] [--force]
+
+Attendance sessions (ATTENDANCE_BACKEND) stay in the store above by default. With
+ATTENDANCE_BACKEND=log they go to the append-only attendance log instead (attendance_log.py: O(1)
+appends, per-class offset index), which is filled once from the store's attendance on first use.
+From then on the log is the only copy that is written: the store's attendance is left as it was,
+and `import` writes sessions to the log only.
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from pathlib import Path
+
+DATA_FOLDER = Path(__file__).parent / "data"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite") # sqlite | json
+DATABASE_PATH = Path(os.environ.get("DATABASE_PATH", DATA_FOLDER / "smart_attendance.db"))
+SQLITE_BUSY_TIMEOUT_MS = 10000 # Wait this long for another worker's write lock
+ATTENDANCE_BACKEND = os.environ.get("ATTENDANCE_BACKEND", "store") # store | log
+
+# table -> (JSON file, indexed columns: column -> record key)
+TABLES = {
+    "students": ("students.json", {"class_id": "classId", "roll_no": "roll_no"}),
+    "classes": ("classes.json", {"teacher_id": "teacherId"}),
+    "attendance": ("attendance.json", {"class_id": "classId"}),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (seq INTEGER PRIMARY KEY, id TEXT UNIQUE, class_id TEXT, roll_no TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS students_class ON students (class_id, roll_no);
+CREATE INDEX IF NOT EXISTS students_roll ON students (roll_no);
+CREATE TABLE IF NOT EXISTS classes (seq INTEGER PRIMARY KEY, id TEXT UNIQUE, teacher_id TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS classes_teacher ON classes (teacher_id);
+CREATE TABLE IF NOT EXISTS attendance (seq INTEGER PRIMARY KEY, id TEXT UNIQUE, class_id TEXT, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS attendance_class ON attendance (class_id);
+CREATE TABLE IF NOT EXISTS registrations (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+INSERT OR IGNORE INTO versions VALUES ('students', 0), ('classes', 0), ('attendance', 0), ('registrations', 0);
+"""
+
+
+def next_class_id(classes):
+    """New class id: C{count + 201} (mock data uses C101-C103), bumped past ids already taken."""
+    taken = {c.get("id") for c in classes}
+    new_id = f"C{len(classes) + 201}"
+    while new_id in taken:
+        new_id = f"C{int(new_id[1:]) + 1}"
+    return new_id
+
+
+class JsonStore:
+    """The original whole-file JSON storage in data_dir."""
+
+    def __init__(self, data_dir=DATA_FOLDER):
+        self.data_dir = Path(data_dir)
+        self._lock = threading.Lock() # serializes read-modify-write within this process only
+
+    def _path(self, name):
+        return self.data_dir / name
+
+    def _load(self, name, default):
+        path = self._path(name)
+        if not path.exists():
+            return default
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return default
+
+    def _save(self, name, data):
+        with open(self._path(name), "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+
+    def load_students(self, class_id=None):
+        students = self._load("students.json", [])
+        return [s for s in students if s.get("classId") == class_id] if class_id else students
+
+    def save_students(self, students):
+        self._save("students.json", students)
+
+    def insert_student(self, student):
+        with self._lock:
+            students = self.load_students()
+            if any(s.get("roll_no") == student.get("roll_no") and s.get("classId") == student.get("classId") for s in students):
+                return False
+            students.append(student)
+            self.save_students(students)
+        return True
+
+    def update_students(self, updated):
+        by_id = {s["id"]: s for s in updated}
+        with self._lock:
+            self.save_students([by_id.get(s.get("id"), s) for s in self.load_students()])
+
+    def class_ids_for_roll_no(self, roll_no):
+        return {s.get("classId") for s in self.load_students() if s.get("roll_no") == roll_no}
+
+    def load_classes(self, teacher_id=None):
+        classes = self._load("classes.json", [])
+        return [c for c in classes if c.get("teacherId") == teacher_id] if teacher_id else classes
+
+    def save_classes(self, classes):
+        self._save("classes.json", classes)
+
+    def insert_class(self, record):
+        with self._lock:
+            classes = self.load_classes()
+            record = {"id": next_class_id(classes), **record}
+            classes.append(record)
+            self.save_classes(classes)
+        return record
+
+    def delete_class(self, class_id):
+        with self._lock:
+            classes = self.load_classes()
+            kept = [c for c in classes if c.get("id") != class_id]
+            if len(kept) == len(classes):
+                return False
+            self.save_classes(kept)
+        return True
+
+    def load_attendance(self, class_id=None):
+        records = self._load("attendance.json", [])
+        return [r for r in records if r.get("classId") == class_id] if class_id else records
+
+    def save_attendance(self, records):
+        self._save("attendance.json", records)
+
+    def insert_attendance(self, record):
+        with self._lock:
+            records = self.load_attendance()
+            records.append(record)
+            self.save_attendance(records)
+
+    def load_registrations(self):
+        return self._load("registrations.json", {})
+
+    def save_registrations(self, registrations):
+        self._save("registrations.json", registrations)
+
+    def put_registration(self, key, record):
+        with self._lock:
+            registrations = self.load_registrations()
+            registrations[key] = record
+            self.save_registrations(registrations)
+
+    def get_registration(self, key):
+        return self.load_registrations().get(key)
+
+    def version(self, *tables):
+        """mtime / size / inode of the tables' files (changes with any write by any process)."""
+        out = []
+        for table in tables:
+            try:
+                st = os.stat(self._path(TABLES[table][0] if table in TABLES else f"{table}.json"))
+                out.append((st.st_mtime_ns, st.st_size, st.st_ino))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+
+class SqliteStore:
+    """Row-per-record storage in one SQLite database (WAL, one connection per thread)."""
+
+    def __init__(self, path=DATABASE_PATH, import_from=None):
+        self.path = Path(path)
+        self._local = threading.local()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if import_from is not None and not self.path.exists():
+            self._create_from_json(import_from)
+        self._conn().executescript(SCHEMA)
+
+    def _create_from_json(self, data_dir):
+        # Built under a temporary name and linked into place, so concurrently starting workers
+        # never see a half-imported database (the loser of the race just discards its copy)
+        tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        staging = SqliteStore(tmp)
+        counts = import_json(staging, data_dir)
+        staging.close()
+        try:
+            os.link(tmp, self.path)
+            print(f"DEBUG: created {self.path}, imported {counts} from {data_dir}")
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp)
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def _conn(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.path), timeout=SQLITE_BUSY_TIMEOUT_MS / 1000.0, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL") # WAL: durable at checkpoints, never corrupt
+            self._local.db = db
+        return db
+
+    class _Transaction:
+        def __init__(self, db):
+            self.db = db
+
+        def __enter__(self):
+            # IMMEDIATE takes the write lock up front, so check-then-insert is atomic across workers
+            self.db.execute("BEGIN IMMEDIATE")
+            return self.db
+
+        def __exit__(self, exc_type, exc, tb):
+            self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+            return False
+
+    def _write(self):
+        return self._Transaction(self._conn())
+
+    @staticmethod
+    def _bump(db, table):
+        db.execute("UPDATE versions SET version = version + 1 WHERE name = ?", (table,))
+
+    def _select(self, table, where="", args=()):
+        rows = self._conn().execute(f"SELECT data FROM {table} {where} ORDER BY seq", args)
+        return [json.loads(data) for (data,) in rows]
+
+    @staticmethod
+    def _row(table, record):
+        columns = TABLES[table][1]
+        return [record.get("id")] + [record.get(key) for key in columns.values()] + [json.dumps(record)]
+
+    def _insert(self, db, table, records):
+        columns = ["id"] + list(TABLES[table][1]) + ["data"]
+        db.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                       [self._row(table, r) for r in records])
+        self._bump(db, table)
+
+    def _replace_all(self, table, records):
+        with self._write() as db:
+            db.execute(f"DELETE FROM {table}")
+            self._insert(db, table, records)
+
+    # students
+    def load_students(self, class_id=None):
+        return self._select("students", "WHERE class_id = ?", (class_id,)) if class_id else self._select("students")
+
+    def save_students(self, students):
+        self._replace_all("students", students)
+
+    def insert_student(self, student):
+        with self._write() as db:
+            dup = db.execute("SELECT 1 FROM students WHERE class_id IS ? AND roll_no IS ? LIMIT 1",
+                             (student.get("classId"), student.get("roll_no"))).fetchone()
+            if dup:
+                return False
+            self._insert(db, "students", [student])
+        return True
+
+    def update_students(self, students):
+        with self._write() as db:
+            db.executemany("UPDATE students SET class_id = ?, roll_no = ?, data = ? WHERE id = ?",
+                           [(s.get("classId"), s.get("roll_no"), json.dumps(s), s["id"]) for s in students])
+            self._bump(db, "students")
+
+    def class_ids_for_roll_no(self, roll_no):
+        rows = self._conn().execute("SELECT DISTINCT class_id FROM students WHERE roll_no = ?", (roll_no,))
+        return {class_id for (class_id,) in rows}
+
+    # classes
+    def load_classes(self, teacher_id=None):
+        return self._select("classes", "WHERE teacher_id = ?", (teacher_id,)) if teacher_id else self._select("classes")
+
+    def save_classes(self, classes):
+        self._replace_all("classes", classes)
+
+    def insert_class(self, record):
+        with self._write() as db:
+            ids = [{"id": i} for (i,) in db.execute("SELECT id FROM classes")]
+            record = {"id": next_class_id(ids), **record}
+            self._insert(db, "classes", [record])
+        return record
+
+    def delete_class(self, class_id):
+        with self._write() as db:
+            deleted = db.execute("DELETE FROM classes WHERE id = ?", (class_id,)).rowcount
+            if deleted:
+                self._bump(db, "classes")
+        return deleted > 0
+
+    # attendance
+    def load_attendance(self, class_id=None):
+        return self._select("attendance", "WHERE class_id = ?", (class_id,)) if class_id else self._select("attendance")
+
+    def save_attendance(self, records):
+        self._replace_all("attendance", records)
+
+    def insert_attendance(self, record):
+        with self._write() as db:
+            self._insert(db, "attendance", [record])
+
+    # registrations (keyed documents)
+    def load_registrations(self):
+        rows = self._conn().execute("SELECT key, data FROM registrations ORDER BY rowid")
+        return {key: json.loads(data) for key, data in rows}
+
+    def save_registrations(self, registrations):
+        with self._write() as db:
+            db.execute("DELETE FROM registrations")
+            db.executemany("INSERT INTO registrations VALUES (?, ?)",
+                           [(k, json.dumps(v)) for k, v in registrations.items()])
+            self._bump(db, "registrations")
+
+    def put_registration(self, key, record):
+        with self._write() as db:
+            db.execute("INSERT OR REPLACE INTO registrations VALUES (?, ?)", (key, json.dumps(record)))
+            self._bump(db, "registrations")
+
+    def get_registration(self, key):
+        row = self._conn().execute("SELECT data FROM registrations WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def version(self, *tables):
+        versions = dict(self._conn().execute("SELECT name, version FROM versions"))
+        return tuple(versions.get(t) for t in tables)
+
+
+class LogAttendanceStore:
+    """A store whose attendance sessions live in an AttendanceLog; everything else goes to base."""
+
+    def __init__(self, base, log):
+        self.base = base
+        self.log = log
+        if not log.exists() and log.create(base.load_attendance()):
+            print(f"DEBUG: created attendance log {log.folder}")
+
+    def __getattr__(self, name):
+        return getattr(self.base, name)
+
+    def load_attendance(self, class_id=None):
+        return self.log.read(class_id)
+
+    def save_attendance(self, records):
+        self.log.replace_all(records)
+
+    def insert_attendance(self, record):
+        self.log.append(record)
+
+    def version(self, *tables):
+        base = self.base.version(*tables)
+        return tuple(self.log.version() if t == "attendance" else v for t, v in zip(tables, base))
+
+
+def import_json(store, data_dir=DATA_FOLDER):
+    """Copy data_dir/*.json into store (replacing what it holds). Returns {table: rows}."""
+    source = JsonStore(data_dir)
+    students, classes = source.load_students(), source.load_classes()
+    attendance, registrations = source.load_attendance(), source.load_registrations()
+    store.save_students(students)
+    store.save_classes(classes)
+    store.save_attendance(attendance)
+    store.save_registrations(registrations)
+    return {"students": len(students), "classes": len(classes), "attendance": len(attendance),
+            "registrations": len(registrations)}
+
+
+def create_store(kind=STORAGE_BACKEND, attendance=ATTENDANCE_BACKEND):
+    if kind == "json":
+        store = JsonStore(DATA_FOLDER)
+    elif kind == "sqlite":
+        store = SqliteStore(DATABASE_PATH, import_from=DATA_FOLDER)
+    else:
+        raise ValueError(f"Unknown STORAGE_BACKEND: {kind}")
+    if attendance == "log":
+        from attendance_log import AttendanceLog
+        return LogAttendanceStore(store, AttendanceLog())
+    if attendance != "store":
+        raise ValueError(f"Unknown ATTENDANCE_BACKEND: {attendance}")
+    return store
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """The STORAGE_BACKEND store, created once per process."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = create_store()
+    return _store
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--force"]
+    if not args or args[0] != "import":
+        sys.exit("Usage: python storage.py import [data_dir] [--force]")
+    data_dir = Path(args[1]) if len(args) > 1 else DATA_FOLDER
+    store = SqliteStore(DATABASE_PATH)
+    if ATTENDANCE_BACKEND == "log": # sessions are imported into the log, not the attendance table
+        from attendance_log import AttendanceLog
+        store = LogAttendanceStore(store, AttendanceLog())
+    if (any(store.version(t)[0] for t in ("students", "classes")) or store.load_attendance()) and "--force" not in sys.argv:
+        sys.exit(f"{DATABASE_PATH} already has data; use --force to replace it")
+    print(f"{DATABASE_PATH}: imported {import_json(store, data_dir)} from {data_dir}")
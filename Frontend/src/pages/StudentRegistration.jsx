@@ -40,6 +40,7 @@ export function StudentRegistration() {
 
         const formData = new FormData();
         formData.append('video', file);
+        formData.append('classId', classId); // Already registered students are recognised, not re-listed
 
         try {
             const response = await fetch(`${API_URL}/api/process-register-video`, {
@@ -333,11 +334,18 @@ export function StudentRegistration() {
                                         </div>
                                     ))}
 
-                                    {results.clusters.length === 0 && (
+                                    {results.clusters.length === 0 && !results.known_students?.length && (
                                         <div className="col-span-full text-center py-8 text-gray-500">
                                             No clear faces detected. Try a better video.
                                         </div>
                                     )}
+
+                                    {results.known_students?.length > 0 && (
+                                        <div className="col-span-full text-sm text-gray-600 bg-gray-50 rounded-lg p-3">
+                                            <span className="font-medium">Already registered (reference faces updated): </span>
+                                            {results.known_students.map(s => `${s.name} (${s.roll_no})`).join(', ')}
+                                        </div>
+                                    )}
                                 </div>
                             )}
                         </Card.Content>